@@ -0,0 +1,71 @@
+"""Compare the JSON encoders available to percy.json_codec on snapshot-shaped
+payloads of roughly 5, 20 and 50 MB.
+
+    python benchmarks/bench_json_encoding.py [--repeat N]
+
+Each payload mimics a responsive snapshot: several widths of serialized HTML
+with non-ASCII text, base64 resources and CORS iframe snapshots.
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from percy import json_codec  # pylint: disable=wrong-import-position
+
+
+def build_payload(target_mb, widths=(375, 768, 1280, 1920)):
+    per_width = target_mb * 1024 * 1024 // len(widths)
+    row = '<div class="card" data-percy-element-id="_x1">Prix: 12,50 € — ok</div>\n'
+    html = row * (per_width // 2 // len(row.encode('utf-8')))
+    blob = base64.b64encode(os.urandom(per_width // 4)).decode('ascii')
+    return {
+        'name': f'{target_mb}MB snapshot',
+        'url': 'http://localhost:8000/',
+        'dom_snapshot': [{
+            'html': html,
+            'width': width,
+            'cookies': [{'name': 'session', 'value': 'abc', 'domain': 'localhost'}],
+            'resources': [{'url': f'http://localhost:8000/img-{width}.png',
+                           'content': blob, 'mimetype': 'image/png'}],
+            'corsIframes': [{'iframeData': {'percyElementId': '_f1'},
+                             'frameUrl': 'https://ads.example.net/',
+                             'iframeSnapshot': {'html': html[:len(html) // 20]}}],
+        } for width in widths],
+    }
+
+
+def measure(encoder, payload, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        encoded = encoder(payload)
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    encoder(payload)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, len(encoded), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5, 20, 50])
+    args = parser.parse_args()
+
+    print(f'{"payload":>8} {"encoder":>8} {"seconds":>8} {"MB/s":>8} {"out MB":>8} {"peak MB":>8}')
+    for size in args.sizes:
+        payload = build_payload(size)
+        for name in json_codec.available_encoders():
+            seconds, length, peak = measure(json_codec.ENCODERS[name], payload, args.repeat)
+            print(f'{size:>6}MB {name:>8} {seconds:>8.3f} {length / 2**20 / seconds:>8.0f} '
+                  f'{length / 2**20:>8.1f} {peak / 2**20:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
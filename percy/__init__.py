@@ -10,7 +10,7 @@ except ImportError:
 
 # import snapshot command
 try:
-    from percy.snapshot import percy_snapshot
+    from percy.snapshot import percy_snapshot, flush, async_uploads
 except ImportError:
     def percy_snapshot(driver, *a, **kw):
         raise ModuleNotFoundError("[percy] `percy-selenium` package is not installed, "\
@@ -0,0 +1,70 @@
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+
+HEADER_PREFIX = b'// percy-dom sha256='
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'percy')
+
+
+class DomScriptCache:
+    """On-disk cache of the @percy/dom script, one file per CLI core version.
+
+    Each file starts with a header line carrying the SHA-256 of the script so a
+    truncated or corrupted entry is detected and discarded rather than injected.
+    Entries are written to a temp file in the same directory and renamed into
+    place, so concurrent workers never observe a partial write, and are read
+    through a memory map to avoid an extra buffered copy of a large bundle.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or default_cache_dir()
+
+    def path(self, version):
+        safe_version = re.sub(r'[^0-9A-Za-z._-]', '_', str(version))
+        return os.path.join(self.directory, f'dom-{safe_version}.js')
+
+    def load(self, version):
+        """Return the cached script for ``version``, or None when missing or invalid."""
+        path = self.path(version)
+        try:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                header_end = mm.find(b'\n')
+                header = mm[:header_end]
+                if header_end < 0 or not header.startswith(HEADER_PREFIX):
+                    raise ValueError('missing header')
+                body = mm[header_end + 1:]
+                if hashlib.sha256(body).hexdigest().encode() != header[len(HEADER_PREFIX):]:
+                    raise ValueError('hash mismatch')
+                return body.decode('utf-8')
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, UnicodeDecodeError):
+            self._discard(path)
+            return None
+
+    def store(self, version, script):
+        """Atomically write ``script`` as the entry for ``version``."""
+        body = script.encode('utf-8')
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.dom-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(HEADER_PREFIX + hashlib.sha256(body).hexdigest().encode() + b'\n')
+                f.write(body)
+            os.replace(tmp_path, self.path(version))
+        except BaseException:
+            self._discard(tmp_path)
+            raise
+
+    @staticmethod
+    def _discard(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
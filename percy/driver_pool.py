@@ -0,0 +1,81 @@
+import atexit
+import threading
+from contextlib import contextmanager
+
+
+class DriverPool:
+    """Bounded pool of helper WebDriver sessions created on demand.
+
+    ``factory`` is called with no arguments to open a new session; at most
+    ``max_sessions`` exist at once and ``acquire`` blocks until one is free.
+    Sessions are reused across captures and quit by ``close``, which is also
+    registered to run at interpreter exit once the first session is opened. A
+    session whose capture raised is quit and dropped rather than reused, since
+    it may be dead (e.g. an invalid session id), freeing its slot.
+    """
+
+    def __init__(self, factory, max_sessions=4):
+        self.factory = factory
+        self.max_sessions = max(1, max_sessions)
+        self._idle = []
+        self._sessions = []
+        self._creating = 0
+        self._cond = threading.Condition()
+        self._atexit_registered = False
+
+    @contextmanager
+    def acquire(self):
+        driver = self._checkout()
+        try:
+            yield driver
+        except BaseException:
+            self._discard(driver)
+            raise
+        with self._cond:
+            self._idle.append(driver)
+            self._cond.notify()
+
+    def close(self):
+        """Quit every session the pool has opened."""
+        with self._cond:
+            sessions, self._sessions, self._idle = self._sessions, [], []
+        for driver in sessions:
+            try:
+                driver.quit()
+            except Exception:  # pylint: disable=broad-except
+                pass
+
+    def size(self):
+        return len(self._sessions)
+
+    def _discard(self, driver):
+        with self._cond:
+            if driver in self._sessions:
+                self._sessions.remove(driver)
+            self._cond.notify()
+        try:
+            driver.quit()
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+    def _checkout(self):
+        with self._cond:
+            while not self._idle and len(self._sessions) + self._creating >= self.max_sessions:
+                self._cond.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._creating += 1
+        try:
+            driver = self.factory()
+        except BaseException:
+            with self._cond:
+                self._creating -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._creating -= 1
+            self._sessions.append(driver)
+            if not self._atexit_registered:
+                atexit.register(self.close)
+                self._atexit_registered = True
+        return driver
@@ -0,0 +1,69 @@
+import json
+import threading
+from collections import OrderedDict
+
+
+class FrameCaptureCache:
+    """LRU cache of serialized cross-origin iframe snapshots.
+
+    Entries are keyed by the frame's resolved URL plus an in-frame fingerprint
+    computed by the page, and bounded both by entry count and by the
+    approximate JSON size of the cached snapshots. ``keys_for`` lists the keys
+    worth offering to a frame declared with a given ``src``, including URLs
+    that ``src`` previously redirected to.
+    """
+
+    def __init__(self, max_entries=100, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._aliases = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counts = {'hits': 0, 'stores': 0}
+
+    @staticmethod
+    def key(url, fingerprint):
+        return f'{url}\n{fingerprint}'
+
+    def keys_for(self, src):
+        with self._lock:
+            urls = {src} | self._aliases.get(src, set())
+            return [key for key in self._entries if key.split('\n', 1)[0] in urls]
+
+    def get(self, url, fingerprint):
+        key = self.key(url, fingerprint)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self._counts['hits'] += 1
+            return entry[0]
+
+    def put(self, url, fingerprint, snapshot, src=None):
+        size = len(json.dumps(snapshot))
+        if size > self.max_bytes:
+            return False
+        key = self.key(url, fingerprint)
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (snapshot, size)
+            self._bytes += size
+            self._counts['stores'] += 1
+            if src and src != url:
+                self._aliases.setdefault(src, set()).add(url)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._bytes -= self._entries.popitem(last=False)[1][1]
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._aliases.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, **self._counts}
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from percy.dom_cache import default_cache_dir
+
+
+def default_share_dir():
+    return os.path.join(default_cache_dir(), 'healthcheck')
+
+
+class SharedHealthcheck:
+    """Shares a successful ``/percy/healthcheck`` payload between the processes
+    of one run.
+
+    The first process to reach the CLI publishes the payload to a JSON file in
+    a per-user directory, one per CLI address and ``run_id`` (e.g. the build id
+    ``percy exec`` exports); other workers of the same run started within
+    ``ttl`` seconds read it instead of issuing their own healthcheck. Entries
+    of another run are never returned. Writes go through a temp file and rename
+    so readers never see a partial entry.
+    """
+
+    def __init__(self, cli_api, run_id, ttl=60, directory=None):
+        self.run_id = str(run_id)
+        self.ttl = ttl
+        self.directory = directory or default_share_dir()
+        digest = hashlib.sha256(f'{cli_api}\n{self.run_id}'.encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(self.directory, f'healthcheck-{digest}.json')
+
+    def load(self):
+        """Return the shared payload, or None when missing, unreadable, expired
+        or published by another run."""
+        entry = self._read(self.path)
+        if entry is None or entry.get('run_id') != self.run_id:
+            return None
+        return entry['payload']
+
+    def store(self, payload):
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.healthcheck-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'timestamp': time.time(), 'run_id': self.run_id,
+                           'payload': payload}, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+        self._prune()
+
+    def clear(self):
+        self._remove(self.path)
+
+    def _read(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            if 'payload' not in entry or time.time() - float(entry['timestamp']) > self.ttl:
+                return None
+            return entry
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _prune(self):
+        # Every run leaves one entry behind; drop those that have expired.
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if name.startswith('healthcheck-') and path != self.path and self._read(path) is None:
+                self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,183 @@
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _ujson_dumps(obj):
+    return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False).encode('utf-8')
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj).encode('utf-8')
+
+
+class RawJSON:
+    """A JSON object kept as the text it arrived in (e.g. a DOM snapshot the
+    browser returned through ``JSON.stringify``) so it can be spliced into an
+    encoded payload without being parsed. The text may be given as a list of
+    consecutive slices, which are never joined when the payload is streamed.
+    Keys set on it are held separately and merged into the object when it is
+    encoded."""
+
+    def __init__(self, text):
+        self.parts = [text] if isinstance(text, str) else list(text)
+        self.extra = {}
+
+    @property
+    def text(self):
+        return self.parts[0] if len(self.parts) == 1 else ''.join(self.parts)
+
+    def __setitem__(self, key, value):
+        self.extra[key] = value
+
+    def __getitem__(self, key):
+        return self.extra[key]
+
+    def __contains__(self, key):
+        return key in self.extra
+
+    def get(self, key, default=None):
+        return self.extra.get(key, default)
+
+    def iter_encoded(self):
+        """Yield the object's JSON text, with the extra keys merged in, as
+        the stored slices."""
+        if not self.extra:
+            yield from self.parts
+            return
+        # Only whitespace after the closing brace is dropped; every slice
+        # before it is kept as received, since it may sit inside a string.
+        end = len(self.parts)
+        while end and not self.parts[end - 1].strip():
+            end -= 1
+        last = self.parts[end - 1].rstrip() if end else ''
+        if not last.endswith('}'):
+            raise ValueError('raw JSON is not an object')
+        last = last[:-1]
+        before, index = last.rstrip(), end - 1
+        while not before and index:
+            index -= 1
+            before = self.parts[index].rstrip()
+        yield from self.parts[:end - 1]
+        yield last
+        yield '' if before.endswith('{') else ','
+        yield _encoder(self.extra).decode('utf-8')[1:]
+
+    def encoded_text(self):
+        return ''.join(self.iter_encoded())
+
+    def decode(self):
+        return json.loads(self.encoded_text())
+
+
+_RAW_MARK = '\x00percy-raw:'
+
+
+def swap_raw(obj, fragments):
+    """Return ``obj`` with every RawJSON replaced by a placeholder string,
+    appending the RawJSON objects to ``fragments`` in placeholder order."""
+    if isinstance(obj, RawJSON):
+        fragments.append(obj)
+        return f'{_RAW_MARK}{len(fragments) - 1}\x00'
+    if isinstance(obj, dict):
+        return {key: swap_raw(value, fragments) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [swap_raw(value, fragments) for value in obj]
+    return obj
+
+
+def splice_raw(encoded, fragments, encode=None):
+    """Replace the encoded placeholders in ``encoded`` (str or bytes, as
+    produced by ``encode``) with the fragments' JSON text."""
+    encode = encode or _encoder
+    for index, fragment in enumerate(fragments):
+        placeholder = encode(f'{_RAW_MARK}{index}\x00')
+        text = fragment.encoded_text()
+        encoded = encoded.replace(placeholder, text if isinstance(encoded, str)
+                                  else text.encode('utf-8'), 1)
+    return encoded
+
+
+def iter_splice_raw(piece, fragments, encode=json.dumps):
+    """Like ``splice_raw`` for a str ``piece`` of streamed output, yielding the
+    fragments' slices instead of building the spliced string."""
+    for index, fragment in enumerate(fragments):
+        placeholder = encode(f'{_RAW_MARK}{index}\x00')
+        head, found, piece = piece.partition(placeholder)
+        if not found:
+            piece = head
+            continue
+        yield head
+        yield from fragment.iter_encoded()
+    yield piece
+
+
+ENCODERS = {'orjson': _orjson_dumps, 'ujson': _ujson_dumps, 'json': _stdlib_dumps}
+
+
+def available_encoders():
+    """Names of the encoders usable in this environment."""
+    return [name for name, module in (('orjson', orjson), ('ujson', ujson), ('json', json))
+            if module is not None]
+
+
+def _default_encoder():
+    # 'auto' prefers orjson; ujson is only used when asked for, as it encodes
+    # snapshot-sized payloads no faster than the stdlib
+    # (see benchmarks/bench_json_encoding.py).
+    requested = (os.environ.get('PERCY_JSON_ENCODER') or 'auto').lower()
+    if requested not in available_encoders():
+        requested = 'orjson' if orjson is not None else 'json'
+    return ENCODERS[requested]
+
+
+_encoder = _default_encoder()
+
+
+def dumps(obj):
+    """Encode ``obj`` as UTF-8 JSON bytes with the active encoder. RawJSON
+    values anywhere in ``obj`` are copied in as-is."""
+    try:
+        return _encoder(obj)
+    except TypeError:
+        fragments = []
+        swapped = swap_raw(obj, fragments)
+        if not fragments:
+            raise
+    return splice_raw(_encoder(swapped), fragments)
+
+
+def encoder_name():
+    for name, encoder in ENCODERS.items():
+        if encoder is _encoder:
+            return name
+    return getattr(_encoder, '__name__', 'custom')
+
+
+def set_encoder(encoder):
+    """Select the encoder by name ('orjson', 'ujson', 'json') or pass a
+    callable returning JSON bytes. Returns the previous encoder, which can be
+    passed back to restore it."""
+    global _encoder
+    previous = _encoder
+    if callable(encoder):
+        _encoder = encoder
+    elif encoder in available_encoders():
+        _encoder = ENCODERS[encoder]
+    else:
+        raise ValueError(f'JSON encoder {encoder!r} is not available; '
+                         f'choose from {available_encoders()}')
+    return previous
@@ -0,0 +1,91 @@
+import atexit
+import queue
+import threading
+
+from percy.transport import get_transport
+from percy.upload_queue import join_queue
+
+
+class LogShipper:
+    """Ships log entries to the Percy CLI from a background thread.
+
+    ``enqueue`` never blocks: entries go into a bounded queue and are dropped
+    (and counted) when it is full, e.g. because the CLI is slow to respond. A
+    single daemon worker drains the queue in batches of up to ``batch_size``
+    and posts each entry over the pooled transport. Pending entries are flushed
+    at interpreter exit. ``on_error`` is called with the exception when a POST
+    fails.
+    """
+
+    # pylint: disable=too-many-arguments,too-many-instance-attributes
+    def __init__(self, url, max_queue_size=1000, batch_size=50, timeout=1, exit_timeout=5,
+                 on_error=None):
+        self.url = url
+        self.on_error = on_error
+        self.batch_size = max(1, batch_size)
+        self.timeout = timeout
+        self.exit_timeout = exit_timeout
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max(1, max_queue_size))
+        self._lock = threading.Lock()
+        self._worker = None
+        self._atexit_registered = False
+
+    def enqueue(self, message, level):
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait({'message': message, 'level': level})
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def flush(self, timeout=None):
+        """Wait until every queued entry has been handled. Returns False if the
+        timeout elapsed first."""
+        return join_queue(self._queue, timeout)
+
+    def stats(self):
+        with self._lock:
+            return {'sent': self.sent, 'failed': self.failed, 'dropped': self.dropped,
+                    'pending': self._queue.qsize()}
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(
+                target=self._run, name='percy-log-shipper', daemon=True)
+            self._worker.start()
+            if not self._atexit_registered:
+                atexit.register(self.flush, self.exit_timeout)
+                self._atexit_registered = True
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._send(batch)
+
+    def _send(self, batch):
+        for entry in batch:
+            try:
+                get_transport().post(self.url, json=entry, timeout=self.timeout)
+                with self._lock:
+                    self.sent += 1
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                if self.on_error:
+                    self.on_error(e)
+            finally:
+                self._queue.task_done()
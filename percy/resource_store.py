@@ -0,0 +1,80 @@
+import hashlib
+import threading
+
+
+class UnknownResourceReferences(Exception):
+    """The CLI rejected a snapshot because it could not resolve some ``sha``
+    references, e.g. because it restarted and lost the bodies."""
+
+    def __init__(self, hashes):
+        super().__init__(f'unknown resource references: {", ".join(hashes)}')
+        self.hashes = hashes
+
+
+class ResourceStore:
+    """Content-addressed record of the resource bodies the CLI has accepted
+    during this build.
+
+    ``strip`` returns a copy of a snapshot payload in which every captured
+    resource whose content was already confirmed is replaced by a reference
+    carrying the SHA-256 of that content (``sha``) instead of the body. Hashes
+    only count as sent once ``confirm`` is called after a successful upload,
+    so a snapshot still in flight is never referenced.
+    """
+
+    def __init__(self):
+        self._sent = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(content):
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        return hashlib.sha256(content).hexdigest()
+
+    def strip(self, payload):
+        """Return ``(payload, hashes, saved)``: the payload with known bodies
+        replaced, the hashes of the bodies it still carries, and the number of
+        content bytes left out."""
+        with self._lock:
+            sent = set(self._sent)
+        state = {'hashes': set(), 'saved': 0}
+        return self._strip(payload, sent, state), state['hashes'], state['saved']
+
+    def _strip(self, value, sent, state, resources=False):
+        # Copies only the containers on the way to a replaced resource.
+        if isinstance(value, list):
+            stripped = [self._reference(item, sent, state) if resources
+                        else self._strip(item, sent, state) for item in value]
+            changed = any(new is not old for new, old in zip(stripped, value))
+        elif isinstance(value, dict):
+            stripped = {key: self._strip(item, sent, state, key == 'resources')
+                        for key, item in value.items()}
+            changed = any(stripped[key] is not value[key] for key in value)
+        else:
+            return value
+        return stripped if changed else value
+
+    def _reference(self, resource, sent, state):
+        content = resource.get('content') if isinstance(resource, dict) else None
+        if not isinstance(content, (str, bytes)):
+            return resource
+        sha = self.digest(content)
+        if sha not in sent:
+            state['hashes'].add(sha)
+            return resource
+        state['saved'] += len(content)
+        reference = {key: item for key, item in resource.items() if key != 'content'}
+        reference['sha'] = sha
+        return reference
+
+    def confirm(self, hashes):
+        with self._lock:
+            self._sent.update(hashes)
+
+    def clear(self):
+        with self._lock:
+            self._sent.clear()
+
+    def size(self):
+        return len(self._sent)
@@ -2,15 +2,27 @@
 import os
 import platform
 import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from functools import lru_cache
-from time import sleep
+from time import monotonic, sleep
 from urllib.parse import urlparse
-import requests
 
 from selenium.webdriver import __version__ as SELENIUM_VERSION
 from percy.version import __version__ as SDK_VERSION
 from percy.driver_metadata import DriverMetaData
+from percy.dom_cache import DomScriptCache
+from percy.driver_pool import DriverPool
+from percy.frame_cache import FrameCaptureCache
+from percy.viewport import ChromiumViewport
+from percy.healthcheck_cache import SharedHealthcheck
+from percy.json_codec import RawJSON, dumps as dumps_json
+from percy.log_shipper import LogShipper
+from percy.resource_store import ResourceStore, UnknownResourceReferences
+from percy.transport import get_transport
+from percy.upload_queue import UploadQueue
 
 # Collect client and environment information
 CLIENT_INFO = 'percy-selenium-python/' + SDK_VERSION
@@ -19,44 +31,281 @@ ENV_INFO = ['selenium/' + SELENIUM_VERSION, 'python/' + platform.python_version(
 def _get_bool_env(key):
     return os.environ.get(key, "").lower() == "true"
 
+def _get_int_env(key, default):
+    try:
+        return int(os.environ.get(key) or default)
+    except (TypeError, ValueError):
+        return default
+
 # Maybe get the CLI API address from the environment
 PERCY_CLI_API = os.environ.get('PERCY_CLI_API') or 'http://localhost:5338'
-PERCY_DEBUG = os.environ.get('PERCY_LOGLEVEL') == 'debug'
+# Log levels understood by the CLI, lowest first. Messages below the active
+# level are dropped before any formatting or I/O; see log() and set_log_level().
+LOG_LEVELS = {'debug': 0, 'info': 1, 'warn': 2, 'error': 3, 'silent': 4}
+PERCY_LOG_LEVEL = LOG_LEVELS.get((os.environ.get('PERCY_LOGLEVEL') or '').lower(),
+                                 LOG_LEVELS['info'])
+PERCY_DEBUG = PERCY_LOG_LEVEL == LOG_LEVELS['debug']
 RESPONSIVE_CAPTURE_SLEEP_TIME = (
     os.environ.get('RESPONSIVE_CAPTURE_SLEEP_TIME') or
     os.environ.get('RESONSIVE_CAPTURE_SLEEP_TIME')
 )
 PERCY_RESPONSIVE_CAPTURE_MIN_HEIGHT = _get_bool_env("PERCY_RESPONSIVE_CAPTURE_MIN_HEIGHT")
 PERCY_RESPONSIVE_CAPTURE_RELOAD_PAGE = _get_bool_env("PERCY_RESPONSIVE_CAPTURE_RELOAD_PAGE")
-# Seconds to let the viewport reflow after a responsive resize before snapshotting.
-# A fixed delay rather than a driver poll, so a wedged geckodriver can't hang the
-# run (see change_window_dimension_and_wait). Tunable via env for slow pages.
+# Upper bound, in seconds, on letting the viewport reflow after a responsive
+# resize before snapshotting. Enforced in-page rather than by a driver poll, so a
+# wedged geckodriver can't hang the run (see change_window_dimension_and_wait).
+# Tunable via env for slow pages.
 try:
     RESIZE_SETTLE_SECONDS = float(os.environ.get('PERCY_RESIZE_SETTLE_SECONDS') or 0.5)
 except (TypeError, ValueError):
     RESIZE_SETTLE_SECONDS = 0.5
+# Order in which the main window visits responsive widths: 'nearest' starts at
+# the current width and sweeps monotonically; 'config' keeps the CLI's order.
+PERCY_RESPONSIVE_WIDTH_ORDER = (os.environ.get('PERCY_RESPONSIVE_WIDTH_ORDER') or
+                                'nearest').lower()
+# How to wait for that reflow: 'event' resolves in-page as soon as the layout
+# goes quiet, with RESIZE_SETTLE_SECONDS as a JS-side deadline; 'fixed' always
+# sleeps the full RESIZE_SETTLE_SECONDS.
+PERCY_RESIZE_SETTLE = (os.environ.get('PERCY_RESIZE_SETTLE') or 'event').lower()
+# Milliseconds without a ResizeObserver callback after which the layout counts
+# as settled in 'event' mode.
+PERCY_RESIZE_QUIET_MS = max(0, _get_int_env('PERCY_RESIZE_QUIET_MS', 50))
 # for logging
 LABEL = '[\u001b[35m' + ('percy:python' if PERCY_DEBUG else 'percy') + '\u001b[39m]'
+# Closed shadow roots resolved per Runtime.callFunctionOn when exposing them via
+# CDP; 0 falls back to one call per root (see expose_closed_shadow_roots).
+PERCY_SHADOW_ROOT_BATCH_SIZE = max(0, _get_int_env('PERCY_SHADOW_ROOT_BATCH_SIZE', 200))
+# How closed shadow roots are discovered: 'full' pulls the whole pierced DOM
+# tree; 'prescan' only describes custom-element subtrees found by an in-page
+# scan, falling back to 'full' past PERCY_SHADOW_DISCOVERY_BUDGET candidates.
+PERCY_SHADOW_DISCOVERY = (os.environ.get('PERCY_SHADOW_DISCOVERY') or 'full').lower()
+PERCY_SHADOW_DISCOVERY_BUDGET = max(1, _get_int_env('PERCY_SHADOW_DISCOVERY_BUDGET', 200))
+# Run the CDP closed-shadow pass even when the page has no custom elements.
+PERCY_FORCE_CLOSED_SHADOW_CAPTURE = _get_bool_env('PERCY_FORCE_CLOSED_SHADOW_CAPTURE')
 CDP_SUPPORT_SELENIUM = (str(SELENIUM_VERSION)[0].isdigit() and int(
     str(SELENIUM_VERSION)[0]) >= 4) if SELENIUM_VERSION else False
 
-def log(message, lvl = 'info'):
+def _on_log_ship_error(e):
+    if PERCY_DEBUG: print(f'Sending log to CLI Failed {e}')
+
+# Logs are shipped to the CLI by a background worker so callers never block on
+# the POST. Queue size is tunable via env; entries beyond it are dropped.
+PERCY_LOG_QUEUE_SIZE = _get_int_env('PERCY_LOG_QUEUE_SIZE', 1000)
+_log_shipper = LogShipper(f'{PERCY_CLI_API}/percy/log', max_queue_size=PERCY_LOG_QUEUE_SIZE,
+                          on_error=_on_log_ship_error)
+
+def set_log_level(level):
+    """Set the minimum level that is printed and shipped to the CLI. Accepts
+    the same names as PERCY_LOGLEVEL; unknown names fall back to 'info'."""
+    global PERCY_LOG_LEVEL, PERCY_DEBUG, LABEL
+    PERCY_LOG_LEVEL = LOG_LEVELS.get(str(level).lower(), LOG_LEVELS['info'])
+    PERCY_DEBUG = PERCY_LOG_LEVEL == LOG_LEVELS['debug']
+    LABEL = '[\u001b[35m' + ('percy:python' if PERCY_DEBUG else 'percy') + '\u001b[39m]'
+
+def log_enabled(lvl):
+    if lvl == 'debug': return PERCY_DEBUG
+    return LOG_LEVELS.get(lvl, LOG_LEVELS['info']) >= PERCY_LOG_LEVEL
+
+def log(message, lvl = 'info', *args):  # pylint: disable=keyword-arg-before-vararg
+    """Print and ship a message to the CLI. Disabled levels return before any
+    work, so hot paths can pass a callable or %-style ``args`` to defer
+    building the string until it is known to be needed."""
+    if not log_enabled(lvl): return
+    if callable(message):
+        message = message()
+    elif args:
+        message = message % args
     message = f'{LABEL} {message}'
+    # Never blocks: the entry is queued for the background shipper.
+    _log_shipper.enqueue(message, lvl)
+    print(message)
+
+def flush_logs(timeout=None):
+    """Block until queued log entries have been sent to the CLI."""
+    return _log_shipper.flush(timeout)
+
+# Opt-in streamed snapshot POSTs: the body is JSON-encoded while it is sent
+# (chunked transfer) instead of being built as one string first. With
+# PERCY_SNAPSHOT_GZIP the streamed body is gzipped, but only when the CLI lists
+# 'gzip-requests' in its healthcheck capabilities; a body the CLI rejects
+# (400/415) is sent again uncompressed.
+PERCY_STREAM_SNAPSHOTS = _get_bool_env('PERCY_STREAM_SNAPSHOTS')
+PERCY_SNAPSHOT_GZIP = _get_bool_env('PERCY_SNAPSHOT_GZIP')
+# Opt-in: receive each serialized DOM from the browser as one JSON string and
+# copy it into the POST body unparsed, instead of decoding it into Python
+# objects only to encode it again.
+PERCY_RAW_DOM_SNAPSHOT = _get_bool_env('PERCY_RAW_DOM_SNAPSHOT')
+# Characters per execute_script call when pulling a serialized DOM out of the
+# browser in slices; 0 returns it in one call. Implies PERCY_RAW_DOM_SNAPSHOT.
+PERCY_DOM_CHUNK_SIZE = max(0, _get_int_env('PERCY_DOM_CHUNK_SIZE', 0))
+
+# Opt-in background snapshot uploads: percy_snapshot returns a Future as soon
+# as the DOM is serialized and the POST runs on a worker thread. Enabled via
+# env for the whole run, or per block with async_uploads().
+PERCY_ASYNC_UPLOADS = _get_bool_env('PERCY_ASYNC_UPLOADS')
+PERCY_UPLOAD_WORKERS = _get_int_env('PERCY_UPLOAD_WORKERS', 2)
+PERCY_UPLOAD_QUEUE_SIZE = _get_int_env('PERCY_UPLOAD_QUEUE_SIZE', 20)
+_upload_queue = UploadQueue(
+    PERCY_UPLOAD_WORKERS, PERCY_UPLOAD_QUEUE_SIZE) if PERCY_ASYNC_UPLOADS else None
+
+def enable_async_uploads(workers=None, max_queue_size=None):
+    """Switch percy_snapshot to background uploads and return the queue."""
+    global _upload_queue
+    if _upload_queue is not None:
+        _upload_queue.flush()
+    _upload_queue = UploadQueue(workers or PERCY_UPLOAD_WORKERS,
+                                max_queue_size or PERCY_UPLOAD_QUEUE_SIZE)
+    return _upload_queue
+
+def disable_async_uploads(timeout=None):
+    """Drain pending uploads and switch back to blocking uploads."""
+    global _upload_queue
+    upload_queue, _upload_queue = _upload_queue, None
+    return upload_queue.flush(timeout) if upload_queue is not None else True
+
+@contextmanager
+def async_uploads(workers=None, max_queue_size=None):
+    """Upload snapshots in the background within the block; every upload has
+    finished by the time the block exits."""
+    global _upload_queue
+    previous = _upload_queue
+    upload_queue = enable_async_uploads(workers, max_queue_size)
     try:
-        requests.post(f'{PERCY_CLI_API}/percy/log',
-                    json={'message': message, 'level': lvl}, timeout=1)
-    except Exception as e:
-        if PERCY_DEBUG: print(f'Sending log to CLI Failed {e}')
+        yield upload_queue
     finally:
-        # Only log if lvl is 'debug' and PERCY_DEBUG is True
-        if lvl != 'debug' or PERCY_DEBUG:
-            print(message)
+        upload_queue.flush()
+        _upload_queue = previous
+
+# Opt-in parallel capture of top-level cross-origin iframes: each frame's src is
+# loaded in a helper session from this pool instead of switching the main
+# driver into frames one at a time.
+_cors_driver_pool = None
+
+def enable_parallel_cors_capture(driver_factory, max_sessions=4):
+    """Capture top-level cross-origin iframes concurrently on up to
+    ``max_sessions`` helper sessions opened with ``driver_factory()``. Helper
+    sessions load each frame's src directly, without the page's cookies or
+    state; frames they cannot capture are retried through the main driver."""
+    global _cors_driver_pool
+    disable_parallel_cors_capture()
+    _cors_driver_pool = DriverPool(driver_factory, max_sessions)
+    return _cors_driver_pool
+
+def disable_parallel_cors_capture():
+    """Switch back to serial iframe capture and quit the helper sessions."""
+    global _cors_driver_pool
+    pool, _cors_driver_pool = _cors_driver_pool, None
+    if pool is not None:
+        pool.close()
+
+# Opt-in cross-snapshot cache of cross-origin iframe captures (see
+# FrameCaptureCache). A hit skips serializing the frame and shipping its DOM
+# back over the WebDriver wire.
+PERCY_IFRAME_CACHE = _get_bool_env('PERCY_IFRAME_CACHE')
+PERCY_IFRAME_CACHE_MAX_ENTRIES = _get_int_env('PERCY_IFRAME_CACHE_MAX_ENTRIES', 100)
+PERCY_IFRAME_CACHE_MAX_MB = _get_int_env('PERCY_IFRAME_CACHE_MAX_MB', 64)
+_frame_cache = FrameCaptureCache(
+    PERCY_IFRAME_CACHE_MAX_ENTRIES,
+    PERCY_IFRAME_CACHE_MAX_MB * 1024 * 1024) if PERCY_IFRAME_CACHE else None
+
+def enable_iframe_cache(max_entries=None, max_mb=None):
+    """Reuse cross-origin iframe captures across snapshots and return the cache."""
+    global _frame_cache
+    _frame_cache = FrameCaptureCache(
+        max_entries or PERCY_IFRAME_CACHE_MAX_ENTRIES,
+        (max_mb or PERCY_IFRAME_CACHE_MAX_MB) * 1024 * 1024)
+    return _frame_cache
+
+def disable_iframe_cache():
+    global _frame_cache
+    _frame_cache = None
+
+# Opt-in parallel responsive capture: every width is loaded and serialized in
+# its own helper session from this pool instead of resizing one window per width.
+_responsive_driver_pool = None
+
+def enable_parallel_responsive_capture(driver_factory, max_sessions=4):
+    """Capture responsive widths concurrently on up to ``max_sessions`` helper
+    sessions opened with ``driver_factory()``. Each session loads the page URL
+    with the page's cookies at its width; widths that fail there are captured
+    in the main window as before."""
+    global _responsive_driver_pool
+    disable_parallel_responsive_capture()
+    _responsive_driver_pool = DriverPool(driver_factory, max_sessions)
+    return _responsive_driver_pool
+
+def disable_parallel_responsive_capture():
+    """Switch back to resizing the main window and quit the helper sessions."""
+    global _responsive_driver_pool
+    pool, _responsive_driver_pool = _responsive_driver_pool, None
+    if pool is not None:
+        pool.close()
+
+def flush(timeout=None):
+    """Wait for pending background snapshot uploads, then for queued logs."""
+    uploads_done = _upload_queue.flush(timeout) if _upload_queue is not None else True
+    return flush_logs(timeout) and uploads_done
+
+# Opt-in content-addressed resource dedupe: once the CLI has accepted a
+# resource body in this build, later snapshots send a SHA-256 reference
+# instead. References are only sent when the CLI lists 'resource-references'
+# in its healthcheck capabilities, or to PERCY_RESOURCE_DEDUPE_URL, a stand-in
+# endpoint that resolves them; otherwise snapshots are sent in full.
+PERCY_RESOURCE_DEDUPE = _get_bool_env('PERCY_RESOURCE_DEDUPE')
+PERCY_RESOURCE_DEDUPE_URL = os.environ.get('PERCY_RESOURCE_DEDUPE_URL')
+_resource_store = ResourceStore() if PERCY_RESOURCE_DEDUPE else None
+
+def enable_resource_dedupe():
+    """Send each resource body once per build and reference it by hash after."""
+    global _resource_store
+    if _resource_store is None:
+        _resource_store = ResourceStore()
+    return _resource_store
+
+def disable_resource_dedupe():
+    global _resource_store
+    _resource_store = None
+
+# Opt-in cross-process share of the healthcheck payload: the first worker to
+# reach the CLI publishes it and workers of the same run started within the TTL
+# reuse it. The run is identified by PERCY_RUN_ID (published by the parent) or
+# the build id `percy exec` exports; without either nothing is shared.
+PERCY_SHARED_HEALTHCHECK = _get_bool_env('PERCY_SHARED_HEALTHCHECK')
+PERCY_HEALTHCHECK_TTL = _get_int_env('PERCY_HEALTHCHECK_TTL', 60)
+PERCY_RUN_ID = os.environ.get('PERCY_RUN_ID') or os.environ.get('PERCY_BUILD_ID')
+_shared_healthcheck = SharedHealthcheck(
+    PERCY_CLI_API, PERCY_RUN_ID, PERCY_HEALTHCHECK_TTL
+) if PERCY_SHARED_HEALTHCHECK and PERCY_RUN_ID else None
 
 # Check if Percy is enabled, caching the result so it is only checked once
 @lru_cache(maxsize=None)
 def is_percy_enabled():
+    if _shared_healthcheck is not None:
+        shared = _shared_healthcheck.load()
+        if shared:
+            return shared
+    data = _healthcheck()
+    if data and _shared_healthcheck is not None:
+        try:
+            _shared_healthcheck.store(data)
+        except Exception as e:
+            log("Could not share the healthcheck result: %s", "debug", e)
+    return data
+
+def refresh_percy_enabled():
+    """Drop the cached (and shared) healthcheck and query the CLI again, e.g.
+    after the CLI was restarted mid-run."""
+    is_percy_enabled.cache_clear()
+    _widths_config_cache.update(config=None, widths={})
+    if _resource_store is not None:
+        _resource_store.clear()
+    if _shared_healthcheck is not None:
+        _shared_healthcheck.clear()
+    return is_percy_enabled()
+
+def _healthcheck():
     try:
-        response = requests.get(f'{PERCY_CLI_API}/percy/healthcheck', timeout=30)
+        response = get_transport().get(f'{PERCY_CLI_API}/percy/healthcheck', timeout=30)
         response.raise_for_status()
         data = response.json()
         session_type =  data.get('type', None)
@@ -65,6 +314,7 @@ def is_percy_enabled():
 
         if not data['success']: raise Exception(data['error'])
         version = response.headers.get('x-percy-core-version')
+        capabilities = data.get('capabilities') or []
 
         if not version:
             print(f'{LABEL} You may be using @percy/agent '
@@ -80,20 +330,80 @@ def is_percy_enabled():
         return {
             'session_type': session_type,
             'config': config,
-            'widths': widths
+            'widths': widths,
+            'core_version': version,
+            'resource_references': 'resource-references' in capabilities,
+            'gzip_requests': 'gzip-requests' in capabilities
         }
     except Exception as e:
         print(f'{LABEL} Percy is not running, disabling snapshots')
         if PERCY_DEBUG: print(f'{LABEL} {e}')
         return False
 
+# Optional on-disk cache of dom.js shared by every process on the machine, so
+# xdist workers / short-lived Robot runs don't each download it again.
+PERCY_DOM_DISK_CACHE = _get_bool_env('PERCY_DOM_DISK_CACHE')
+_dom_cache = DomScriptCache(
+    os.environ.get('PERCY_DOM_CACHE_DIR')) if PERCY_DOM_DISK_CACHE else None
+
 # Fetch the @percy/dom script, caching the result so it is only fetched once
 @lru_cache(maxsize=None)
 def fetch_percy_dom():
-    response = requests.get(f'{PERCY_CLI_API}/percy/dom.js', timeout=30)
+    healthcheck = is_percy_enabled()
+    version = healthcheck.get('core_version') if healthcheck else None
+    if _dom_cache is not None and version:
+        cached = _dom_cache.load(version)
+        if cached is not None:
+            return cached
+
+    response = get_transport().get(f'{PERCY_CLI_API}/percy/dom.js', timeout=30)
     response.raise_for_status()
+    if _dom_cache is not None and version:
+        try:
+            _dom_cache.store(version, response.text)
+        except Exception as e:
+            log("Could not write dom.js to the disk cache: %s", "debug", e)
     return response.text
 
+# Counters for guarded PercyDOM injection (see inject_percy_dom): 'skipped'
+# counts only contexts where the bundle's marker was already present. Updated
+# from helper and parallel-capture threads, hence the lock.
+PERCY_DOM_INJECTION_STATS = {'injected': 0, 'skipped': 0}
+_injection_stats_lock = threading.Lock()
+
+def _count_dom_injection(key):
+    with _injection_stats_lock:
+        PERCY_DOM_INJECTION_STATS[key] += 1
+
+@lru_cache(maxsize=4)
+def _tagged_percy_dom(percy_dom_script):
+    """Return (marker, script) where the script also records the marker on
+    window, so a later inject_percy_dom can tell the bundle is already loaded."""
+    marker = hashlib.sha256(percy_dom_script.encode('utf-8')).hexdigest()[:16]
+    return marker, f'{percy_dom_script}\n;window.__percyDomMarker = {json.dumps(marker)};'
+
+def inject_percy_dom(driver, percy_dom_script, force=False):
+    """Inject the PercyDOM bundle into the current browsing context unless the
+    same version is already there. A tiny probe for ``PercyDOM`` plus the hash
+    marker replaces re-sending the whole dom.js over the WebDriver wire.
+    ``force`` skips the probe when the context is known to be fresh (e.g. right
+    after a reload). Returns True if the script was sent."""
+    marker, tagged_script = _tagged_percy_dom(percy_dom_script)
+    if not force:
+        try:
+            present = driver.execute_script(
+                "return typeof PercyDOM !== 'undefined' "
+                "&& window.__percyDomMarker === arguments[0];", marker)
+        except Exception as e:
+            log("PercyDOM presence check failed, injecting: %s", "debug", e)
+            present = False
+        if present is True:
+            _count_dom_injection('skipped')
+            return False
+    driver.execute_script(tagged_script)
+    _count_dom_injection('injected')
+    return True
+
 # pylint: disable=too-many-arguments, too-many-branches, too-many-locals
 def create_region(
     boundingBox=None,
@@ -187,74 +497,236 @@ def process_frame(driver, frame_element, options, percy_dom_script):
     }
 
 
-# In-browser script that walks document.querySelectorAll('iframe') and returns
+# In-browser function that walks document.querySelectorAll('iframe') and returns
 # metadata for each. Mirrors percy-nightwatch's enumerateIframesScript so the
-# wire shape stays in sync. Selectors is a list[str] of CSS selectors that
-# users want to opt out of CORS iframe capture for.
+# wire shape stays in sync. It takes a list[str] of CSS selectors that users
+# want to opt out of CORS iframe capture for.
+_ENUMERATE_IFRAMES_FN = (
+    "function(__percySelectors) {"
+    "var __percyIframes = document.querySelectorAll('iframe');"
+    "var __percyResult = [];"
+    "for (var i = 0; i < __percyIframes.length; i++) {"
+    "  var f = __percyIframes[i];"
+    "  var matchesIgnore = false;"
+    "  if (__percySelectors && __percySelectors.length) {"
+    "    for (var j = 0; j < __percySelectors.length; j++) {"
+    "      try { if (f.matches(__percySelectors[j])) { matchesIgnore = true; break; } }"
+    "      catch (e) {}"
+    "    }"
+    "  }"
+    "  __percyResult.push({"
+    "    src: f.src || '',"
+    "    srcdoc: f.getAttribute('srcdoc'),"
+    "    percyElementId: f.getAttribute('data-percy-element-id'),"
+    "    dataPercyIgnore: f.hasAttribute('data-percy-ignore'),"
+    "    matchesIgnoreSelector: matchesIgnore,"
+    "    index: i,"
+    "    width: Math.round(f.getBoundingClientRect().width),"
+    "    height: Math.round(f.getBoundingClientRect().height)"
+    "  });"
+    "}"
+    "return __percyResult;"
+    "}"
+)
+
 def enumerate_iframes_script(selectors):
     selectors_json = json.dumps(list(selectors or []))
     return (
         "var __percySelectors = " + selectors_json + ";"
-        "var __percyIframes = document.querySelectorAll('iframe');"
-        "var __percyResult = [];"
-        "for (var i = 0; i < __percyIframes.length; i++) {"
-        "  var f = __percyIframes[i];"
-        "  var matchesIgnore = false;"
-        "  if (__percySelectors && __percySelectors.length) {"
-        "    for (var j = 0; j < __percySelectors.length; j++) {"
-        "      try { if (f.matches(__percySelectors[j])) { matchesIgnore = true; break; } }"
-        "      catch (e) {}"
-        "    }"
-        "  }"
-        "  __percyResult.push({"
-        "    src: f.src || '',"
-        "    srcdoc: f.getAttribute('srcdoc'),"
-        "    percyElementId: f.getAttribute('data-percy-element-id'),"
-        "    dataPercyIgnore: f.hasAttribute('data-percy-ignore'),"
-        "    matchesIgnoreSelector: matchesIgnore,"
-        "    index: i"
-        "  });"
-        "}"
-        "return __percyResult;"
+        "return (" + _ENUMERATE_IFRAMES_FN + ")(__percySelectors);"
     )
 
 
+# Everything done inside a cross-origin frame, fused into one execute_script
+# round trip: the document.URL support and cycle checks, the PercyDOM presence
+# check, serialization and enumeration of nested iframes. Reports
+# status 'inject' when PercyDOM is missing so the caller can resend it prefixed
+# with the bundle (see _capture_current_frame).
+#
+# With the frame capture cache on (``o.cache`` is the cache-key suffix), frames
+# without iframes of their own are fingerprinted by an FNV-1a hash over the
+# title, text content, and every element's tag, attributes and form value;
+# when the caller already holds that URL + fingerprint (``o.known``) the script
+# answers 'cached' instead of serializing. The hash skips the data-percy-*
+# attributes serialize stamps into the DOM and avoids document.lastModified
+# (the current time when the server sends no header).
+_CAPTURE_FRAME_SCRIPT = (
+    "return (function(o) {"
+    "  var url = document.URL;"
+    "  var lower = String(url || '').toLowerCase();"
+    "  if (!url || o.unsupported.some(function(p) { return lower.indexOf(p) === 0; }))"
+    "    return { status: 'unsupported', frameUrl: url };"
+    "  if (o.ancestors.indexOf(url) !== -1) return { status: 'cycle', frameUrl: url };"
+    "  var fp = null;"
+    "  if (o.cache && !document.querySelector('iframe')) {"
+    "    var h = 0x811c9dc5;"
+    "    var mix = function(str) {"
+    "      str = String(str);"
+    "      for (var i = 0; i < str.length; i++)"
+    "        h = Math.imul(h ^ str.charCodeAt(i), 16777619);"
+    "      h = Math.imul(h ^ 0, 16777619);"
+    "    };"
+    "    var root = document.documentElement;"
+    "    var els = document.getElementsByTagName('*');"
+    "    mix(document.title); mix(root ? root.textContent : '');"
+    "    for (var e = 0; e < els.length; e++) {"
+    "      mix(els[e].tagName);"
+    "      for (var a = 0; a < els[e].attributes.length; a++) {"
+    "        var attr = els[e].attributes[a];"
+    "        if (attr.name.indexOf('data-percy-') !== 0) { mix(attr.name); mix(attr.value); }"
+    "      }"
+    "      if (typeof els[e].value === 'string') mix(els[e].value);"
+    "    }"
+    "    fp = [(h >>> 0).toString(16), els.length, o.cache].join(':');"
+    "    if (o.known.indexOf(url + '\\n' + fp) !== -1)"
+    "      return { status: 'cached', frameUrl: url, fingerprint: fp, iframes: [] };"
+    "  }"
+    "  if (typeof PercyDOM === 'undefined' || window.__percyDomMarker !== o.marker)"
+    "    return { status: 'inject', frameUrl: url };"
+    "  return { status: 'ok', frameUrl: url, fingerprint: fp,"
+    "           snapshot: PercyDOM.serialize(o.options),"
+    "           iframes: o.enumerate ? (" + _ENUMERATE_IFRAMES_FN + ")(o.ignoreSelectors) : [] };"
+    "})(arguments[0]);"
+)
+
+
 def _should_skip_iframe(iframe, current_origin):
     # pylint: disable=too-many-return-statements
     """Mirror of nightwatch's shouldSkipIframe — pure on the enumerated metadata."""
     if iframe.get('dataPercyIgnore'):
-        log(f"Skipping iframe marked with data-percy-ignore: {iframe.get('src') or '(no src)'}",
-            "debug")
+        log("Skipping iframe marked with data-percy-ignore: %s", "debug",
+            iframe.get('src') or '(no src)')
         return True
     if iframe.get('matchesIgnoreSelector'):
-        log(f"Skipping iframe matching ignoreIframeSelectors: "
-            f"{iframe.get('src') or '(no src)'}", "debug")
+        log("Skipping iframe matching ignoreIframeSelectors: %s", "debug",
+            iframe.get('src') or '(no src)')
         return True
     # Check srcdoc BEFORE the src-emptiness check: a pure-srcdoc iframe has no
     # src attribute, and we want it routed through the srcdoc-specific branch
     # (where same-origin inlining handles it) rather than silently lumped under
     # "unsupported src".
     if iframe.get('srcdoc'):
-        log(f"Skipping srcdoc iframe at index {iframe.get('index')}", "debug")
+        log("Skipping srcdoc iframe at index %s", "debug", iframe.get('index'))
         return True
     src = iframe.get('src') or ''
     if not src or is_unsupported_iframe_src(src):
         if src:
-            log(f"Skipping unsupported iframe src: {src}", "debug")
+            log("Skipping unsupported iframe src: %s", "debug", src)
         return True
     frame_origin = get_origin(src)
     if not frame_origin:
-        log(f"Skipping iframe with invalid URL: {src}", "debug")
+        log("Skipping iframe with invalid URL: %s", "debug", src)
         return True
     if frame_origin == current_origin:
-        log(f"Skipping same-origin iframe: {src}", "debug")
+        log("Skipping same-origin iframe: %s", "debug", src)
         return True
     if not iframe.get('percyElementId'):
-        log(f"Skipping cross-origin iframe without data-percy-element-id: {src}", "debug")
+        log("Skipping cross-origin iframe without data-percy-element-id: %s", "debug", src)
         return True
     return False
 
 
+def _frame_cache_suffix(marker, frame_options, size=None):
+    """Part of a frame cache key that pins the PercyDOM version, the options
+    and the frame's rendered size."""
+    options = json.dumps([frame_options, size], sort_keys=True, default=str)
+    return marker + hashlib.sha256(options.encode('utf-8')).hexdigest()[:12]
+
+
+def _capture_current_frame(driver, iframe_meta, depth, ancestor_urls, ctx, collected):
+    """Serialize the frame the driver is currently in and recurse into its
+    cross-origin children, appending entries to ``collected``. Shared by the
+    switch-into-frame path and helper sessions that load the frame directly.
+
+    The in-frame work is one round trip (_CAPTURE_FRAME_SCRIPT), or two the
+    first time a frame is seen: the second resends it prefixed with PercyDOM."""
+    max_frame_depth = ctx['max_frame_depth']
+    marker, tagged_script = _tagged_percy_dom(ctx['percy_dom_script'])
+    # enableJavaScript is forced to True so that the standard iframe
+    # serialization path is bypassed — we handle CORS iframe serialization
+    # manually here.
+    frame_options = {**ctx['serialize_options'], 'enableJavaScript': True}
+    frame_cache = _frame_cache
+    capture_args = {
+        'unsupported': list(UNSUPPORTED_IFRAME_SRC_PREFIXES),
+        'ancestors': sorted(ancestor_urls or []),
+        'marker': marker,
+        'options': frame_options,
+        'enumerate': depth < max_frame_depth,
+        'ignoreSelectors': list(ctx['ignore_selectors'] or []),
+        'cache': _frame_cache_suffix(marker, frame_options,
+                                     _frame_size(iframe_meta)) if frame_cache else None,
+        'known': frame_cache.keys_for(iframe_meta.get('src')) if frame_cache else [],
+    }
+    frame_result = driver.execute_script(_CAPTURE_FRAME_SCRIPT, capture_args) or {}
+    if frame_result.get('status') == 'cached':
+        snapshot = frame_cache.get(frame_result.get('frameUrl'), frame_result.get('fingerprint'))
+        if snapshot is not None:
+            frame_result['status'], frame_result['snapshot'] = 'served', snapshot
+        else:
+            # evicted since keys_for() was read; capture it for real
+            capture_args['known'] = []
+            frame_result = driver.execute_script(_CAPTURE_FRAME_SCRIPT, capture_args) or {}
+    if frame_result.get('status') == 'inject':
+        frame_result = driver.execute_script(
+            tagged_script + "\n;" + _CAPTURE_FRAME_SCRIPT, capture_args) or {}
+        _count_dom_injection('injected')
+    elif frame_result.get('status') == 'ok':
+        # serialized without resending the bundle: its marker was present
+        _count_dom_injection('skipped')
+    elif frame_result.get('status') == 'served':
+        frame_result['status'] = 'ok'
+    if (frame_cache and frame_result.get('status') == 'ok' and frame_result.get('snapshot')
+            and frame_result.get('fingerprint') and not frame_result.get('iframes')):
+        frame_cache.put(frame_result.get('frameUrl'), frame_result['fingerprint'],
+                        frame_result['snapshot'], src=iframe_meta.get('src'))
+
+    status = frame_result.get('status')
+    # The frame's resolved document.URL may be unsupported (about:blank, a
+    # net-error page) even though its src looked fine, or a redirect chain
+    # (src=A → 30x → B) may lead back to an ancestor; neither is serialized.
+    if status == 'unsupported':
+        log("Skipping iframe (post-switch URL unsupported): %s", "debug",
+            frame_result.get('frameUrl'))
+        return
+    if status == 'cycle':
+        log("Skipping cyclic iframe (%s appears in ancestor chain "
+            "via redirect resolution)", "debug", frame_result.get('frameUrl'))
+        return
+    if status != 'ok' or not frame_result.get('snapshot'):
+        log("Serialization returned empty result for frame: %s", "debug",
+            iframe_meta.get('src'))
+        return
+
+    frame_url = frame_result.get('frameUrl') or iframe_meta.get('src') or "unknown-src"
+    log("Captured cross-origin iframe (depth %s): %s", "debug", depth, frame_url)
+
+    collected.append({
+        "iframeData": {"percyElementId": iframe_meta['percyElementId']},
+        "iframeSnapshot": frame_result['snapshot'],
+        "frameUrl": frame_url
+    })
+
+    # Recurse into cross-origin iframes nested inside this frame. Same-origin
+    # descendants are already inlined as srcdoc by PercyDOM.serialize above.
+    # Compare each nested-frame origin against this frame's origin (the
+    # immediate parent), not the page origin.
+    if depth < max_frame_depth:
+        current_origin = get_origin(frame_url)
+        child_iframes = frame_result.get('iframes')
+        child_iframes = child_iframes if isinstance(child_iframes, list) else []
+        next_ancestors = set(ancestor_urls or [])
+        next_ancestors.add(frame_url)
+        if iframe_meta.get('src'):
+            next_ancestors.add(iframe_meta['src'])
+        for child in child_iframes:
+            if _should_skip_iframe(child, current_origin):
+                continue
+            nested = process_frame_tree(driver, child, depth + 1, next_ancestors, ctx)
+            if nested:
+                collected.extend(nested)
+
+
 def process_frame_tree(driver, iframe_meta, depth, ancestor_urls, ctx):
     # pylint: disable=too-many-return-statements,too-many-statements
     """Recursively capture a cross-origin iframe and any nested cross-origin
@@ -264,29 +736,23 @@ def process_frame_tree(driver, iframe_meta, depth, ancestor_urls, ctx):
     the chain we treat it as a cycle and stop descending.
     """
     max_frame_depth = ctx['max_frame_depth']
-    ignore_selectors = ctx['ignore_selectors']
-    serialize_options = ctx['serialize_options']
-    percy_dom_script = ctx['percy_dom_script']
 
     if depth > max_frame_depth:
-        log(f"Reached max iframe nesting depth ({max_frame_depth}); "
-            f"stopping at {iframe_meta.get('src')}", "debug")
+        log("Reached max iframe nesting depth (%s); stopping at %s", "debug",
+            max_frame_depth, iframe_meta.get('src'))
         return []
     if ancestor_urls and iframe_meta.get('src') in ancestor_urls:
-        log(f"Skipping cyclic iframe ({iframe_meta.get('src')} appears in ancestor chain)",
-            "debug")
+        log("Skipping cyclic iframe (%s appears in ancestor chain)", "debug",
+            iframe_meta.get('src'))
         return []
 
     collected = []
     switched_in = False
     captured_error = None
-    # Track the post-switch URL so we can also detect cycles where a frame's
-    # static src differs from its resolved document.URL (redirect chains).
-    inside_url = None
 
     try:
-        log(f"Processing cross-origin iframe (depth {depth}): {iframe_meta.get('src')}",
-            "debug")
+        log("Processing cross-origin iframe (depth %s): %s", "debug",
+            depth, iframe_meta.get('src'))
 
         # Find the iframe element by its data-percy-element-id rather than by
         # numeric index, which avoids drift if the DOM mutated between
@@ -300,82 +766,14 @@ def process_frame_tree(driver, iframe_meta, depth, ancestor_urls, ctx):
             find_script, iframe_meta['percyElementId']
         )
         if not iframe_element:
-            log(f"Could not find iframe element with data-percy-element-id: "
-                f"{iframe_meta['percyElementId']}", "debug")
+            log("Could not find iframe element with data-percy-element-id: %s", "debug",
+                iframe_meta['percyElementId'])
             return []
 
         driver.switch_to.frame(iframe_element)
         switched_in = True
 
-        # Post-switch URL re-check: a frame's src attribute may have pointed
-        # somewhere reachable but the actual loaded document can be about:blank
-        # or a net-error page. Read document.URL inside the frame and bail if
-        # unsupported.
-        try:
-            inside_url = driver.execute_script("return document.URL;")
-        except Exception:  # pylint: disable=broad-except
-            inside_url = None
-        if is_unsupported_iframe_src(inside_url):
-            log(f"Skipping iframe (post-switch URL unsupported): {inside_url}", "debug")
-            return []
-        # Second cycle check, on the resolved document.URL. A redirect chain
-        # (src=A → 30x → B) wouldn't trip the pre-switch guard because the
-        # static src doesn't appear in ancestor_urls — but the post-switch URL
-        # would. Catch the cycle here before we serialize and recurse.
-        if ancestor_urls and inside_url and inside_url in ancestor_urls:
-            log(f"Skipping cyclic iframe ({inside_url} appears in ancestor chain "
-                "via redirect resolution)", "debug")
-            return []
-
-        # Inject PercyDOM and serialize. enableJavaScript is forced to True so
-        # that the standard iframe serialization path is bypassed — we handle
-        # CORS iframe serialization manually here.
-        driver.execute_script(percy_dom_script)
-        frame_options = {**serialize_options, 'enableJavaScript': True}
-        frame_result = driver.execute_script(
-            "return { snapshot: PercyDOM.serialize(" + json.dumps(frame_options) + "),"
-            " frameUrl: document.URL };"
-        )
-
-        if not frame_result or not frame_result.get('snapshot'):
-            log(f"Serialization returned empty result for frame: {iframe_meta.get('src')}",
-                "debug")
-            return []
-
-        frame_url = frame_result.get('frameUrl') or iframe_meta.get('src') or "unknown-src"
-        log(f"Captured cross-origin iframe (depth {depth}): {frame_url}", "debug")
-
-        collected.append({
-            "iframeData": {"percyElementId": iframe_meta['percyElementId']},
-            "iframeSnapshot": frame_result['snapshot'],
-            "frameUrl": frame_url
-        })
-
-        # Look for cross-origin iframes nested inside this frame and recurse.
-        # Same-origin descendants are already inlined as srcdoc by
-        # PercyDOM.serialize above. Compare each nested-frame origin against
-        # this frame's origin (the immediate parent), not the page origin.
-        if depth < max_frame_depth:
-            current_origin = get_origin(frame_url)
-            try:
-                child_iframes_raw = driver.execute_script(
-                    enumerate_iframes_script(ignore_selectors)
-                )
-            except Exception as e:  # pylint: disable=broad-except
-                log(f"Failed to enumerate nested iframes: {e}", "debug")
-                child_iframes_raw = []
-            child_iframes = child_iframes_raw if isinstance(child_iframes_raw, list) else []
-            next_ancestors = set(ancestor_urls or [])
-            next_ancestors.add(frame_url)
-            if iframe_meta.get('src'):
-                next_ancestors.add(iframe_meta['src'])
-            for child in child_iframes:
-                if _should_skip_iframe(child, current_origin):
-                    continue
-                nested = process_frame_tree(driver, child, depth + 1, next_ancestors, ctx)
-                if nested:
-                    collected.extend(nested)
-
+        _capture_current_frame(driver, iframe_meta, depth, ancestor_urls, ctx, collected)
         return collected
     except PercyContextLost as err:
         # Merge any partial capture from the inner level before propagating.
@@ -418,6 +816,85 @@ def process_frame_tree(driver, iframe_meta, depth, ancestor_urls, ctx):
                     raise lost from e  # noqa: B904
 
 
+def _capture_cors_iframe_on_helper(pool, iframe_meta, page_url, ctx):
+    """Capture one top-level cross-origin iframe by loading its src in a helper
+    session sized to the iframe's rendered box. Returns the frame's entries, or
+    None if the caller should fall back to capturing it through the main driver."""
+    width, height = _frame_size(iframe_meta)
+    try:
+        with pool.acquire() as helper:
+            if isinstance(width, int) and isinstance(height, int) and width > 0 and height > 0:
+                change_window_dimension_and_wait(helper, width, height, 0,
+                                                 wait_for_resize=False,
+                                                 viewport=_chromium_viewport(helper))
+            helper.get(iframe_meta['src'])
+            collected = []
+            _capture_current_frame(helper, iframe_meta, 1,
+                                   {page_url} if page_url else set(), ctx, collected)
+            return collected
+    except Exception as e:  # pylint: disable=broad-except
+        log("Helper session capture failed for %s, retrying in the page: %s", "debug",
+            iframe_meta.get('src'), e)
+        return None
+
+
+def _capture_cors_iframes_in_parallel(pool, iframes, page_url, ctx):
+    """Capture top-level cross-origin iframes concurrently on up to
+    ``pool.max_sessions`` helper sessions, keeping page order."""
+    log("Capturing %d cross-origin iframe(s) on up to %d helper session(s)", "debug",
+        len(iframes), pool.max_sessions)
+    with ThreadPoolExecutor(max_workers=min(pool.max_sessions, len(iframes)),
+                            thread_name_prefix='percy-cors') as executor:
+        return list(executor.map(
+            lambda iframe: _capture_cors_iframe_on_helper(pool, iframe, page_url, ctx),
+            iframes))
+
+
+RESPONSIVE_IFRAME_STRATEGIES = ('per-width', 'once', 'adaptive')
+
+
+def resolve_responsive_iframe_strategy(options, percy_config):
+    """Per-snapshot option, then .percy.yml, then env; 'per-width' by default."""
+    snapshot_config = (percy_config or {}).get('snapshot') or {}
+    for value in (options.get('responsiveIframeStrategy'),
+                  options.get('responsive_iframe_strategy'),
+                  snapshot_config.get('responsiveIframeStrategy'),
+                  os.environ.get('PERCY_RESPONSIVE_IFRAME_STRATEGY')):
+        if value:
+            strategy = str(value).lower()
+            if strategy in RESPONSIVE_IFRAME_STRATEGIES:
+                return strategy
+            log("Unknown responsive iframe strategy %r, using 'per-width'", "debug", value)
+            break
+    return 'per-width'
+
+
+def _reusable_frame_capture(responsive, iframe):
+    """Entries captured for this top-level frame at an earlier width, when the
+    responsive strategy allows reusing them: always for 'once', and for
+    'adaptive' only while the frame's rendered size is unchanged."""
+    if not responsive:
+        return None
+    frame_id = iframe.get('percyElementId')
+    if frame_id not in responsive['entries']:
+        return None
+    if (responsive['strategy'] == 'adaptive'
+            and responsive['sizes'].get(frame_id) != _frame_size(iframe)):
+        return None
+    return responsive['entries'][frame_id]
+
+
+def _remember_frame_capture(responsive, iframe, entries):
+    if responsive:
+        frame_id = iframe.get('percyElementId')
+        responsive['entries'][frame_id] = entries or []
+        responsive['sizes'][frame_id] = _frame_size(iframe)
+
+
+def _frame_size(iframe):
+    return iframe.get('width'), iframe.get('height')
+
+
 def _capture_cors_iframes(driver, page_url, ctx):
     """Top-level walk: enumerate page iframes, recurse into cross-origin ones."""
     try:
@@ -437,20 +914,38 @@ def _capture_cors_iframes(driver, page_url, ctx):
         cors_iframes = []
         skipped = 0
 
+        eligible = []
         for iframe in iframe_info:
             if _should_skip_iframe(iframe, page_origin):
                 skipped += 1
-                continue
-            try:
-                entries = process_frame_tree(
-                    driver, iframe, 1, {page_url} if page_url else set(), ctx
-                )
-            except PercyContextLost as err:
-                log("Aborting further nested CORS capture due to lost frame context",
-                    "debug")
-                if err.partial_capture:
-                    cors_iframes.extend(err.partial_capture)
-                break
+            else:
+                eligible.append(iframe)
+
+        # Entries already known for a frame (reused from an earlier responsive
+        # width, or captured on a helper session); None still needs capturing.
+        responsive = ctx.get('responsive_iframes')
+        results = [_reusable_frame_capture(responsive, iframe) for iframe in eligible]
+        pending = [i for i, entries in enumerate(results) if entries is None]
+        pool = _cors_driver_pool
+        if pool is not None and len(pending) > 1:
+            parallel_results = _capture_cors_iframes_in_parallel(
+                pool, [eligible[i] for i in pending], page_url, ctx)
+            for i, entries in zip(pending, parallel_results):
+                results[i] = entries
+
+        for iframe, entries in zip(eligible, results):
+            if entries is None:
+                try:
+                    entries = process_frame_tree(
+                        driver, iframe, 1, {page_url} if page_url else set(), ctx
+                    )
+                except PercyContextLost as err:
+                    log("Aborting further nested CORS capture due to lost frame context",
+                        "debug")
+                    if err.partial_capture:
+                        cors_iframes.extend(err.partial_capture)
+                    break
+            _remember_frame_capture(responsive, iframe, entries)
             if entries:
                 cors_iframes.extend(entries)
 
@@ -462,8 +957,188 @@ def _capture_cors_iframes(driver, page_url, ctx):
         return []
 
 
+# Cumulative counters for closed shadow root exposure (see expose_closed_shadow_roots).
+CLOSED_SHADOW_ROOT_STATS = {'found': 0, 'exposed': 0, 'cdp_calls': 0, 'seconds': 0.0}
+
+_EXPOSE_SHADOW_ROOTS_FN = (
+    "function() { for (const root of arguments) {"
+    " window.__percyClosedShadowRoots.set(root.host, root); } }"
+)
+_EXPOSE_SHADOW_ROOT_FN = (
+    "function() { window.__percyClosedShadowRoots.set(this.host, this); }"
+)
+
+def _cdp(driver, cmd, params):
+    CLOSED_SHADOW_ROOT_STATS['cdp_calls'] += 1
+    return driver.execute_cdp_cmd(cmd, params)
+
+def _expose_closed_shadow_roots_via_cdp(driver, closed_pairs):
+    """Register each closed shadow root under its host in the page WeakMap and
+    return how many were exposed. ``ShadowRoot.host`` is readable even in closed
+    mode, so only the roots need resolving, and with batching on a single
+    ``Runtime.callFunctionOn`` registers a whole chunk of them. A batch that
+    fails is retried one root at a time."""
+    group = 'percy-closed-shadow-roots'
+    object_ids = []
+    for pair in closed_pairs:
+        try:
+            resolved = _cdp(driver, "DOM.resolveNode", {
+                "backendNodeId": pair["shadowBackendNodeId"], "objectGroup": group})
+            object_id = (resolved.get("object") or {}).get("objectId")
+        except Exception as e:  # pylint: disable=broad-except
+            log("Failed to resolve a closed shadow root via CDP: %s", "debug", e)
+            continue
+        if object_id:
+            object_ids.append(object_id)
+
+    exposed = 0
+    batch_size = PERCY_SHADOW_ROOT_BATCH_SIZE
+    chunks = ([object_ids[i:i + batch_size] for i in range(0, len(object_ids), batch_size)]
+              if batch_size else [])
+    for chunk in chunks:
+        try:
+            _cdp(driver, "Runtime.callFunctionOn", {
+                "functionDeclaration": _EXPOSE_SHADOW_ROOTS_FN,
+                "objectId": chunk[0],
+                "arguments": [{"objectId": object_id} for object_id in chunk]
+            })
+            exposed += len(chunk)
+        except Exception as e:  # pylint: disable=broad-except
+            log("Batched closed shadow root exposure failed, retrying per root: %s",
+                "debug", e)
+            exposed += _expose_each_shadow_root(driver, chunk)
+    if not batch_size:
+        exposed += _expose_each_shadow_root(driver, object_ids)
+
+    if object_ids:
+        try:
+            _cdp(driver, "Runtime.releaseObjectGroup", {"objectGroup": group})
+        except Exception:  # pylint: disable=broad-except
+            pass
+    return exposed
+
+def _expose_each_shadow_root(driver, object_ids):
+    exposed = 0
+    for object_id in object_ids:
+        try:
+            _cdp(driver, "Runtime.callFunctionOn", {
+                "functionDeclaration": _EXPOSE_SHADOW_ROOT_FN, "objectId": object_id})
+            exposed += 1
+        except Exception as e:  # pylint: disable=broad-except
+            log("Failed to expose a closed shadow root via CDP: %s", "debug", e)
+    return exposed
+
+
+def _collect_closed_shadow_pairs(root, closed_pairs=None, seen=None):
+    """Walk a CDP node tree and return {host, shadow} backend-id pairs for every
+    closed shadow root in it. ``seen`` dedupes roots across overlapping trees."""
+    closed_pairs = [] if closed_pairs is None else closed_pairs
+    seen = set() if seen is None else seen
+    # Iterative walker. Recursive Python on a very deep DOM blows past
+    # CPython's recursion limit (~1000) and raises RecursionError, which
+    # the outer broad-except would silently swallow — meaning a deep page
+    # would just lose closed-shadow exposure with no diagnostic. A stack
+    # keeps memory bounded by tree breadth instead of tree depth.
+    stack = [root] if root else []
+    while stack:
+        node = stack.pop()
+        # Skip nodes inside child frame documents — cross-frame closed
+        # shadow roots are not yet supported (their execution context
+        # lacks the WeakMap).
+        if not isinstance(node, dict) or node.get("contentDocument"):
+            continue
+        for sr in (node.get("shadowRoots") or []):
+            if (sr.get("shadowRootType") == "closed"
+                    and sr.get("backendNodeId") not in seen):
+                seen.add(sr.get("backendNodeId"))
+                closed_pairs.append({
+                    "hostBackendNodeId": node.get("backendNodeId"),
+                    "shadowBackendNodeId": sr.get("backendNodeId")
+                })
+            stack.append(sr)
+        for child in (node.get("children") or []):
+            stack.append(child)
+    return closed_pairs
+
+# Collects the outermost custom elements (closed roots are only reachable via
+# CDP, so any custom element may host one), looking through open shadow roots.
+# Stops one past the budget so the caller can tell it was exceeded.
+_CLOSED_SHADOW_CANDIDATES_JS = """(function(budget) {
+  const found = [];
+  const stack = [document.documentElement];
+  while (stack.length && found.length <= budget) {
+    const el = stack.pop();
+    if (!el) continue;
+    if (el.localName && el.localName.indexOf('-') > 0) { found.push(el); continue; }
+    for (const child of el.children) stack.push(child);
+    if (el.shadowRoot) for (const child of el.shadowRoot.children) stack.push(child);
+  }
+  return found;
+})"""
+
+# True as soon as any custom element is found, looking through open shadow roots.
+_HAS_CUSTOM_ELEMENTS_JS = """
+  const pending = [document];
+  while (pending.length) {
+    for (const el of pending.pop().querySelectorAll('*')) {
+      if (el.localName.indexOf('-') > 0) return true;
+      if (el.shadowRoot) pending.push(el.shadowRoot);
+    }
+  }
+  return false;
+"""
+
+def _may_have_closed_shadow_roots(driver):
+    """Cheap in-page probe run before any CDP work. Closed roots are nearly
+    always attached by custom elements, so a page without any is skipped.
+    Set PERCY_FORCE_CLOSED_SHADOW_CAPTURE to also cover closed roots on
+    built-in elements. An inconclusive probe keeps the CDP pass."""
+    if PERCY_FORCE_CLOSED_SHADOW_CAPTURE:
+        return True
+    try:
+        return driver.execute_script(_HAS_CUSTOM_ELEMENTS_JS) is not False
+    except Exception as e:  # pylint: disable=broad-except
+        log("Custom element probe failed, running closed shadow DOM capture: %s", "debug", e)
+        return True
+
+def _prescan_closed_shadow_pairs(driver, budget):
+    """Find closed shadow roots by describing only custom-element subtrees.
+    Returns None when the page has more candidates than ``budget`` (or the scan
+    fails), meaning the caller should fall back to the full document walk.
+    Closed roots attached to built-in elements (e.g. a ``div``) are only seen by
+    the full walk, which is why this path is opt-in."""
+    group = 'percy-closed-shadow-prescan'
+    try:
+        result = _cdp(driver, "Runtime.evaluate", {
+            "expression": f"{_CLOSED_SHADOW_CANDIDATES_JS}({int(budget)})",
+            "objectGroup": group})
+        array_id = ((result or {}).get("result") or {}).get("objectId")
+        if not array_id:
+            return None
+        props = _cdp(driver, "Runtime.getProperties",
+                     {"objectId": array_id, "ownProperties": True})
+        candidates = [p["value"]["objectId"] for p in (props or {}).get("result") or []
+                      if p.get("name", "").isdigit() and (p.get("value") or {}).get("objectId")]
+        if len(candidates) > budget:
+            log("Closed shadow root prescan found %d candidates (budget %d), "
+                "walking the full document", "debug", len(candidates), budget)
+            return None
+        closed_pairs, seen = [], set()
+        for object_id in candidates:
+            described = _cdp(driver, "DOM.describeNode",
+                             {"objectId": object_id, "depth": -1, "pierce": True})
+            _collect_closed_shadow_pairs((described or {}).get("node"), closed_pairs, seen)
+        return closed_pairs
+    except Exception as e:  # pylint: disable=broad-except
+        log("Closed shadow root prescan failed, walking the full document: %s", "debug", e)
+        return None
+    finally:
+        try:
+            _cdp(driver, "Runtime.releaseObjectGroup", {"objectGroup": group})
+        except Exception:  # pylint: disable=broad-except
+            pass
+
 def expose_closed_shadow_roots(driver):
-    # pylint: disable=too-many-nested-blocks
     """Use CDP to find every closed shadow root in the page and stash each
     {host -> shadowRoot} pair in a WeakMap on ``window``. PercyDOM.serialize
     reads from that map to capture closed-mode shadow DOM that would otherwise
@@ -486,76 +1161,44 @@ def expose_closed_shadow_roots(driver):
         log("Skipping closed shadow DOM capture: CDP requires a Chromium browser",
             "debug")
         return
+    if not _may_have_closed_shadow_roots(driver):
+        log("Skipping closed shadow DOM capture: no custom elements on the page", "debug")
+        return
     try:
         driver.execute_cdp_cmd("DOM.enable", {})
     except Exception as e:  # pylint: disable=broad-except
         log(f"CDP unavailable for closed shadow DOM capture: {e}", "debug")
         return
     try:
-        doc = driver.execute_cdp_cmd(
-            "DOM.getDocument", {"depth": -1, "pierce": True}
-        )
-        root = doc.get("root") if isinstance(doc, dict) else None
-        closed_pairs = []
-
-        # Iterative walker. Recursive Python on a very deep DOM blows past
-        # CPython's recursion limit (~1000) and raises RecursionError, which
-        # the outer broad-except would silently swallow — meaning a deep page
-        # would just lose closed-shadow exposure with no diagnostic. A stack
-        # keeps memory bounded by tree breadth instead of tree depth.
-        if root:
-            stack = [root]
-            while stack:
-                node = stack.pop()
-                # Skip nodes inside child frame documents — cross-frame closed
-                # shadow roots are not yet supported (their execution context
-                # lacks the WeakMap).
-                if not isinstance(node, dict) or node.get("contentDocument"):
-                    continue
-                shadow_roots = node.get("shadowRoots") or []
-                for sr in shadow_roots:
-                    if sr.get("shadowRootType") == "closed":
-                        closed_pairs.append({
-                            "hostBackendNodeId": node.get("backendNodeId"),
-                            "shadowBackendNodeId": sr.get("backendNodeId")
-                        })
-                    stack.append(sr)
-                for child in (node.get("children") or []):
-                    stack.append(child)
+        closed_pairs = None
+        if PERCY_SHADOW_DISCOVERY == 'prescan':
+            closed_pairs = _prescan_closed_shadow_pairs(driver, PERCY_SHADOW_DISCOVERY_BUDGET)
+        if closed_pairs is None:
+            doc = driver.execute_cdp_cmd(
+                "DOM.getDocument", {"depth": -1, "pierce": True}
+            )
+            root = doc.get("root") if isinstance(doc, dict) else None
+            closed_pairs = _collect_closed_shadow_pairs(root)
 
         if not closed_pairs:
             return
 
-        log(f"Found {len(closed_pairs)} closed shadow root(s), exposing via CDP",
-            "debug")
-
         # Create the WeakMap on the page (same key as PercyDOM looks up).
         driver.execute_script(
             "window.__percyClosedShadowRoots = "
             "window.__percyClosedShadowRoots || new WeakMap();"
         )
 
-        for pair in closed_pairs:
-            try:
-                host_obj = driver.execute_cdp_cmd(
-                    "DOM.resolveNode", {"backendNodeId": pair["hostBackendNodeId"]}
-                )
-                shadow_obj = driver.execute_cdp_cmd(
-                    "DOM.resolveNode", {"backendNodeId": pair["shadowBackendNodeId"]}
-                )
-                host_id = (host_obj.get("object") or {}).get("objectId")
-                shadow_id = (shadow_obj.get("object") or {}).get("objectId")
-                if not host_id or not shadow_id:
-                    continue
-                driver.execute_cdp_cmd("Runtime.callFunctionOn", {
-                    "functionDeclaration":
-                        "function(shadowRoot) {"
-                        " window.__percyClosedShadowRoots.set(this, shadowRoot); }",
-                    "objectId": host_id,
-                    "arguments": [{"objectId": shadow_id}]
-                })
-            except Exception as e:  # pylint: disable=broad-except
-                log(f"Failed to expose a closed shadow root via CDP: {e}", "debug")
+        started = monotonic()
+        calls_before = CLOSED_SHADOW_ROOT_STATS['cdp_calls']
+        exposed = _expose_closed_shadow_roots_via_cdp(driver, closed_pairs)
+        elapsed = monotonic() - started
+        CLOSED_SHADOW_ROOT_STATS['found'] += len(closed_pairs)
+        CLOSED_SHADOW_ROOT_STATS['exposed'] += exposed
+        CLOSED_SHADOW_ROOT_STATS['seconds'] += elapsed
+        log("Exposed %d/%d closed shadow root(s) via CDP in %.1fms (%d CDP calls)", "debug",
+            exposed, len(closed_pairs), elapsed * 1000,
+            CLOSED_SHADOW_ROOT_STATS['cdp_calls'] - calls_before)
     except Exception as e:  # pylint: disable=broad-except
         log(f"Could not expose closed shadow roots via CDP: {e}", "debug")
     finally:
@@ -577,6 +1220,13 @@ DEFAULT_MAX_FRAME_DEPTH = 3
 HARD_MAX_FRAME_DEPTH = 10
 
 
+UNSUPPORTED_IFRAME_SRC_PREFIXES = (
+    "about:", "chrome:", "chrome-extension:", "devtools:", "edge:",
+    "opera:", "view-source:", "data:", "javascript:", "blob:",
+    "vbscript:", "file:", "ws:", "wss:", "ftp:"
+)
+
+
 def is_unsupported_iframe_src(frame_src):
     """True if a frame's src cannot be navigated/loaded for serialization.
 
@@ -585,12 +1235,7 @@ def is_unsupported_iframe_src(frame_src):
     case-insensitive startswith over the 15 canonical scheme prefixes."""
     if not frame_src:
         return True
-    unsupported_prefixes = (
-        "about:", "chrome:", "chrome-extension:", "devtools:", "edge:",
-        "opera:", "view-source:", "data:", "javascript:", "blob:",
-        "vbscript:", "file:", "ws:", "wss:", "ftp:"
-    )
-    return str(frame_src).lower().startswith(unsupported_prefixes)
+    return str(frame_src).lower().startswith(UNSUPPORTED_IFRAME_SRC_PREFIXES)
 
 
 # Backwards-compatible private alias kept for any external callers.
@@ -803,8 +1448,62 @@ def _wait_for_ready(driver, percy_config, kwargs):
                 pass
 
 
+# Slice of the page-side serialized DOM starting at arguments[0], at most
+# arguments[1] UTF-16 units long, never ending between a surrogate pair.
+# Returns [slice, end].
+_DOM_SLICE_JS = """
+var text = window.__percySerializedDom, start = arguments[0];
+var end = Math.min(start + arguments[1], text.length);
+if (end < text.length) {
+  var code = text.charCodeAt(end - 1);
+  if (code >= 0xD800 && code <= 0xDBFF) end--;
+}
+return [text.slice(start, end), end];
+"""
+
+def _serialize_page_in_chunks(driver, options):
+    """Serialize into a page-side string, then pull it in PERCY_DOM_CHUNK_SIZE
+    slices so no single WebDriver response carries the whole DOM."""
+    length = driver.execute_script(
+        'window.__percySerializedDom = JSON.stringify('
+        f'PercyDOM.serialize({json.dumps(options)}));'
+        'return window.__percySerializedDom.length;')
+    if not isinstance(length, int):
+        raise Exception(f'PercyDOM.serialize returned no snapshot: {length!r}')
+    parts, start = [], 0
+    try:
+        while start < length:
+            part, end = driver.execute_script(_DOM_SLICE_JS, start, PERCY_DOM_CHUNK_SIZE)
+            if end <= start:
+                raise Exception(f'DOM slice at {start} made no progress')
+            parts.append(part)
+            start = end
+    finally:
+        try:
+            driver.execute_script('delete window.__percySerializedDom;')
+        except Exception as e:
+            log("Could not release the page-side serialized DOM: %s", "debug", e)
+    log("Pulled serialized DOM (%d chars) in %d slice(s)", "debug", length, len(parts))
+    return RawJSON(parts)
+
+def _serialize_page(driver, options):
+    """Run PercyDOM.serialize in the page. With PERCY_RAW_DOM_SNAPSHOT the
+    browser returns the snapshot as one JSON string that is kept unparsed
+    (RawJSON) and copied into the POST body as-is; with PERCY_DOM_CHUNK_SIZE
+    that string is pulled in slices."""
+    if PERCY_DOM_CHUNK_SIZE:
+        return _serialize_page_in_chunks(driver, options)
+    if not PERCY_RAW_DOM_SNAPSHOT:
+        return driver.execute_script(f'return PercyDOM.serialize({json.dumps(options)})')
+    text = driver.execute_script(
+        f'return JSON.stringify(PercyDOM.serialize({json.dumps(options)}))')
+    if not isinstance(text, str) or not text.lstrip().startswith('{'):
+        raise Exception(f'PercyDOM.serialize returned no snapshot: {text!r}')
+    return RawJSON(text)
+
 def get_serialized_dom(driver, cookies, percy_config=None, percy_dom_script=None,
-                       skip_readiness=False, readiness_diagnostics=None, **kwargs):
+                       skip_readiness=False, readiness_diagnostics=None,
+                       responsive_iframes=None, **kwargs):
     # 0. Readiness gate before serialize. Graceful on old CLI.
     #    `skip_readiness` lets responsive capture run readiness once before the
     #    width loop and pass diagnostics through, instead of paying the cost
@@ -822,12 +1521,16 @@ def get_serialized_dom(driver, cookies, percy_config=None, percy_dom_script=None
     # concern; the CLI already has it from healthcheck and a top-level
     # `readiness` in the POST body is brittle against future validators.
     kwargs.pop('readiness', None)
+    # Same for the responsive iframe strategy, which capture_responsive_dom
+    # has already resolved into `responsive_iframes`.
+    kwargs.pop('responsiveIframeStrategy', None)
+    kwargs.pop('responsive_iframe_strategy', None)
     # 1. Serialize the main page first (this adds the data-percy-element-ids)
-    dom_snapshot = driver.execute_script(f'return PercyDOM.serialize({json.dumps(kwargs)})')
+    dom_snapshot = _serialize_page(driver, kwargs)
     # Attach readiness diagnostics so the CLI can log timing and pass/fail.
     # `is not None` preserves legitimate falsy returns (e.g. `{}` meaning
     # "gate ran, no notable diagnostics").
-    if readiness_diagnostics is not None and isinstance(dom_snapshot, dict):
+    if readiness_diagnostics is not None and isinstance(dom_snapshot, (dict, RawJSON)):
         dom_snapshot['readiness_diagnostics'] = readiness_diagnostics
     # 2. Process CORS iframes (nested, depth-capped, cycle-guarded, ignore-aware)
     if percy_dom_script:
@@ -836,6 +1539,7 @@ def get_serialized_dom(driver, cookies, percy_config=None, percy_dom_script=None
             'ignore_selectors': resolve_ignore_selectors(kwargs, percy_config),
             'serialize_options': dict(kwargs),
             'percy_dom_script': percy_dom_script,
+            'responsive_iframes': responsive_iframes,
         }
         try:
             page_url = driver.current_url
@@ -848,13 +1552,33 @@ def get_serialized_dom(driver, cookies, percy_config=None, percy_dom_script=None
     dom_snapshot['cookies'] = cookies
     return dom_snapshot
 
-def get_responsive_widths(widths=None):
+# /percy/widths-config responses for the current healthcheck config, keyed by
+# the normalized requested widths. The CLI config is fixed for a run, so the
+# entries live until the healthcheck is refreshed (a new config object).
+_widths_config_cache = {'config': None, 'widths': {}}
+
+def get_responsive_widths(widths=None, percy_config=None):
+    """Return the CLI's responsive widths for ``widths``. With ``percy_config``
+    (the healthcheck config) the result is memoized for as long as that config
+    is the cached one."""
     if widths is None:
         widths = []
+    widths_list = widths if isinstance(widths, list) else []
+    key = tuple(sorted({str(width) for width in widths_list}))
+    cache = _widths_config_cache
+    if percy_config is not None and cache['config'] is percy_config and key in cache['widths']:
+        return list(cache['widths'][key])
+    widths_data = _fetch_responsive_widths(widths_list)
+    if percy_config is not None:
+        if cache['config'] is not percy_config:
+            cache['config'], cache['widths'] = percy_config, {}
+        cache['widths'][key] = list(widths_data)
+    return widths_data
+
+def _fetch_responsive_widths(widths_list):
     try:
-        widths_list = widths if isinstance(widths, list) else []
         query_param = f"?widths={','.join(map(str, widths_list))}" if widths_list else ""
-        response = requests.get(
+        response = get_transport().get(
             f"{PERCY_CLI_API}/percy/widths-config{query_param}",
             timeout=30
         )
@@ -882,12 +1606,43 @@ def _setup_resize_listener(driver):
         window.addEventListener('resize', window._percyResizeHandler);
     """)
 
-def change_window_dimension_and_wait(driver, width, height, resizeCount, wait_for_resize=True):
+def _chromium_viewport(driver):
+    """Return a ChromiumViewport for CDP-capable Chrome drivers, else None."""
+    if not CDP_SUPPORT_SELENIUM or not hasattr(driver, 'execute_cdp_cmd'):
+        return None
+    try:
+        browser_name = str((driver.capabilities or {}).get('browserName', '')).lower()
+    except Exception:  # pylint: disable=broad-except
+        return None
+    return ChromiumViewport(driver) if browser_name == 'chrome' else None
+
+def _restore_window(driver, viewport, width, height, resize_count):
+    """Undo the responsive resizes: clear the emulated viewport on Chromium
+    (and restore the real window only if a resize fell back to it), otherwise
+    resize the window back to ``width`` x ``height``."""
+    if viewport is None:
+        change_window_dimension_and_wait(
+            driver, width, height, resize_count, wait_for_resize=False)
+        return
+    try:
+        viewport.clear()
+    except Exception as e:
+        log("Could not clear the device metrics override: %s", "debug", e)
+    if viewport.window_resized:
+        try:
+            driver.set_window_size(width, height)
+        except Exception as e:
+            log("Could not restore the window size: %s", "debug", e)
+
+def change_window_dimension_and_wait(driver, width, height, resizeCount, wait_for_resize=True,
+                                     viewport=None):
     # resizeCount is retained for call-site/signature stability and the in-page
     # resize listener; its value is no longer polled (see the settle note below).
-    # pylint: disable=unused-argument
+    # pylint: disable=unused-argument, too-many-arguments
     try:
-        if CDP_SUPPORT_SELENIUM and driver.capabilities['browserName'] == 'chrome':
+        if viewport is not None:
+            viewport.resize(width, height)
+        elif CDP_SUPPORT_SELENIUM and driver.capabilities['browserName'] == 'chrome':
             print(f'Attempting to resize using CDP for width {width} and height {height}')
             driver.execute_cdp_cmd('Emulation.setDeviceMetricsOverride', { 'height': height,
                                 'width': width, 'deviceScaleFactor': 1, 'mobile': False })
@@ -902,6 +1657,8 @@ def change_window_dimension_and_wait(driver, width, height, resizeCount, wait_fo
         )
         #driver.execute_script(f"window.resizeTo({width}, {height});")
         driver.set_window_size(width, height)
+        if viewport is not None:
+            viewport.window_resized = True
     # The final window-restore after the responsive loop passes
     # wait_for_resize=False: no snapshot is taken after it, so polling for the
     # resize event is pointless — and that poll (a tight WebDriverWait whose
@@ -913,11 +1670,65 @@ def change_window_dimension_and_wait(driver, width, height, resizeCount, wait_fo
     # `window.resizeCount` via execute_script inside a 1s WebDriverWait, but that
     # timeout only bounds the poll *loop* — not a single execute_script that
     # geckodriver has wedged on, which hung CI jobs until the runner budget ran
-    # out. A short fixed settle delay issues no driver command between the resize
-    # and the snapshot, so it cannot wedge; we trade event-precise timing for a
-    # hang-proof path.
+    # out. The settle wait is now one async script whose JS-side deadline always
+    # calls done() (the same guard _wait_for_ready relies on), or a plain fixed
+    # delay with PERCY_RESIZE_SETTLE=fixed.
     print(f'Resized to {width}x{height}, letting layout settle...')
-    sleep(RESIZE_SETTLE_SECONDS)
+    _wait_for_resize_settle(driver)
+
+# Resolves once the layout has been quiet for arguments[0] ms (ResizeObserver on
+# the root element; its first callback fires on observe, so an already-finished
+# reflow settles after one quiet period) followed by two animation frames so the
+# new layout is painted. arguments[1] is the hard deadline in ms: done() runs by
+# then whatever the page does, and always on a later tick (see _wait_for_ready).
+_RESIZE_SETTLE_JS = """
+var quietMs = arguments[0], deadlineMs = arguments[1];
+var done = arguments[arguments.length - 1];
+var fired = false, quietTimer = null, observer = null;
+function fireDone(status) {
+  if (fired) return;
+  fired = true;
+  if (observer) observer.disconnect();
+  window.removeEventListener('resize', restartQuiet);
+  setTimeout(function() { done(status); }, 0);
+}
+function settle() {
+  if (typeof requestAnimationFrame !== 'function') return fireDone('settled');
+  requestAnimationFrame(function() {
+    requestAnimationFrame(function() { fireDone('settled'); });
+  });
+}
+function restartQuiet() {
+  clearTimeout(quietTimer);
+  quietTimer = setTimeout(settle, quietMs);
+}
+setTimeout(function() { fireDone('timeout'); }, deadlineMs);
+try {
+  window.addEventListener('resize', restartQuiet);
+  if (typeof ResizeObserver === 'function') {
+    observer = new ResizeObserver(restartQuiet);
+    observer.observe(document.documentElement);
+  } else {
+    restartQuiet();
+  }
+} catch (e) { fireDone('error'); }
+"""
+
+def _wait_for_resize_settle(driver):
+    """Wait for the layout to settle after a resize, for at most
+    RESIZE_SETTLE_SECONDS. Falls back to sleeping out the remainder of that
+    bound if the in-page wait fails."""
+    if PERCY_RESIZE_SETTLE == 'fixed' or RESIZE_SETTLE_SECONDS <= 0:
+        sleep(max(0, RESIZE_SETTLE_SECONDS))
+        return
+    started = monotonic()
+    try:
+        status = driver.execute_async_script(
+            _RESIZE_SETTLE_JS, PERCY_RESIZE_QUIET_MS, int(RESIZE_SETTLE_SECONDS * 1000))
+        log("Resize settle: %s after %.0fms", "debug", status, (monotonic() - started) * 1000)
+    except Exception as e:
+        log("Resize settle detection failed, sleeping instead: %s", "debug", e)
+        sleep(max(0, RESIZE_SETTLE_SECONDS - (monotonic() - started)))
 
 def _responsive_sleep():
     if not RESPONSIVE_CAPTURE_SLEEP_TIME:
@@ -929,14 +1740,216 @@ def _responsive_sleep():
     except (TypeError, ValueError):
         pass
 
+def _responsive_iframe_state(config, kwargs):
+    """Cross-origin iframes are captured at every width unless the strategy
+    lets later widths reuse earlier captures (see _reusable_frame_capture).
+    Returns the state shared across widths, or None for 'per-width'."""
+    iframe_strategy = resolve_responsive_iframe_strategy(kwargs, config)
+    if iframe_strategy != 'per-width' and PERCY_RESPONSIVE_CAPTURE_RELOAD_PAGE:
+        log("Page reloads re-number iframes between widths; capturing them per width",
+            'debug')
+        iframe_strategy = 'per-width'
+    if iframe_strategy == 'per-width':
+        return None
+    return {'strategy': iframe_strategy, 'entries': {}, 'sizes': {}}
+
+def _responsive_target_height(config, kwargs, current_height):
+    if not PERCY_RESPONSIVE_CAPTURE_MIN_HEIGHT:
+        return current_height
+    target_height = kwargs.get('minHeight') or config.get('snapshot', {}).get('minHeight')
+    if target_height:
+        try:
+            target_height = int(target_height)
+        except (TypeError, ValueError):
+            log(
+                 f'Invalid minHeight value {target_height!r}; expected integer, '
+                 'using current window height instead.',
+                 'debug',
+             )
+    return target_height
+
+def _count_width_resizes(sizes, order, current_size):
+    resizes, last = 0, current_size
+    for index in order:
+        if sizes[index] != last:
+            resizes, last = resizes + 1, sizes[index]
+    return resizes + (1 if order else 0)
+
+def _order_responsive_widths(sizes, current_size, skip=()):
+    """Return the indexes of ``sizes`` ((width, height) pairs) not in ``skip``
+    in the order the main window should visit them.
+
+    With PERCY_RESPONSIVE_WIDTH_ORDER=nearest (the default), capture starts at
+    the current window size, so its resize is skipped, then moves
+    monotonically away through the widths on one side of it and sweeps the
+    other side back towards it, so the final restore is the smallest step.
+    'config' keeps the order /percy/widths-config returned.
+    """
+    pending = [index for index in range(len(sizes)) if index not in skip]
+    if PERCY_RESPONSIVE_WIDTH_ORDER == 'config' or len(pending) < 2:
+        return pending
+    current_width = current_size[0]
+    ranked = sorted(pending, key=lambda index: sizes[index][0])
+    # The current width comes first, at the current height if one width uses it.
+    start = sorted((index for index in ranked if sizes[index][0] == current_width),
+                   key=lambda index: sizes[index] != current_size)
+    below = [index for index in ranked if sizes[index][0] < current_width]
+    above = [index for index in ranked if sizes[index][0] > current_width]
+    # End on whichever side has the width closest to the current one.
+    if below and (not above or
+                  current_width - sizes[below[-1]][0] <=
+                  sizes[above[0]][0] - current_width):
+        order = start + above + below
+    else:
+        order = start + below[::-1] + above[::-1]
+    saved = (_count_width_resizes(sizes, pending, current_size) -
+             _count_width_resizes(sizes, order, current_size))
+    log(f'Responsive width order {[sizes[index][0] for index in order]} '
+        f'saves {saved} resize(s)', 'debug')
+    return order
+
+def _capture_width_on_helper(pool, url, cookies, config, width, height,
+                             percy_dom_script, kwargs):
+    # pylint: disable=too-many-arguments
+    """Load ``url`` with the page's cookies in a helper session sized to
+    ``width`` and serialize it. Returns None if the caller should capture the
+    width in the main window instead."""
+    try:
+        with pool.acquire() as helper:
+            # Cookies can only be set for the current domain, so load the page
+            # once, copy them over, then load it again at the target size.
+            helper.get(url)
+            for cookie in cookies or []:
+                try:
+                    helper.add_cookie(cookie)
+                except Exception as e:
+                    log("Could not copy cookie %s to helper session: %s", "debug",
+                        cookie.get('name'), e)
+            change_window_dimension_and_wait(helper, width, height, 0, wait_for_resize=False,
+                                             viewport=_chromium_viewport(helper))
+            helper.get(url)
+            inject_percy_dom(helper, percy_dom_script, force=True)
+            expose_closed_shadow_roots(helper)
+            readiness_diagnostics = _wait_for_ready(helper, config, kwargs)
+            _responsive_sleep()
+            dom_snapshot = get_serialized_dom(
+                helper, cookies, percy_dom_script=percy_dom_script, percy_config=config,
+                skip_readiness=True, readiness_diagnostics=readiness_diagnostics, **kwargs)
+            dom_snapshot['width'] = width
+            return dom_snapshot
+    except Exception as e:
+        log("Helper session capture failed for width %s, using the main window: %s", "debug",
+            width, e)
+        return None
+
+def _submit_widths_to_helpers(driver, cookies, config, sizes, current_size,
+                              percy_dom_script, kwargs):
+    # pylint: disable=too-many-arguments
+    """Start serializing each responsive width except the one the main window
+    is already at, concurrently in its own helper session (see
+    enable_parallel_responsive_capture), so the main window can capture its
+    width meanwhile. Returns {index in sizes: future of the DOM snapshot}; a
+    None result is left to the main window."""
+    pool = _responsive_driver_pool
+    indexes = [index for index, size in enumerate(sizes) if size != current_size]
+    if pool is None or len(sizes) < 2 or not indexes:
+        return {}
+    url = driver.current_url
+    log("Capturing %d widths on up to %d helper session(s)", "debug",
+        len(indexes), pool.max_sessions)
+    executor = ThreadPoolExecutor(max_workers=min(pool.max_sessions, len(indexes)),
+                                  thread_name_prefix='percy-responsive')
+    futures = {
+        index: executor.submit(
+            _capture_width_on_helper, pool, url, cookies, config, *sizes[index],
+            percy_dom_script, kwargs)
+        for index in indexes
+    }
+    executor.shutdown(wait=False)
+    return futures
+
+def _capture_in_main_window(driver, cookies, config, percy_dom_script, kwargs, **capture):
+    """Serialize the main window at its current size, reloading the page first
+    with PERCY_RESPONSIVE_CAPTURE_RELOAD_PAGE."""
+    if PERCY_RESPONSIVE_CAPTURE_RELOAD_PAGE:
+        log('Reloading page for width: %s', 'debug', capture['width'])
+        driver.refresh()
+        inject_percy_dom(driver, percy_dom_script, force=True)
+        # Re-prime closed shadow roots after the page reload — the WeakMap
+        # on window was destroyed when navigation happened.
+        expose_closed_shadow_roots(driver)
+        _setup_resize_listener(driver)
+        driver.execute_script("PercyDOM.waitForResize();")
+    _responsive_sleep()
+    dom_snapshot = get_serialized_dom(
+        driver, cookies, percy_dom_script=percy_dom_script,
+        percy_config=config,
+        skip_readiness=True,
+        readiness_diagnostics=capture['readiness_diagnostics'],
+        responsive_iframes=capture['responsive_iframes'],
+        **kwargs)
+    dom_snapshot['width'] = capture['width']
+    return dom_snapshot
+
+def _share_identical_snapshot_parts(dom_snapshot, seen):
+    """Make ``dom_snapshot`` reference the copy in ``seen`` of any ``html``
+    string, ``resources`` entry or raw snapshot text an earlier width already
+    holds, and record its own for later widths, so a page whose layout is
+    CSS-only holds one serialized DOM in memory instead of one per width.
+    Returns the number of characters shared. The POST body is unchanged: the
+    CLI expects each width in full."""
+    if isinstance(dom_snapshot, RawJSON):
+        digest = hashlib.sha256()
+        for part in dom_snapshot.parts:
+            digest.update(part.encode('utf-8'))
+        first = seen.setdefault(('raw', digest.digest()), dom_snapshot.parts)
+        if first is dom_snapshot.parts:
+            return 0
+        dom_snapshot.parts = first
+        return sum(len(part) for part in first)
+    if not isinstance(dom_snapshot, dict):
+        return 0
+    shared = 0
+    html = dom_snapshot.get('html')
+    if isinstance(html, str):
+        first = seen.setdefault(('html', html), html)
+        if first is not html:
+            dom_snapshot['html'] = first
+            shared += len(html)
+    resources = dom_snapshot.get('resources')
+    if not isinstance(resources, list):
+        return shared
+    for index, resource in enumerate(resources):
+        if not isinstance(resource, dict):
+            continue
+        try:
+            first = seen.setdefault(('resource', tuple(sorted(resource.items()))), resource)
+        except TypeError:  # unhashable values
+            continue
+        if first is not resource:
+            resources[index] = first
+            content = resource.get('content')
+            shared += len(content) if isinstance(content, (str, bytes)) else 0
+    return shared
+
+def _dump_responsive_snapshots(dom_snapshots):
+    # Optional debug dump — gated to avoid polluting the user's CWD on every CI run.
+    if not PERCY_DEBUG:
+        return
+    try:
+        with open("output_file.json", "w", encoding="utf-8") as file_handle:
+            json.dump(dom_snapshots, file_handle, indent=4,
+                      default=lambda raw: raw.decode())
+    except Exception as e:  # pylint: disable=broad-except
+        log(f"Could not write debug snapshot dump: {type(e).__name__}: {e}", "debug")
+
 def capture_responsive_dom(driver, cookies, config, percy_dom_script=None, **kwargs):
-    widths = get_responsive_widths(kwargs.get('widths'))
+    widths = get_responsive_widths(kwargs.get('widths'), config)
     log(widths, 'debug')
-    dom_snapshots = []
     window_size = driver.get_window_size()
     current_width, current_height = window_size['width'], window_size['height']
     log(f'Before window size: {current_width}x{current_height}', 'debug')
-    last_window_width = current_width
+    last_window_size = (current_width, current_height)
     resize_count = 0
     # Initialize resize listener once before the loop
     driver.execute_script("PercyDOM.waitForResize()")
@@ -946,61 +1959,60 @@ def capture_responsive_dom(driver, cookies, config, percy_dom_script=None, **kwa
     # Per-width DOM mutations after viewport changes are handled by the
     # `waitForResize` instrumentation above, not by re-running readiness.
     responsive_readiness_diagnostics = _wait_for_ready(driver, config, kwargs)
-    target_height = current_height
-
-    if PERCY_RESPONSIVE_CAPTURE_MIN_HEIGHT:
-        target_height = kwargs.get('minHeight') or config.get('snapshot', {}).get('minHeight')
-        if target_height:
-            try:
-                target_height = int(target_height)
-            except (TypeError, ValueError):
-                log(
-                     f'Invalid minHeight value {target_height!r}; expected integer, '
-                     'using current window height instead.',
-                     'debug',
-                 )
-    for width_dict in widths:
-        width = width_dict['width']
-        height = width_dict.get('height', target_height)
-        print(f'Capturing responsive snapshot for width: {width} and height: {height}')
-        if last_window_width != width:
-            resize_count += 1
-            change_window_dimension_and_wait(driver, width, height, resize_count)
-            last_window_width = width
-
-        if PERCY_RESPONSIVE_CAPTURE_RELOAD_PAGE:
-            log(f'Reloading page for width: {width}', 'debug')
-            driver.refresh()
-            driver.execute_script(percy_dom_script)
-            # Re-prime closed shadow roots after the page reload — the WeakMap
-            # on window was destroyed when navigation happened.
-            expose_closed_shadow_roots(driver)
-            _setup_resize_listener(driver)
-            driver.execute_script("PercyDOM.waitForResize();")
-            resize_count = 0 # Reset count because the listener just started fresh
-        print(f'{width}x{height} ready, taking snapshot...')
-        _responsive_sleep()
-        dom_snapshot = get_serialized_dom(
-            driver, cookies, percy_dom_script=percy_dom_script,
-            percy_config=config,
-            skip_readiness=True,
-            readiness_diagnostics=responsive_readiness_diagnostics,
-            **kwargs)
-        dom_snapshot['width'] = width
-        print(f'Taken snapshot for width: {width}, height: {height}')
-        dom_snapshots.append(dom_snapshot)
-    # Optional debug dump — gated to avoid polluting the user's CWD on every CI run.
-    if PERCY_DEBUG:
-        try:
-            with open("output_file.json", "w", encoding="utf-8") as file_handle:
-                json.dump(dom_snapshots, file_handle, indent=4)
-        except Exception as e:  # pylint: disable=broad-except
-            log(f"Could not write debug snapshot dump: {type(e).__name__}: {e}", "debug")
-    # Restore the original window size after capture. No snapshot follows, so
-    # skip the resize-event poll (wait_for_resize=False) — it serves no purpose
-    # here and is the call that hangs geckodriver in CI.
-    change_window_dimension_and_wait(
-        driver, current_width, current_height, resize_count + 1, wait_for_resize=False)
+    target_height = _responsive_target_height(config, kwargs, current_height)
+    responsive_iframes = _responsive_iframe_state(config, kwargs)
+    viewport = _chromium_viewport(driver)
+    sizes = [(width_dict['width'], width_dict.get('height', target_height))
+             for width_dict in widths]
+    helper_futures = _submit_widths_to_helpers(
+        driver, cookies, config, sizes, last_window_size, percy_dom_script, kwargs)
+    captured = {}
+    # Identical parts are shared as each width arrives, so duplicates are freed
+    # during the loop rather than after every width holds its own copy.
+    shared_parts, shared_chars = {}, 0
+    order = _order_responsive_widths(sizes, last_window_size, helper_futures)
+    resized = False
+    # Always undo the resizes, even if a width fails, so the browser is not
+    # left pinned at an emulated width for the rest of the session.
+    try:
+        while order or helper_futures:
+            for index in order:
+                width, height = sizes[index]
+                print(f'Capturing responsive snapshot for width: {width} and height: {height}')
+                if last_window_size != (width, height):
+                    resize_count += 1
+                    change_window_dimension_and_wait(driver, width, height, resize_count,
+                                                     viewport=viewport)
+                    last_window_size, resized = (width, height), True
+                print(f'{width}x{height} ready, taking snapshot...')
+                captured[index] = _capture_in_main_window(
+                    driver, cookies, config, percy_dom_script, kwargs, width=width,
+                    readiness_diagnostics=responsive_readiness_diagnostics,
+                    responsive_iframes=responsive_iframes)
+                if PERCY_RESPONSIVE_CAPTURE_RELOAD_PAGE:
+                    resize_count = 0 # Reset count because the listener just started fresh
+                shared_chars += _share_identical_snapshot_parts(captured[index], shared_parts)
+                print(f'Taken snapshot for width: {width}, height: {height}')
+            # Then collect the helpers' widths; any they failed to capture are
+            # taken in the main window on the next pass.
+            for index, future in sorted(helper_futures.items()):
+                if future.result() is not None:
+                    captured[index] = future.result()
+                    shared_chars += _share_identical_snapshot_parts(captured[index], shared_parts)
+            helper_futures = {}
+            order = _order_responsive_widths(sizes, last_window_size, captured)
+    finally:
+        # No snapshot follows, so skip the resize-event poll
+        # (wait_for_resize=False) — it serves no purpose here and is the call
+        # that hangs geckodriver in CI. Nothing to restore if the window was
+        # never resized.
+        if resized:
+            _restore_window(driver, viewport, current_width, current_height, resize_count + 1)
+    if shared_chars:
+        log(f'Responsive widths share {shared_chars} characters of identical DOM content',
+            'debug')
+    dom_snapshots = [captured[index] for index in range(len(widths))]
+    _dump_responsive_snapshots(dom_snapshots)
     return dom_snapshots
 
 def is_responsive_snapshot_capture(config, **kwargs):
@@ -1024,7 +2036,7 @@ def percy_snapshot(driver, name, **kwargs):
     try:
         # Inject the DOM serialization script
         percy_dom_script = fetch_percy_dom()
-        driver.execute_script(percy_dom_script)
+        inject_percy_dom(driver, percy_dom_script)
         # Expose closed shadow roots via CDP before serialization so PercyDOM
         # can find them through the WeakMap (Chromium-only; non-Chromium no-ops).
         expose_closed_shadow_roots(driver)
@@ -1047,27 +2059,108 @@ def percy_snapshot(driver, name, **kwargs):
         # Strip SDK-local `readiness` from the snapshot POST body. The CLI
         # already has it via healthcheck; sending it again here risks future
         # CLI-side validators rejecting unknown top-level fields.
-        post_kwargs = {k: v for k, v in kwargs.items() if k != 'readiness'}
-        # Post the DOM to the snapshot endpoint with snapshot options and other info
-        response = requests.post(f'{PERCY_CLI_API}/percy/snapshot', json={**post_kwargs, **{
+        post_kwargs = {k: v for k, v in kwargs.items() if k not in (
+            'readiness', 'responsiveIframeStrategy', 'responsive_iframe_strategy')}
+        payload = {
+            **post_kwargs,
             'client_info': CLIENT_INFO,
             'environment_info': ENV_INFO,
             'dom_snapshot': dom_snapshot,
             'url': driver.current_url,
             'name': name
-        }}, timeout=600)
+        }
+    except Exception as e:
+        log(f'Could not take DOM snapshot "{name}"')
+        log(f'{e}')
+        return None
 
-        # Handle errors
-        response.raise_for_status()
-        data = response.json()
+    # Serialization is done; the driver is free. In async mode the POST runs on
+    # an upload worker and the caller gets a Future for the response data.
+    if _upload_queue is not None:
+        return _upload_queue.submit(_post_snapshot, name, payload)
+    return _post_snapshot(name, payload)
+
+def _resource_reference_url():
+    """The snapshot endpoint that resolves {'sha'} resource references, or
+    None when the CLI in use does not."""
+    if PERCY_RESOURCE_DEDUPE_URL:
+        return PERCY_RESOURCE_DEDUPE_URL
+    data = is_percy_enabled()
+    if data and data.get('resource_references'):
+        return f'{PERCY_CLI_API}/percy/snapshot'
+    return None
 
-        if not data['success']: raise Exception(data['error'])
-        return data.get("data", None)
+# Post the DOM to the snapshot endpoint with snapshot options and other info
+def _post_snapshot(name, payload):
+    try:
+        store, url = _resource_store, None
+        if store is not None:
+            url = _resource_reference_url()
+            if url is None:
+                log('The Percy CLI does not resolve resource references; '
+                    'sending the snapshot in full', 'debug')
+                store = None
+        if store is not None:
+            slim, hashes, saved = store.strip(payload)
+            if saved:
+                try:
+                    data = _send_snapshot(slim, url)
+                    store.confirm(hashes)
+                    log(f'Snapshot "{name}" referenced {saved} bytes of known resources',
+                        'debug')
+                    return data
+                except UnknownResourceReferences as e:
+                    # The CLI may have restarted and lost them: send in full.
+                    log(f'Resource references rejected, resending in full: {e}', 'debug')
+                    store.clear()
+                    hashes = store.strip(payload)[1]
+        data = _send_snapshot(payload, url)
+        if store is not None:
+            store.confirm(hashes)
+        return data
     except Exception as e:
         log(f'Could not take DOM snapshot "{name}"')
         log(f'{e}')
         return None
 
+def _gzip_snapshots():
+    """Whether streamed snapshot bodies are gzipped: only when asked for and
+    the CLI reports it accepts gzip request bodies."""
+    if not PERCY_SNAPSHOT_GZIP:
+        return False
+    data = is_percy_enabled()
+    return bool(data and data.get('gzip_requests'))
+
+def _send_snapshot(payload, url=None):
+    url = url or f'{PERCY_CLI_API}/percy/snapshot'
+    if PERCY_STREAM_SNAPSHOTS:
+        compress = _gzip_snapshots()
+        response = get_transport().post_json_stream(
+            url, payload, compress=compress, timeout=600)
+        if compress and response.status_code in (400, 415):
+            log(f'Gzipped snapshot rejected ({response.status_code}), resending uncompressed',
+                'debug')
+            response = get_transport().post_json_stream(
+                url, payload, compress=False, timeout=600)
+    else:
+        response = get_transport().post(
+            url, data=dumps_json(payload),
+            headers={'Content-Type': 'application/json'}, timeout=600)
+
+    if _resource_store is not None:
+        try:
+            rejected = response.json().get('unknownResources')
+        except (ValueError, AttributeError):
+            rejected = None
+        if rejected: raise UnknownResourceReferences(rejected)
+
+    # Handle errors
+    response.raise_for_status()
+    data = response.json()
+
+    if not data['success']: raise Exception(data['error'])
+    return data.get("data", None)
+
 # Take screenshot on driver
 def percy_automate_screenshot(driver, name, options = None, **kwargs):
     data = is_percy_enabled()
@@ -1104,7 +2197,8 @@ def percy_automate_screenshot(driver, name, options = None, **kwargs):
         options["consider_region_elements"] = consider_region_elements
 
         # Post to automateScreenshot endpoint with driver options and other info
-        response = requests.post(f'{PERCY_CLI_API}/percy/automateScreenshot', json={**kwargs, **{
+        response = get_transport().post(f'{PERCY_CLI_API}/percy/automateScreenshot', json={
+            **kwargs,
             'client_info': CLIENT_INFO,
             'environment_info': ENV_INFO,
             'sessionId': metadata.session_id,
@@ -1112,7 +2206,7 @@ def percy_automate_screenshot(driver, name, options = None, **kwargs):
             'capabilities': metadata.capabilities,
             'snapshotName': name,
             'options': options
-        }}, timeout=600)
+        }, timeout=600)
 
         # Handle errors
         response.raise_for_status()
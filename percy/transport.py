@@ -0,0 +1,131 @@
+import json
+import os
+import threading
+import zlib
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from percy.json_codec import iter_splice_raw, swap_raw
+
+
+def _get_int_env(key, default):
+    try:
+        return int(os.environ.get(key) or default)
+    except (TypeError, ValueError):
+        return default
+
+
+# Size of the pieces a streamed JSON body is sent in.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def iter_json_body(payload, compress=False, chunk_size=STREAM_CHUNK_SIZE):
+    """Encode ``payload`` as JSON incrementally, yielding UTF-8 byte chunks of
+    about ``chunk_size`` (gzip-compressed when ``compress``), so the whole
+    document never exists as one string. RawJSON values are copied in as-is."""
+    gzip = zlib.compressobj(wbits=31) if compress else None
+    buffer, size = [], 0
+    fragments = []
+    payload = swap_raw(payload, fragments)
+    for encoded in json.JSONEncoder().iterencode(payload):
+        pieces = (iter_splice_raw(encoded, fragments)
+                  if fragments and '\\u0000percy-raw:' in encoded else (encoded,))
+        for piece in pieces:
+            buffer.append(piece)
+            size += len(piece)
+            if size < chunk_size:
+                continue
+            chunk = ''.join(buffer).encode('utf-8')
+            buffer, size = [], 0
+            chunk = gzip.compress(chunk) if gzip else chunk
+            if chunk:
+                yield chunk
+    chunk = ''.join(buffer).encode('utf-8')
+    if gzip:
+        chunk = gzip.compress(chunk) + gzip.flush()
+    if chunk:
+        yield chunk
+
+
+# Connection pool size and connect-retry budget for calls to the Percy CLI.
+# Tunable via env for suites that snapshot from many threads at once.
+PERCY_HTTP_POOL_SIZE = _get_int_env('PERCY_HTTP_POOL_SIZE', 10)
+PERCY_HTTP_RETRIES = _get_int_env('PERCY_HTTP_RETRIES', 1)
+
+
+class Transport:
+    """Pooled, keep-alive HTTP transport for every call made to the Percy CLI.
+
+    A single ``HTTPAdapter`` (and therefore a single urllib3 connection pool)
+    is shared by all threads, while each thread gets its own ``requests.Session``
+    on top of it: the pool is thread-safe, session state (cookies, hooks) is not.
+    Retries only cover connection failures — the request never reached the CLI,
+    so re-sending a snapshot POST cannot duplicate it.
+    """
+
+    def __init__(self, pool_size=None, retries=None):
+        self.pool_size = max(1, pool_size if pool_size is not None else PERCY_HTTP_POOL_SIZE)
+        self.retries = max(0, retries if retries is not None else PERCY_HTTP_RETRIES)
+        self._adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            max_retries=Retry(
+                total=self.retries, connect=self.retries,
+                read=0, status=0, redirect=0,
+                backoff_factor=0.1, raise_on_status=False
+            )
+        )
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self._adapter)
+            session.mount('https://', self._adapter)
+            self._local.session = session
+        return session
+
+    def get(self, url, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.session.post(url, **kwargs)
+
+    def post_json_stream(self, url, payload, compress=False, **kwargs):
+        """POST ``payload`` as a chunked JSON body encoded while it is sent,
+        optionally with ``Content-Encoding: gzip``."""
+        headers = {**kwargs.pop('headers', {}), 'Content-Type': 'application/json'}
+        if compress:
+            headers['Content-Encoding'] = 'gzip'
+        return self.session.post(url, data=iter_json_body(payload, compress),
+                                 headers=headers, **kwargs)
+
+    def close(self):
+        self._adapter.close()
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """Return the process-wide transport, creating it on first use."""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = Transport()
+    return _transport
+
+
+def set_transport(transport):
+    """Swap the process-wide transport (e.g. for a stub in tests). Passing
+    ``None`` resets to a fresh default on next use. Returns the previous one."""
+    global _transport
+    with _transport_lock:
+        previous, _transport = _transport, transport
+    return previous
@@ -0,0 +1,80 @@
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+def join_queue(work_queue, timeout=None):
+    """``Queue.join`` with a timeout. Returns False if it elapsed first."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with work_queue.all_tasks_done:
+        while work_queue.unfinished_tasks:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            work_queue.all_tasks_done.wait(remaining)
+    return True
+
+
+class UploadQueue:
+    """Runs snapshot uploads on background worker threads.
+
+    ``submit`` queues a callable and returns a ``concurrent.futures.Future``
+    for its result. The queue is bounded, so once ``max_queue_size`` uploads are
+    waiting the caller blocks until a worker frees a slot instead of buffering
+    unbounded DOM payloads in memory. Pending uploads are drained at interpreter
+    exit, and using the queue as a context manager drains it on exit.
+    """
+
+    def __init__(self, workers=2, max_queue_size=20, exit_timeout=600):
+        self.workers = max(1, workers)
+        self.exit_timeout = exit_timeout
+        self._queue = queue.Queue(maxsize=max(1, max_queue_size))
+        self._threads = []
+        self._lock = threading.Lock()
+        self._atexit_registered = False
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self._ensure_workers()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def flush(self, timeout=None):
+        """Wait until every submitted upload has finished. Returns False if the
+        timeout elapsed first."""
+        return join_queue(self._queue, timeout)
+
+    def pending(self):
+        return self._queue.unfinished_tasks
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def _ensure_workers(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._run, name=f'percy-upload-{len(self._threads)}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            if not self._atexit_registered:
+                atexit.register(self.flush, self.exit_timeout)
+                self._atexit_registered = True
+
+    def _run(self):
+        while True:
+            future, fn, args, kwargs = self._queue.get()
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as e:  # pylint: disable=broad-exception-caught
+                        future.set_exception(e)
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,30 @@
+class ChromiumViewport:
+    """Responsive viewport for Chromium driven by CDP device-metrics emulation.
+
+    ``resize`` sets ``Emulation.setDeviceMetricsOverride`` only when the size
+    differs from the override already in effect, and ``clear`` removes it with
+    ``Emulation.clearDeviceMetricsOverride`` so the page returns to the real
+    window size instead of being pinned by a restoring override. Callers set
+    ``window_resized`` when a resize fell back to the real window, which then
+    needs restoring as well.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.active = None
+        self.window_resized = False
+
+    def resize(self, width, height):
+        """Emulate ``width`` x ``height``; returns False if already in effect."""
+        if self.active == (width, height):
+            return False
+        self.driver.execute_cdp_cmd('Emulation.setDeviceMetricsOverride', {
+            'width': width, 'height': height, 'deviceScaleFactor': 1, 'mobile': False})
+        self.active = (width, height)
+        return True
+
+    def clear(self):
+        if self.active is None:
+            return
+        self.active = None
+        self.driver.execute_cdp_cmd('Emulation.clearDeviceMetricsOverride', {})
@@ -0,0 +1,67 @@
+# pylint: disable=protected-access
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from percy.dom_cache import DomScriptCache, default_cache_dir
+
+
+class TestDomScriptCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = DomScriptCache(os.path.join(self.directory, 'percy'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_store_then_load_round_trips(self):
+        script = 'window.PercyDOM = { serialize() { return "✓"; } };'
+        self.cache.store('1.2.3', script)
+        self.assertEqual(self.cache.load('1.2.3'), script)
+        self.assertIsNone(self.cache.load('1.2.4'))
+
+    def test_store_leaves_no_temp_files(self):
+        self.cache.store('1.0.0', 'a')
+        self.cache.store('1.0.0', 'b')
+        self.assertEqual(os.listdir(self.cache.directory), ['dom-1.0.0.js'])
+        self.assertEqual(self.cache.load('1.0.0'), 'b')
+
+    def test_version_is_sanitized_into_file_name(self):
+        self.assertEqual(os.path.basename(self.cache.path('../1.0.0-beta/x')),
+                         'dom-.._1.0.0-beta_x.js')
+
+    def test_corrupt_entries_are_discarded(self):
+        self.cache.store('1.0.0', 'original')
+        path = self.cache.path('1.0.0')
+        with open(path, 'ab') as f:
+            f.write(b'tampered')
+        self.assertIsNone(self.cache.load('1.0.0'))
+        self.assertFalse(os.path.exists(path))
+
+        for content in (b'', b'no header line', b'// not-percy\nbody'):
+            with open(path, 'wb') as f:
+                f.write(content)
+            self.assertIsNone(self.cache.load('1.0.0'))
+            self.assertFalse(os.path.exists(path))
+
+    def test_failed_write_removes_temp_file(self):
+        with patch('percy.dom_cache.os.replace', side_effect=OSError('read-only')):
+            with self.assertRaises(OSError):
+                self.cache.store('1.0.0', 'script')
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+    def test_discard_ignores_missing_files(self):
+        DomScriptCache._discard(os.path.join(self.directory, 'missing'))
+
+    def test_default_dir_honours_xdg_cache_home(self):
+        with patch.dict(os.environ, {'XDG_CACHE_HOME': '/tmp/xdg'}):
+            self.assertEqual(default_cache_dir(), os.path.join('/tmp/xdg', 'percy'))
+            self.assertEqual(DomScriptCache().directory, os.path.join('/tmp/xdg', 'percy'))
+        with patch.dict(os.environ, {'XDG_CACHE_HOME': ''}):
+            self.assertTrue(default_cache_dir().endswith(os.path.join('.cache', 'percy')))
+
+
+if __name__ == '__main__':
+    unittest.main()
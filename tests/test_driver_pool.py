@@ -0,0 +1,84 @@
+# pylint: disable=protected-access
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+
+from percy.driver_pool import DriverPool
+
+
+class TestDriverPool(unittest.TestCase):
+    def test_sessions_are_created_lazily_and_reused(self):
+        factory = MagicMock(side_effect=MagicMock)
+        pool = DriverPool(factory, max_sessions=2)
+        self.assertEqual(pool.size(), 0)
+
+        with pool.acquire() as first:
+            pass
+        with pool.acquire() as second:
+            pass
+
+        self.assertIs(first, second)
+        self.assertEqual(factory.call_count, 1)
+
+    def test_acquire_blocks_at_max_sessions(self):
+        pool = DriverPool(MagicMock, max_sessions=1)
+        acquired = threading.Event()
+
+        def borrow():
+            with pool.acquire():
+                acquired.set()
+
+        with pool.acquire():
+            worker = threading.Thread(target=borrow)
+            worker.start()
+            self.assertFalse(acquired.wait(0.1))
+        worker.join(5)
+
+        self.assertTrue(acquired.is_set())
+        self.assertEqual(pool.size(), 1)
+
+    def test_failed_factory_frees_the_slot(self):
+        factory = MagicMock(side_effect=[Exception('no browser'), MagicMock()])
+        pool = DriverPool(factory, max_sessions=1)
+
+        with self.assertRaises(Exception):
+            with pool.acquire():
+                pass  # pragma: no cover
+        with pool.acquire() as driver:
+            self.assertIsNotNone(driver)
+
+    def test_session_that_raised_is_quit_and_replaced(self):
+        drivers = [MagicMock(), MagicMock()]
+        drivers[0].quit.side_effect = Exception('invalid session id')
+        pool = DriverPool(MagicMock(side_effect=drivers), max_sessions=1)
+
+        with self.assertRaises(ValueError):
+            with pool.acquire() as crashed:
+                raise ValueError('invalid session id')
+        drivers[0].quit.assert_called_once_with()
+        self.assertEqual(pool.size(), 0)
+
+        with pool.acquire() as replacement:
+            pass
+        self.assertIs(crashed, drivers[0])
+        self.assertIs(replacement, drivers[1])
+        self.assertEqual(pool.size(), 1)
+
+    @patch('percy.driver_pool.atexit.register')
+    def test_close_quits_every_session(self, mock_register):
+        drivers = [MagicMock(), MagicMock()]
+        drivers[1].quit.side_effect = Exception('already gone')
+        pool = DriverPool(MagicMock(side_effect=drivers), max_sessions=2)
+
+        with pool.acquire(), pool.acquire():
+            pass
+        pool.close()
+
+        for driver in drivers:
+            driver.quit.assert_called_once_with()
+        self.assertEqual(pool.size(), 0)
+        mock_register.assert_called_once_with(pool.close)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import json
+import unittest
+
+from percy.frame_cache import FrameCaptureCache
+
+URL = 'https://widget.example.net/embed'
+
+
+class TestFrameCaptureCache(unittest.TestCase):
+    def test_put_then_get_round_trips(self):
+        cache = FrameCaptureCache()
+        self.assertIsNone(cache.get(URL, 'fp'))
+        self.assertTrue(cache.put(URL, 'fp', {'html': '<x/>'}))
+
+        self.assertEqual(cache.get(URL, 'fp'), {'html': '<x/>'})
+        self.assertIsNone(cache.get(URL, 'other-fp'))
+        self.assertEqual(cache.stats(), {'entries': 1, 'bytes': len(json.dumps({'html': '<x/>'})),
+                                         'hits': 1, 'stores': 1})
+
+    def test_keys_for_includes_redirect_targets(self):
+        cache = FrameCaptureCache()
+        cache.put(URL, 'fp1', {})
+        cache.put('https://cdn.example.net/final', 'fp2', {}, src=URL)
+        cache.put('https://elsewhere.example.org/', 'fp3', {})
+
+        self.assertEqual(sorted(cache.keys_for(URL)), [
+            FrameCaptureCache.key('https://cdn.example.net/final', 'fp2'),
+            FrameCaptureCache.key(URL, 'fp1')])
+        self.assertEqual(cache.keys_for('https://unknown.example.com/'), [])
+
+    def test_least_recently_used_entry_is_evicted_by_count(self):
+        cache = FrameCaptureCache(max_entries=2)
+        cache.put(URL, 'a', {})
+        cache.put(URL, 'b', {})
+        cache.get(URL, 'a')
+        cache.put(URL, 'c', {})
+
+        self.assertIsNotNone(cache.get(URL, 'a'))
+        self.assertIsNone(cache.get(URL, 'b'))
+        self.assertEqual(cache.stats()['entries'], 2)
+
+    def test_memory_cap_evicts_and_rejects_oversized_entries(self):
+        snapshot = {'html': 'x' * 50}
+        size = len(json.dumps(snapshot))
+        cache = FrameCaptureCache(max_bytes=size * 2)
+        for fp in ('a', 'b', 'c'):
+            cache.put(URL, fp, snapshot)
+
+        self.assertEqual(cache.stats()['bytes'], size * 2)
+        self.assertIsNone(cache.get(URL, 'a'))
+        self.assertFalse(cache.put(URL, 'huge', {'html': 'x' * size * 3}))
+
+    def test_replacing_an_entry_keeps_the_size_accurate(self):
+        cache = FrameCaptureCache()
+        cache.put(URL, 'fp', {'html': 'long' * 10})
+        cache.put(URL, 'fp', {})
+        self.assertEqual(cache.stats()['bytes'], len(json.dumps({})))
+
+    def test_clear(self):
+        cache = FrameCaptureCache()
+        cache.put('https://cdn.example.net/final', 'fp', {}, src=URL)
+        cache.clear()
+        self.assertEqual(cache.keys_for(URL), [])
+        self.assertEqual(cache.stats()['bytes'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
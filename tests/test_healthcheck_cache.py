@@ -0,0 +1,86 @@
+# pylint: disable=protected-access
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from percy.healthcheck_cache import SharedHealthcheck
+
+PAYLOAD = {'session_type': 'web', 'config': {}, 'widths': {}, 'core_version': '1.0.0'}
+
+
+class TestSharedHealthcheck(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.shared = SharedHealthcheck('http://localhost:5338', 'build-1', ttl=60,
+                                        directory=self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_store_then_load_round_trips(self):
+        self.assertIsNone(self.shared.load())
+        self.shared.store(PAYLOAD)
+        self.assertEqual(self.shared.load(), PAYLOAD)
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(self.shared.path)])
+
+    def test_entries_are_per_cli_address_and_run(self):
+        other_cli = SharedHealthcheck('http://localhost:6000', 'build-1', directory=self.directory)
+        other_run = SharedHealthcheck('http://localhost:5338', 'build-2', directory=self.directory)
+        self.assertEqual(len({self.shared.path, other_cli.path, other_run.path}), 3)
+        self.shared.store(PAYLOAD)
+        self.assertIsNone(other_cli.load())
+        self.assertIsNone(other_run.load())
+
+    def test_entry_of_another_run_is_ignored(self):
+        self.shared.store(PAYLOAD)
+        with open(self.shared.path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+        with open(self.shared.path, 'w', encoding='utf-8') as f:
+            json.dump({**entry, 'run_id': 'build-0'}, f)
+        self.assertIsNone(self.shared.load())
+
+    def test_default_directory_is_per_user(self):
+        with patch.dict(os.environ, {'XDG_CACHE_HOME': self.directory}):
+            shared = SharedHealthcheck('x', 'build-1')
+        self.assertEqual(shared.directory, os.path.join(self.directory, 'percy', 'healthcheck'))
+        shared.store(PAYLOAD)
+        self.assertEqual(shared.load(), PAYLOAD)
+        self.assertEqual(os.stat(shared.directory).st_mode & 0o777, 0o700)
+
+    def test_store_prunes_expired_entries_of_other_runs(self):
+        stale = SharedHealthcheck('http://localhost:5338', 'build-0', directory=self.directory)
+        stale.store(PAYLOAD)
+        with patch('percy.healthcheck_cache.time.time', return_value=10 ** 12):
+            self.shared.store(PAYLOAD)
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(self.shared.path)])
+
+    def test_expired_entries_are_ignored(self):
+        self.shared.store(PAYLOAD)
+        with patch('percy.healthcheck_cache.time.time', return_value=10 ** 12):
+            self.assertIsNone(self.shared.load())
+
+    def test_malformed_entries_are_ignored(self):
+        for content in ('not json', json.dumps({'payload': PAYLOAD}),
+                        json.dumps({'timestamp': 'soon', 'payload': PAYLOAD})):
+            with open(self.shared.path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            self.assertIsNone(self.shared.load())
+
+    def test_clear_removes_the_entry(self):
+        self.shared.store(PAYLOAD)
+        self.shared.clear()
+        self.assertIsNone(self.shared.load())
+        self.shared.clear()  # already gone, must not raise
+
+    def test_failed_write_removes_temp_file(self):
+        with patch('percy.healthcheck_cache.os.replace', side_effect=OSError('read-only')):
+            with self.assertRaises(OSError):
+                self.shared.store(PAYLOAD)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
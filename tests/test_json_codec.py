@@ -0,0 +1,102 @@
+# pylint: disable=protected-access
+import json
+import os
+import unittest
+from unittest.mock import patch
+
+from percy import json_codec
+from percy.json_codec import RawJSON
+
+
+class TestJsonCodec(unittest.TestCase):
+    PAYLOAD = {'name': 'Home', 'dom_snapshot': {'html': '<p>café ☃</p>', 'width': 375},
+               'resources': [], 'enableJavaScript': True, 'minHeight': None}
+
+    def setUp(self):
+        self.addCleanup(json_codec.set_encoder, json_codec._encoder)
+
+    def test_every_available_encoder_round_trips_to_bytes(self):
+        for name in json_codec.available_encoders():
+            json_codec.set_encoder(name)
+            encoded = json_codec.dumps(self.PAYLOAD)
+            self.assertIsInstance(encoded, bytes)
+            self.assertEqual(json.loads(encoded), self.PAYLOAD)
+            self.assertEqual(json_codec.encoder_name(), name)
+
+    def test_stdlib_is_always_available_and_last(self):
+        self.assertEqual(json_codec.available_encoders()[-1], 'json')
+
+    def test_custom_encoder_can_be_installed_and_restored(self):
+        previous = json_codec.set_encoder(lambda obj: b'{}')
+        self.assertEqual(json_codec.dumps(self.PAYLOAD), b'{}')
+        self.assertEqual(json_codec.encoder_name(), '<lambda>')
+        json_codec.set_encoder(previous)
+        self.assertEqual(json.loads(json_codec.dumps(self.PAYLOAD)), self.PAYLOAD)
+
+    def test_unavailable_encoder_is_rejected(self):
+        with self.assertRaises(ValueError):
+            json_codec.set_encoder('simdjson')
+
+    def test_env_selects_the_encoder_and_ignores_unknown_names(self):
+        with patch.dict(os.environ, {'PERCY_JSON_ENCODER': 'json'}):
+            self.assertIs(json_codec._default_encoder(), json_codec.ENCODERS['json'])
+        with patch.dict(os.environ, {'PERCY_JSON_ENCODER': 'nope'}):
+            self.assertIs(json_codec._default_encoder(), json_codec.ENCODERS[
+                'orjson' if json_codec.orjson is not None else 'json'])
+
+
+class TestRawJSON(unittest.TestCase):
+    TEXT = '{"html":"<p>caf\\u00e9 \u2603</p>","resources":[]}'
+
+    def setUp(self):
+        self.addCleanup(json_codec.set_encoder, json_codec._encoder)
+
+    def test_raw_text_is_spliced_into_the_payload_with_extra_keys(self):
+        raw = RawJSON(self.TEXT)
+        raw['cookies'] = [{'name': 'a'}]
+        raw['width'] = 375
+        payload = {'name': 'Home', 'dom_snapshot': [raw, RawJSON('{}')]}
+
+        for name in json_codec.available_encoders():
+            json_codec.set_encoder(name)
+            encoded = json_codec.dumps(payload)
+            self.assertIn(self.TEXT[:-1].encode('utf-8'), encoded)
+            self.assertEqual(json.loads(encoded), {'name': 'Home', 'dom_snapshot': [
+                {'html': '<p>caf\u00e9 \u2603</p>', 'resources': [],
+                 'cookies': [{'name': 'a'}], 'width': 375}, {}]})
+
+    def test_mapping_access_reads_only_the_extra_keys(self):
+        raw = RawJSON(self.TEXT)
+        raw['width'] = 768
+        self.assertEqual((raw['width'], raw.get('html'), 'width' in raw), (768, None, True))
+        self.assertEqual(raw.decode()['width'], 768)
+
+    def test_sliced_text_is_encoded_without_joining_slices(self):
+        raw = RawJSON(['{"html":"<p>', 'x</p>"', '}'])
+        raw['width'] = 375
+        self.assertEqual(list(raw.iter_encoded())[:2], ['{"html":"<p>', 'x</p>"'])
+        self.assertEqual(raw.decode(), {'html': '<p>x</p>', 'width': 375})
+        self.assertEqual(RawJSON(['{', '}']).text, '{}')
+
+    def test_whitespace_slices_inside_strings_are_kept(self):
+        text = json.dumps({'html': '<pre>a' + ' ' * 10 + 'b</pre>'}) + '  '
+        raw = RawJSON([text[i:i + 4] for i in range(0, len(text), 4)])
+        raw['width'] = 375
+        self.assertEqual(raw.decode(), {'html': '<pre>a' + ' ' * 10 + 'b</pre>', 'width': 375})
+        empty = RawJSON(['{', '  ', '}', ' '])
+        empty['width'] = 375
+        self.assertEqual(empty.decode(), {'width': 375})
+
+    def test_non_object_text_cannot_take_extra_keys(self):
+        raw = RawJSON('[1, 2]')
+        raw['width'] = 375
+        with self.assertRaises(ValueError):
+            json_codec.dumps({'dom_snapshot': raw})
+
+    def test_unencodable_values_still_raise(self):
+        with self.assertRaises(TypeError):
+            json_codec.dumps({'when': object()})
+
+
+if __name__ == '__main__':
+    unittest.main()
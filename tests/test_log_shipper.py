@@ -0,0 +1,88 @@
+# pylint: disable=protected-access
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+
+from percy.log_shipper import LogShipper
+from percy.transport import set_transport
+
+URL = 'http://localhost:5338/percy/log'
+
+
+class TestLogShipper(unittest.TestCase):
+    def setUp(self):
+        self.transport = MagicMock()
+        self.previous = set_transport(self.transport)
+
+    def tearDown(self):
+        set_transport(self.previous)
+
+    def test_entries_are_posted_by_the_worker(self):
+        shipper = LogShipper(URL)
+        shipper.enqueue('one', 'info')
+        shipper.enqueue('two', 'debug')
+
+        self.assertTrue(shipper.flush(5))
+        self.transport.post.assert_any_call(
+            URL, json={'message': 'one', 'level': 'info'}, timeout=1)
+        self.transport.post.assert_any_call(
+            URL, json={'message': 'two', 'level': 'debug'}, timeout=1)
+        self.assertEqual(shipper.stats(),
+                         {'sent': 2, 'failed': 0, 'dropped': 0, 'pending': 0})
+
+    def test_enqueue_drops_and_counts_when_queue_is_full(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def slow_post(*_args, **_kwargs):
+            started.set()
+            release.wait(5)
+        self.transport.post.side_effect = slow_post
+
+        shipper = LogShipper(URL, max_queue_size=1)
+        self.assertTrue(shipper.enqueue('in-flight', 'info'))
+        started.wait(5)
+        self.assertTrue(shipper.enqueue('queued', 'info'))
+        self.assertFalse(shipper.enqueue('dropped', 'info'))
+        self.assertFalse(shipper.flush(0.05))
+
+        release.set()
+        self.assertTrue(shipper.flush(5))
+        self.assertEqual(shipper.stats()['dropped'], 1)
+        self.assertEqual(shipper.stats()['sent'], 2)
+
+    def test_failed_posts_are_counted_and_reported(self):
+        self.transport.post.side_effect = Exception('cli down')
+        errors = []
+        shipper = LogShipper(URL, on_error=errors.append)
+        shipper.enqueue('lost', 'info')
+
+        self.assertTrue(shipper.flush(5))
+        self.assertEqual(shipper.stats()['failed'], 1)
+        self.assertEqual(str(errors[0]), 'cli down')
+
+    def test_worker_drains_in_batches(self):
+        shipper = LogShipper(URL, batch_size=3)
+        with patch.object(shipper, '_ensure_worker'):
+            for i in range(5):
+                shipper.enqueue(str(i), 'info')
+        with patch.object(shipper, '_send', wraps=shipper._send) as mock_send:
+            shipper._ensure_worker()
+            self.assertTrue(shipper.flush(5))
+
+        self.assertEqual([len(c.args[0]) for c in mock_send.call_args_list], [3, 2])
+
+    @patch('percy.log_shipper.atexit.register')
+    def test_worker_starts_once_and_registers_exit_flush(self, mock_register):
+        shipper = LogShipper(URL, exit_timeout=2)
+        shipper.enqueue('a', 'info')
+        worker = shipper._worker
+        shipper.enqueue('b', 'info')
+
+        self.assertIs(shipper._worker, worker)
+        mock_register.assert_called_once_with(shipper.flush, 2)
+        self.assertTrue(shipper.flush(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import hashlib
+import threading
+import unittest
+
+from percy.resource_store import ResourceStore
+
+
+def _snapshot(*contents):
+    return {'html': '<p></p>', 'resources': [
+        {'url': f'http://localhost/{i}.png', 'content': content, 'mimetype': 'image/png'}
+        for i, content in enumerate(contents)]}
+
+
+class TestResourceStore(unittest.TestCase):
+    def test_unconfirmed_bodies_are_sent_in_full(self):
+        store = ResourceStore()
+        payload = {'name': 'Home', 'dom_snapshot': _snapshot('AAAA')}
+
+        stripped, hashes, saved = store.strip(payload)
+
+        self.assertIs(stripped, payload)
+        self.assertEqual(hashes, {hashlib.sha256(b'AAAA').hexdigest()})
+        self.assertEqual(saved, 0)
+
+    def test_confirmed_bodies_become_references_without_touching_the_original(self):
+        store = ResourceStore()
+        first = {'name': 'Home', 'dom_snapshot': _snapshot('AAAA')}
+        store.confirm(store.strip(first)[1])
+        second = {'name': 'About', 'dom_snapshot': [_snapshot('AAAA', 'BBBB'), _snapshot()]}
+
+        stripped, hashes, saved = store.strip(second)
+
+        self.assertEqual(stripped['dom_snapshot'][0]['resources'], [
+            {'url': 'http://localhost/0.png', 'mimetype': 'image/png',
+             'sha': hashlib.sha256(b'AAAA').hexdigest()},
+            second['dom_snapshot'][0]['resources'][1]])
+        self.assertIs(stripped['dom_snapshot'][1], second['dom_snapshot'][1])
+        self.assertEqual(second['dom_snapshot'][0]['resources'][0]['content'], 'AAAA')
+        self.assertEqual(hashes, {hashlib.sha256(b'BBBB').hexdigest()})
+        self.assertEqual(saved, 4)
+
+    def test_nested_iframe_resources_are_deduped(self):
+        store = ResourceStore()
+        store.confirm({ResourceStore.digest('AAAA')})
+        payload = {'dom_snapshot': {'resources': [], 'corsIframes': [
+            {'iframeSnapshot': _snapshot('AAAA')}]}}
+
+        stripped = store.strip(payload)[0]
+
+        resource = stripped['dom_snapshot']['corsIframes'][0]['iframeSnapshot']['resources'][0]
+        self.assertNotIn('content', resource)
+
+    def test_clear_forgets_every_hash(self):
+        store = ResourceStore()
+        store.confirm({'a', 'b'})
+        store.clear()
+        self.assertEqual(store.size(), 0)
+
+    def test_confirm_is_thread_safe(self):
+        store = ResourceStore()
+        threads = [threading.Thread(target=store.confirm, args=({str(i)},)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(store.size(), 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
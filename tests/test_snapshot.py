@@ -124,6 +124,15 @@ def mock_screenshot(fail=False, data=False):
         }),
         status=(500 if fail else 200))
 
+def last_cli_request():
+    # Logs are shipped to the CLI from a background thread and can land after
+    # the request under test, so drain them and look past them.
+    local.flush_logs(5)
+    for req in reversed(httpretty.latest_requests()):
+        if req.path != '/percy/log':
+            return req
+    return httpretty.last_request()
+
 # pylint: disable=too-many-public-methods
 class TestPercySnapshot(unittest.TestCase):
     @classmethod
@@ -145,6 +154,8 @@ class TestPercySnapshot(unittest.TestCase):
         httpretty.enable()
 
     def tearDown(self):
+        # drain queued logs while httpretty is still intercepting
+        local.flush_logs(5)
         httpretty.disable()
         httpretty.reset()
 
@@ -165,7 +176,7 @@ class TestPercySnapshot(unittest.TestCase):
 
             mock_print.assert_called_with(f'{LABEL} Percy is not running, disabling snapshots')
 
-        self.assertEqual(httpretty.last_request().path, '/percy/healthcheck')
+        self.assertEqual(last_cli_request().path, '/percy/healthcheck')
 
     def test_disables_snapshots_when_the_healthcheck_version_is_wrong(self):
         mock_healthcheck(fail=True, fail_how='wrong-version')
@@ -176,7 +187,7 @@ class TestPercySnapshot(unittest.TestCase):
 
             mock_print.assert_called_with(f'{LABEL} Unsupported Percy CLI version, 2.0.0')
 
-        self.assertEqual(httpretty.last_request().path, '/percy/healthcheck')
+        self.assertEqual(last_cli_request().path, '/percy/healthcheck')
 
     def test_disables_snapshots_when_the_healthcheck_version_is_missing(self):
         mock_healthcheck(fail=True, fail_how='no-version')
@@ -190,7 +201,7 @@ class TestPercySnapshot(unittest.TestCase):
                 'Please uninstall @percy/agent and install @percy/cli instead. '
                 'https://www.browserstack.com/docs/percy/migration/migrate-to-cli')
 
-        self.assertEqual(httpretty.last_request().path, '/percy/healthcheck')
+        self.assertEqual(last_cli_request().path, '/percy/healthcheck')
 
     def test_posts_snapshots_to_the_local_percy_server(self):
         mock_healthcheck()
@@ -202,7 +213,7 @@ class TestPercySnapshot(unittest.TestCase):
         percy_snapshot(self.driver, 'Snapshot 1')
         response = percy_snapshot(self.driver, 'Snapshot 2', enable_javascript=True)
 
-        self.assertEqual(httpretty.last_request().path, '/percy/snapshot')
+        self.assertEqual(last_cli_request().path, '/percy/snapshot')
 
         snap_bodies, seen = [], set()
         for req in httpretty.latest_requests():
@@ -234,7 +245,7 @@ class TestPercySnapshot(unittest.TestCase):
         percy_snapshot(self.driver, 'Snapshot 1')
         response = percy_snapshot(self.driver, 'Snapshot 2', enable_javascript=True, sync=True)
 
-        self.assertEqual(httpretty.last_request().path, '/percy/snapshot')
+        self.assertEqual(last_cli_request().path, '/percy/snapshot')
 
         snap_bodies, seen = [], set()
         for req in httpretty.latest_requests():
@@ -283,7 +294,7 @@ class TestPercySnapshot(unittest.TestCase):
         self.assertEqual(window_size['width'], new_window_size['width'])
         self.assertEqual(window_size['height'], new_window_size['height'])
 
-        self.assertEqual(httpretty.last_request().path, '/percy/snapshot')
+        self.assertEqual(last_cli_request().path, '/percy/snapshot')
 
         s1 = httpretty.latest_requests()[5].parsed_body
         self.assertEqual(s1['name'], 'Snapshot 1')
@@ -311,7 +322,7 @@ class TestPercySnapshot(unittest.TestCase):
 
         percy_snapshot(self.driver, 'Snapshot 1', responsiveSnapshotCapture = True)
 
-        self.assertEqual(httpretty.last_request().path, '/percy/snapshot')
+        self.assertEqual(last_cli_request().path, '/percy/snapshot')
 
         s1 = httpretty.latest_requests()[2].parsed_body
         self.assertEqual(s1['name'], 'Snapshot 1')
@@ -344,7 +355,7 @@ class TestPercySnapshot(unittest.TestCase):
         self.assertEqual(window_size['width'], new_window_size['width'])
         self.assertEqual(window_size['height'], new_window_size['height'])
 
-        self.assertEqual(httpretty.last_request().path, '/percy/snapshot')
+        self.assertEqual(last_cli_request().path, '/percy/snapshot')
 
         # Filter snapshot POSTs robustly (httpretty 1.1.x may double-record;
         # first record sometimes lacks body — deduplicate by snapshot name)
@@ -382,7 +393,7 @@ class TestPercySnapshot(unittest.TestCase):
 
         percy_snapshot(self.driver, 'Snapshot 1', responsiveSnapshotCapture = True)
 
-        self.assertEqual(httpretty.last_request().path, '/percy/snapshot')
+        self.assertEqual(last_cli_request().path, '/percy/snapshot')
 
         snap_bodies = [
             r.parsed_body for r in httpretty.latest_requests()
@@ -434,9 +445,9 @@ class TestPercySnapshot(unittest.TestCase):
             with patch.object(driver, 'capabilities', new={ 'browserName': 'chrome' }):
                 percy_snapshot(driver, 'Snapshot 1', responsiveSnapshotCapture = True, width = 600)
 
-        self.assertEqual(httpretty.last_request().path, '/percy/snapshot')
+        self.assertEqual(last_cli_request().path, '/percy/snapshot')
 
-        s1 = httpretty.last_request().parsed_body
+        s1 = last_cli_request().parsed_body
         self.assertEqual(s1['name'], 'Snapshot 1')
         self.assertEqual(s1['url'], 'http://localhost:8000/')
         self.assertEqual(s1['dom_snapshot'], expected_dom_snapshot)
@@ -448,7 +459,7 @@ class TestPercySnapshot(unittest.TestCase):
 
         percySnapshot(browser=self.driver, name='Snapshot')
 
-        self.assertEqual(httpretty.last_request().path, '/percy/snapshot')
+        self.assertEqual(last_cli_request().path, '/percy/snapshot')
 
         snap_bodies = [
             r.parsed_body for r in httpretty.latest_requests()
@@ -471,6 +482,7 @@ class TestPercySnapshot(unittest.TestCase):
 
             mock_print.assert_any_call(f'{LABEL} Could not take DOM snapshot "Snapshot 1"')
 
+        local.flush_logs(5)
         log_bodies = [
             req.parsed_body
             for req in httpretty.latest_requests()
@@ -659,6 +671,8 @@ class TestPercyScreenshot(unittest.TestCase):
         httpretty.enable()
 
     def tearDown(self):
+        # drain queued logs while httpretty is still intercepting
+        local.flush_logs(5)
         httpretty.disable()
         httpretty.reset()
 
@@ -679,7 +693,7 @@ class TestPercyScreenshot(unittest.TestCase):
 
             mock_print.assert_called_with(f'{LABEL} Percy is not running, disabling snapshots')
 
-        self.assertEqual(httpretty.last_request().path, '/percy/healthcheck')
+        self.assertEqual(last_cli_request().path, '/percy/healthcheck')
 
     def test_disables_screenshot_when_the_healthcheck_version_is_wrong(self):
         mock_healthcheck(fail=True, fail_how='wrong-version')
@@ -690,7 +704,7 @@ class TestPercyScreenshot(unittest.TestCase):
 
             mock_print.assert_called_with(f'{LABEL} Unsupported Percy CLI version, 2.0.0')
 
-        self.assertEqual(httpretty.last_request().path, '/percy/healthcheck')
+        self.assertEqual(last_cli_request().path, '/percy/healthcheck')
 
     def test_disables_screenshot_when_the_healthcheck_version_is_missing(self):
         mock_healthcheck(fail=True, fail_how='no-version')
@@ -704,7 +718,7 @@ class TestPercyScreenshot(unittest.TestCase):
                 'Please uninstall @percy/agent and install @percy/cli instead. '
                 'https://www.browserstack.com/docs/percy/migration/migrate-to-cli')
 
-        self.assertEqual(httpretty.last_request().path, '/percy/healthcheck')
+        self.assertEqual(last_cli_request().path, '/percy/healthcheck')
 
     def test_disables_screenshot_when_the_driver_is_not_selenium(self):
         mock_healthcheck(fail=True, fail_how='no-version')
@@ -726,7 +740,11 @@ class TestPercyScreenshot(unittest.TestCase):
             "sync": "true"
         })
 
-        s = httpretty.latest_requests()[1].parsed_body
+        local.flush_logs(5)
+        s = next(
+            r.parsed_body for r in httpretty.latest_requests()
+            if r.path == '/percy/automateScreenshot' and isinstance(r.parsed_body, dict)
+        )
         self.assertEqual(s['snapshotName'], 'Snapshot C')
         self.assertEqual(s['options']['ignore_region_elements'], ['Dummy_id'])
         self.assertEqual(s['options']['consider_region_elements'], ['Consider_Dummy_id'])
@@ -750,7 +768,7 @@ class TestPercyScreenshot(unittest.TestCase):
             "consider_region_selenium_elements": [consider_element]
         })
 
-        self.assertEqual(httpretty.last_request().path, '/percy/automateScreenshot')
+        self.assertEqual(last_cli_request().path, '/percy/automateScreenshot')
 
         screenshot_bodies, seen = [], set()
         for req in httpretty.latest_requests():
@@ -795,6 +813,7 @@ class TestPercyScreenshot(unittest.TestCase):
 
             mock_print.assert_any_call(f'{LABEL} Could not take Screenshot "Snapshot 1"')
 
+        local.flush_logs(5)
         log_bodies = [
             req.parsed_body
             for req in httpretty.latest_requests()
@@ -880,6 +899,8 @@ class TestPercyResponsiveCaptureMinHeight(unittest.TestCase):
         httpretty.enable()
 
     def tearDown(self):
+        # drain queued logs while httpretty is still intercepting
+        local.flush_logs(5)
         httpretty.disable()
         httpretty.reset()
 
@@ -903,7 +924,7 @@ class TestPercyResponsiveCaptureMinHeight(unittest.TestCase):
         self.assertEqual(original_size['width'], restored_size['width'])
         self.assertEqual(original_size['height'], restored_size['height'])
 
-        s1 = httpretty.last_request().parsed_body
+        s1 = last_cli_request().parsed_body
         self.assertEqual(s1['name'], 'MinHeight Kwarg')
         # each dom_snapshot entry must carry the correct width
         widths_in_snap = sorted(d['width'] for d in s1['dom_snapshot'])
@@ -927,7 +948,7 @@ class TestPercyResponsiveCaptureMinHeight(unittest.TestCase):
         self.assertEqual(original_size['width'], restored_size['width'])
         self.assertEqual(original_size['height'], restored_size['height'])
 
-        s1 = httpretty.last_request().parsed_body
+        s1 = last_cli_request().parsed_body
         self.assertEqual(s1['name'], 'MinHeight Config')
         self.assertIsInstance(s1['dom_snapshot'], list)
 
@@ -955,7 +976,7 @@ class TestPercyResponsiveCaptureMinHeight(unittest.TestCase):
 
         percy_snapshot(self.driver, 'Count Check', responsiveSnapshotCapture=True, minHeight=400)
 
-        s1 = httpretty.last_request().parsed_body
+        s1 = last_cli_request().parsed_body
         # mobile [390] + config [375, 1280] = 3 widths
         self.assertEqual(len(s1['dom_snapshot']), 3)
 
@@ -983,6 +1004,8 @@ class TestPercyResponsiveCaptureReloadPage(unittest.TestCase):
         httpretty.enable(allow_net_connect=True)
 
     def tearDown(self):
+        # drain queued logs while httpretty is still intercepting
+        local.flush_logs(5)
         httpretty.disable()
         httpretty.reset()
 
@@ -1003,8 +1026,8 @@ class TestPercyResponsiveCaptureReloadPage(unittest.TestCase):
             # refresh must be called once per width (2 widths → 2 calls)
             self.assertEqual(mock_refresh.call_count, 2)
 
-        self.assertEqual(httpretty.last_request().path, '/percy/snapshot')
-        s1 = httpretty.last_request().parsed_body
+        self.assertEqual(last_cli_request().path, '/percy/snapshot')
+        s1 = last_cli_request().parsed_body
         self.assertEqual(s1['name'], 'Reload Enabled')
         self.assertIsInstance(s1['dom_snapshot'], list)
 
@@ -1037,8 +1060,8 @@ class TestPercyResponsiveCaptureReloadPage(unittest.TestCase):
 
         percy_snapshot(self.driver, 'Reload Disabled', responsiveSnapshotCapture=True)
 
-        self.assertEqual(httpretty.last_request().path, '/percy/snapshot')
-        s1 = httpretty.last_request().parsed_body
+        self.assertEqual(last_cli_request().path, '/percy/snapshot')
+        s1 = last_cli_request().parsed_body
         self.assertEqual(s1['name'], 'Reload Disabled')
         for snap in s1['dom_snapshot']:
             self.assertEqual(snap['html'], dom_string)
@@ -1066,7 +1089,7 @@ class TestPercyResponsiveCaptureReloadPage(unittest.TestCase):
             self.assertEqual(last_call[0][1], original_size['width'])
             self.assertEqual(last_call[0][2], original_size['height'])
 
-        s1 = httpretty.last_request().parsed_body
+        s1 = last_cli_request().parsed_body
         self.assertEqual(s1['name'], 'Reload + MinHeight')
         widths_in_snap = sorted(d['width'] for d in s1['dom_snapshot'])
         self.assertEqual(widths_in_snap, [375, 1280])
@@ -1084,7 +1107,7 @@ class TestPercyResponsiveCaptureReloadPage(unittest.TestCase):
             percy_snapshot(self.driver, 'Reload Count', responsiveSnapshotCapture=True)
             self.assertEqual(mock_refresh.call_count, 3)
 
-        s1 = httpretty.last_request().parsed_body
+        s1 = last_cli_request().parsed_body
         self.assertEqual(len(s1['dom_snapshot']), 3)
 
 
@@ -1175,21 +1198,20 @@ class TestIframeCaptureUnit(unittest.TestCase):
         # execute_script call order:
         #  [0] main serialize       [1] enumerate top-level iframes
         #  [2] querySelector (find iframe by id)
-        #  [3] post-switch document.URL re-check
-        #  [4] inject PercyDOM in frame
-        #  [5] serialize the frame  [6] enumerate nested iframes (empty)
+        #  [3] fused in-frame capture: PercyDOM is missing, so it asks for it
+        #  [4] the same capture prefixed with PercyDOM: URL checks, serialize
+        #      and nested iframe enumeration (empty) in one round trip
         driver.execute_script.side_effect = [
             {"html": '<html><iframe data-percy-element-id="cid-1"></iframe></html>',
              "resources": [{"url": "https://cdn/main.css", "content": "m"}]},
             [self._meta("http://main.example.com/inner", None),
              self._meta("https://cross.example.com/page", "cid-1", index=1)],
             Mock(name="iframe_element"),
-            "https://cross.example.com/page",
-            None,
-            {"snapshot": {"html": "<iframe-html/>",
+            {"status": "inject", "frameUrl": "https://cross.example.com/page"},
+            {"status": "ok",
+             "snapshot": {"html": "<iframe-html/>",
                           "resources": [{"url": "https://cdn/frame.css", "content": "f"}]},
-             "frameUrl": "https://cross.example.com/page"},
-            [],
+             "frameUrl": "https://cross.example.com/page", "iframes": []},
         ]
         driver.current_url = "http://main.example.com/"
 
@@ -1247,10 +1269,9 @@ class TestIframeCaptureUnit(unittest.TestCase):
             {"html": '<html><iframe data-percy-element-id="percy-id-1"></iframe></html>'},
             [self._meta("https://main.example.com/widget", "percy-id-1")],
             Mock(),
-            "https://main.example.com/widget",
-            None,
-            {"snapshot": {"html": "<frame/>"}, "frameUrl": "https://main.example.com/widget"},
-            [],
+            {"status": "inject"},
+            {"status": "ok", "snapshot": {"html": "<frame/>"},
+             "frameUrl": "https://main.example.com/widget", "iframes": []},
         ]
         driver.current_url = "http://main.example.com/"
 
@@ -1266,11 +1287,9 @@ class TestIframeCaptureUnit(unittest.TestCase):
             {"html": '<html><iframe data-percy-element-id="percy-id-port"></iframe></html>'},
             [self._meta("http://main.example.com:4000/widget", "percy-id-port")],
             Mock(),
-            "http://main.example.com:4000/widget",
-            None,
-            {"snapshot": {"html": "<frame/>"},
-             "frameUrl": "http://main.example.com:4000/widget"},
-            [],
+            {"status": "inject"},
+            {"status": "ok", "snapshot": {"html": "<frame/>"},
+             "frameUrl": "http://main.example.com:4000/widget", "iframes": []},
         ]
         driver.current_url = "http://main.example.com:3000/"
 
@@ -1335,12 +1354,11 @@ class TestIframeCaptureUnit(unittest.TestCase):
             {"html": dom_html, "resources": []},
             [self._meta("https://cross.example.com/page", "cid-1")],
             Mock(),
-            "https://cross.example.com/page",
-            None,
-            {"snapshot": {"html": '<html><body><h1>Frame</h1></body></html>',
+            {"status": "inject"},
+            {"status": "ok",
+             "snapshot": {"html": '<html><body><h1>Frame</h1></body></html>',
                           "resources": [frame_resource]},
-             "frameUrl": "https://cross.example.com/page"},
-            [],
+             "frameUrl": "https://cross.example.com/page", "iframes": []},
         ]
         driver.current_url = "http://main.example.com/"
 
@@ -1364,13 +1382,13 @@ class TestIframeCaptureUnit(unittest.TestCase):
              self._meta("http://main.example.com/inner", "pid-same", index=1),
              self._meta("https://b.other.com/w2", "pid-2", index=2)],
             # frame 1
-            Mock(), "https://a.other.com/w1", None,
-            {"snapshot": {"html": "<frame1/>"}, "frameUrl": "https://a.other.com/w1"},
-            [],
+            Mock(), {"status": "inject"},
+            {"status": "ok", "snapshot": {"html": "<frame1/>"},
+             "frameUrl": "https://a.other.com/w1", "iframes": []},
             # frame 2
-            Mock(), "https://b.other.com/w2", None,
-            {"snapshot": {"html": "<frame2/>"}, "frameUrl": "https://b.other.com/w2"},
-            [],
+            Mock(), {"status": "inject"},
+            {"status": "ok", "snapshot": {"html": "<frame2/>"},
+             "frameUrl": "https://b.other.com/w2", "iframes": []},
         ]
         driver.current_url = "http://main.example.com/"
 
@@ -1407,12 +1425,13 @@ class TestIframeCaptureUnit(unittest.TestCase):
                      '<iframe data-percy-element-id="pid-ok"></iframe></html>'},
             [self._meta("https://fail.example.com/page", "pid-fail"),
              self._meta("https://ok.example.com/page", "pid-ok", index=1)],
-            # fail frame: querySelector returns, document.URL ok, inject raises
-            Mock(), "https://fail.example.com/page", Exception("inject failed"),
+            # fail frame: querySelector returns, capture asks for PercyDOM,
+            # injecting it raises
+            Mock(), {"status": "inject"}, Exception("inject failed"),
             # ok frame
-            Mock(), "https://ok.example.com/page", None,
-            {"snapshot": {"html": "<ok/>"}, "frameUrl": "https://ok.example.com/page"},
-            [],
+            Mock(), {"status": "inject"},
+            {"status": "ok", "snapshot": {"html": "<ok/>"},
+             "frameUrl": "https://ok.example.com/page", "iframes": []},
         ]
         driver.current_url = "http://main.example.com/"
         # switch_to.frame succeeds for both; parent_frame called in finally
@@ -1551,7 +1570,8 @@ class TestIframeTreeBehavior(unittest.TestCase):
             {"html": "<html/>"},
             [self._meta("https://cross.example.com/p", "pid-1")],
             Mock(),                  # querySelector for the iframe element
-            "about:blank",           # post-switch document.URL is unsupported
+            # post-switch document.URL is unsupported
+            {"status": "unsupported", "frameUrl": "about:blank"},
         ]
         driver.current_url = "http://main.example.com/"
 
@@ -1569,9 +1589,9 @@ class TestIframeTreeBehavior(unittest.TestCase):
             {"html": "<html/>"},
             [self._meta("https://a.example.com/", "pid-1")],
             Mock(),
-            "https://a.example.com/",
-            None,
-            {"snapshot": {"html": "<a/>"}, "frameUrl": "https://a.example.com/"},
+            {"status": "inject"},
+            {"status": "ok", "snapshot": {"html": "<a/>"},
+             "frameUrl": "https://a.example.com/", "iframes": []},
         ]
         driver.current_url = "http://main.example.com/"
 
@@ -1579,8 +1599,9 @@ class TestIframeTreeBehavior(unittest.TestCase):
             driver, [], percy_dom_script="script", maxIframeDepth=1
         )
         self.assertEqual(len(dom["corsIframes"]), 1)
-        # Only 6 execute_script calls — no nested-enumerate call.
-        self.assertEqual(driver.execute_script.call_count, 6)
+        # The in-frame capture was told not to enumerate nested iframes.
+        self.assertEqual(driver.execute_script.call_count, 5)
+        self.assertFalse(driver.execute_script.call_args.args[1]['enumerate'])
 
     def test_ancestor_cycle_guard_stops_descent(self):
         """If a nested iframe's src appears in the ancestor chain, it is not
@@ -1590,13 +1611,12 @@ class TestIframeTreeBehavior(unittest.TestCase):
             {"html": "<html/>"},
             # top-level
             [self._meta("https://a.example.com/", "pid-a")],
-            # switch into a
+            # switch into a; its nested iframe cycles back to the page URL
             Mock(),
-            "https://a.example.com/",
-            None,
-            {"snapshot": {"html": "<a/>"}, "frameUrl": "https://a.example.com/"},
-            # nested enumeration inside a: cycles back to the page URL
-            [self._meta("http://main.example.com/", "pid-cycle")],
+            {"status": "inject"},
+            {"status": "ok", "snapshot": {"html": "<a/>"},
+             "frameUrl": "https://a.example.com/",
+             "iframes": [self._meta("http://main.example.com/", "pid-cycle")]},
         ]
         driver.current_url = "http://main.example.com/"
 
@@ -1614,15 +1634,15 @@ class TestIframeTreeBehavior(unittest.TestCase):
             {"html": "<html/>"},
             [self._meta("https://a.example.com/", "pid-a"),
              self._meta("https://b.example.com/", "pid-b", index=1)],
-            # frame a
-            Mock(), "https://a.example.com/", None,
-            {"snapshot": {"html": "<a/>"}, "frameUrl": "https://a.example.com/"},
-            # nested enumeration inside a
-            [self._meta("https://c.example.com/", "pid-c")],
+            # frame a, with nested frame c
+            Mock(), {"status": "inject"},
+            {"status": "ok", "snapshot": {"html": "<a/>"},
+             "frameUrl": "https://a.example.com/",
+             "iframes": [self._meta("https://c.example.com/", "pid-c")]},
             # frame c (nested)
-            Mock(), "https://c.example.com/", None,
-            {"snapshot": {"html": "<c/>"}, "frameUrl": "https://c.example.com/"},
-            [],
+            Mock(), {"status": "inject"},
+            {"status": "ok", "snapshot": {"html": "<c/>"},
+             "frameUrl": "https://c.example.com/", "iframes": []},
         ]
         driver.current_url = "http://main.example.com/"
         # parent_frame fails on the *second* call (returning from c -> a).
@@ -1927,12 +1947,12 @@ class TestRedirectCycleGuardOnFrameUrl(unittest.TestCase):
         # 0: main serialize
         # 1: enumerate top-level iframes
         # 2: querySelector for the iframe element
-        # 3: post-switch document.URL → resolves to the page URL (cycle!)
+        # 3: in-frame capture: document.URL resolves to the page URL (cycle!)
         driver.execute_script.side_effect = [
             {"html": "<html/>"},
             [self._meta("https://a.example.com/redirector", "pid-a")],
             Mock(name="iframe_element"),
-            "http://main.example.com/",   # resolved to page URL → cycle
+            {"status": "cycle", "frameUrl": "http://main.example.com/"},
         ]
         driver.current_url = "http://main.example.com/"
 
@@ -1942,9 +1962,11 @@ class TestRedirectCycleGuardOnFrameUrl(unittest.TestCase):
 
         # Frame was switched into and back out of, but never serialized.
         self.assertNotIn("corsIframes", dom)
-        # We did the post-switch URL read (call #3 above) and then bailed —
-        # no PercyDOM.serialize on this frame, no nested enumeration.
+        # The in-frame capture (call #3 above) bailed before serializing, and
+        # the page URL was passed in as an ancestor for it to compare against.
         self.assertEqual(driver.execute_script.call_count, 4)
+        self.assertEqual(driver.execute_script.call_args.args[1]['ancestors'],
+                         ["http://main.example.com/"])
         driver.switch_to.parent_frame.assert_called_once()
 
 
@@ -1966,7 +1988,7 @@ class TestTopLevelIframeFailureLog(unittest.TestCase):
             {"html": "<html/>"},
             [self._meta("https://cross.example.com/page", "pid-1")],
             Mock(),                              # iframe element
-            "https://cross.example.com/page",    # post-switch document.URL
+            {"status": "inject"},                # in-frame capture: no PercyDOM yet
             Exception("dom inject blew up"),     # injection of PercyDOM raises
         ]
         driver.current_url = "http://main.example.com/"
@@ -1991,12 +2013,13 @@ class TestTopLevelIframeFailureLog(unittest.TestCase):
         driver.execute_script.side_effect = [
             {"html": "<html/>"},
             [self._meta("https://a.example.com/", "pid-a")],
-            Mock(), "https://a.example.com/", None,
-            {"snapshot": {"html": "<a/>"}, "frameUrl": "https://a.example.com/"},
-            # nested enumeration inside a returns a child
-            [self._meta("https://b.example.com/", "pid-b")],
+            # frame a, whose nested enumeration returns a child
+            Mock(), {"status": "inject"},
+            {"status": "ok", "snapshot": {"html": "<a/>"},
+             "frameUrl": "https://a.example.com/",
+             "iframes": [self._meta("https://b.example.com/", "pid-b")]},
             # nested child blows up at injection
-            Mock(), "https://b.example.com/",
+            Mock(), {"status": "inject"},
             Exception("nested inject blew up"),
         ]
         driver.current_url = "http://main.example.com/"
@@ -1,22 +1,120 @@
-# pylint: disable=protected-access
+# pylint: disable=protected-access, too-many-lines
 """Focused unit tests for snapshot.py helper functions and their error/
 fallback paths. These run as plain unittests (no Percy CLI needed) and
 target branches the end-to-end suite in test_snapshot.py does not reach."""
 import importlib
 import json
 import os
+import shutil
+import tempfile
 import unittest
-from unittest.mock import patch, MagicMock, Mock
+from concurrent.futures import Future, ThreadPoolExecutor
+from unittest.mock import call, patch, MagicMock, Mock
 
 import percy.snapshot as local
+from percy.log_shipper import LogShipper
+from percy.transport import iter_json_body
+
+_log_shipper_patch = patch('percy.snapshot._log_shipper')
+
+
+def setUpModule():
+    # Nothing here talks to a CLI: keep log() from queueing POSTs to
+    # localhost:5338 that would outlive the test that logged them.
+    _log_shipper_patch.start()
+
+
+def tearDownModule():
+    _log_shipper_patch.stop()
 
 
 class TestLog(unittest.TestCase):
+    def setUp(self):
+        # a real shipper, so the tests below exercise the background worker
+        shipper = LogShipper(f'{local.PERCY_CLI_API}/percy/log',
+                             on_error=local._on_log_ship_error)
+        patcher = patch('percy.snapshot._log_shipper', shipper)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     @patch('percy.snapshot.PERCY_DEBUG', True)
-    @patch('percy.snapshot.requests.post', side_effect=Exception('network down'))
-    def test_log_swallows_post_failure(self, _mock_post):
+    @patch('percy.log_shipper.get_transport')
+    def test_log_swallows_post_failure(self, mock_get_transport):
+        mock_get_transport.return_value.post.side_effect = Exception('network down')
         # Failing to ship the log to the CLI must never raise to the caller.
-        local.log('hello', 'info')  # should not raise
+        with patch('builtins.print') as mock_print:
+            local.log('hello', 'info')  # should not raise
+            local.flush_logs(5)
+        mock_print.assert_any_call('Sending log to CLI Failed network down')
+
+    @patch('percy.snapshot.PERCY_DEBUG', False)
+    @patch('percy.log_shipper.get_transport')
+    def test_log_ships_entry_in_background(self, mock_get_transport):
+        with patch('builtins.print') as mock_print:
+            local.log('shipped', 'info')
+            self.assertTrue(local.flush_logs(5))
+        mock_print.assert_called_once_with(f'{local.LABEL} shipped')
+        mock_get_transport.return_value.post.assert_called_once_with(
+            f'{local.PERCY_CLI_API}/percy/log',
+            json={'message': f'{local.LABEL} shipped', 'level': 'info'}, timeout=1)
+
+    @patch('percy.snapshot.PERCY_DEBUG', False)
+    @patch('percy.snapshot._log_shipper')
+    def test_disabled_debug_skips_formatting_and_io(self, mock_shipper):
+        message = MagicMock()
+        with patch('builtins.print') as mock_print:
+            local.log(message, 'debug')
+            local.log('lazy %s', 'debug', message)
+        message.assert_not_called()
+        message.__str__.assert_not_called()
+        mock_shipper.enqueue.assert_not_called()
+        mock_print.assert_not_called()
+
+    @patch('percy.snapshot.PERCY_DEBUG', True)
+    @patch('percy.snapshot._log_shipper')
+    def test_lazy_messages_are_built_when_enabled(self, mock_shipper):
+        with patch('builtins.print'):
+            local.log(lambda: 'from callable', 'debug')
+            local.log('from %s %d', 'debug', 'args', 2)
+        self.assertEqual([c.args for c in mock_shipper.enqueue.call_args_list], [
+            (f'{local.LABEL} from callable', 'debug'),
+            (f'{local.LABEL} from args 2', 'debug'),
+        ])
+
+
+class TestSetLogLevel(unittest.TestCase):
+    def tearDown(self):
+        local.set_log_level(os.environ.get('PERCY_LOGLEVEL') or 'info')
+
+    @patch('percy.snapshot._log_shipper')
+    def test_levels_below_threshold_are_dropped(self, mock_shipper):
+        local.set_log_level('WARN')
+        self.assertFalse(local.PERCY_DEBUG)
+        with patch('builtins.print'):
+            local.log('dropped', 'info')
+            local.log('kept', 'error')
+        self.assertEqual([c.args[1] for c in mock_shipper.enqueue.call_args_list], ['error'])
+
+    def test_debug_level_enables_debug(self):
+        local.set_log_level('debug')
+        self.assertTrue(local.PERCY_DEBUG)
+        self.assertTrue(local.log_enabled('debug'))
+        self.assertTrue(local.log_enabled('info'))
+
+    def test_label_follows_the_level(self):
+        local.set_log_level('debug')
+        self.assertIn('percy:python', local.LABEL)
+        with patch('percy.snapshot._log_shipper'), patch('builtins.print') as mock_print:
+            local.log('now verbose', 'debug')
+        mock_print.assert_called_once_with('[\u001b[35mpercy:python\u001b[39m] now verbose')
+        local.set_log_level('info')
+        self.assertEqual(local.LABEL, '[\u001b[35mpercy\u001b[39m]')
+
+    def test_unknown_level_falls_back_to_info(self):
+        local.set_log_level('chatty')
+        self.assertEqual(local.PERCY_LOG_LEVEL, local.LOG_LEVELS['info'])
+        self.assertFalse(local.log_enabled('debug'))
+        self.assertTrue(local.log_enabled('something-custom'))
 
 
 class TestWaitForReady(unittest.TestCase):
@@ -119,22 +217,44 @@ class TestConfigMergeIntoSerialize(unittest.TestCase):
 
 
 class TestGetResponsiveWidths(unittest.TestCase):
-    @patch('percy.snapshot.requests.get')
-    def test_non_list_widths_raises_upgrade_hint(self, mock_get):
+    @patch('percy.snapshot.get_transport')
+    def test_non_list_widths_raises_upgrade_hint(self, mock_get_transport):
         response = MagicMock()
         response.raise_for_status.return_value = None
         response.json.return_value = {'widths': 'not-a-list'}
-        mock_get.return_value = response
+        mock_get_transport.return_value.get.return_value = response
         with self.assertRaises(Exception) as cm:
             local.get_responsive_widths([375])
         self.assertIn('Update Percy CLI', str(cm.exception))
 
-    @patch('percy.snapshot.requests.get', side_effect=Exception('connection refused'))
-    def test_request_failure_raises_upgrade_hint(self, _mock_get):
+    @patch('percy.snapshot.get_transport')
+    def test_request_failure_raises_upgrade_hint(self, mock_get_transport):
+        mock_get_transport.return_value.get.side_effect = Exception('connection refused')
         with self.assertRaises(Exception) as cm:
             local.get_responsive_widths([375])
         self.assertIn('Update Percy CLI', str(cm.exception))
 
+    @patch('percy.snapshot._healthcheck', return_value=False)
+    @patch('percy.snapshot.get_transport')
+    def test_widths_are_memoized_per_config_until_refresh(self, mock_get_transport, _health):
+        self.addCleanup(local._widths_config_cache.update, config=None, widths={})
+        response = MagicMock()
+        response.json.return_value = {'widths': [{'width': 375}, {'width': 1280}]}
+        mock_get_transport.return_value.get.return_value = response
+        config = {'snapshot': {}}
+
+        first = local.get_responsive_widths([1280, 375], config)
+        self.assertEqual(local.get_responsive_widths([375, 1280], config), first)
+        self.assertEqual(mock_get_transport.return_value.get.call_count, 1)
+
+        local.get_responsive_widths([375], config)
+        local.get_responsive_widths([375, 1280], {'snapshot': {}})
+        self.assertEqual(mock_get_transport.return_value.get.call_count, 3)
+
+        local.refresh_percy_enabled()
+        local.is_percy_enabled.cache_clear()
+        self.assertIsNone(local._widths_config_cache['config'])
+
 
 class TestChangeWindowDimension(unittest.TestCase):
     def test_resize_falls_back_to_set_window_size(self):
@@ -146,6 +266,148 @@ class TestChangeWindowDimension(unittest.TestCase):
         local.change_window_dimension_and_wait(driver, 800, 600, 1)
         self.assertEqual(driver.set_window_size.call_count, 2)
 
+    @patch('percy.snapshot.sleep')
+    def test_settle_waits_in_page_with_a_js_deadline(self, mock_sleep):
+        driver = MagicMock()
+        driver.capabilities = {'browserName': 'firefox'}
+        driver.execute_async_script.return_value = 'settled'
+        with patch('percy.snapshot.RESIZE_SETTLE_SECONDS', 0.5):
+            local.change_window_dimension_and_wait(driver, 800, 600, 1)
+        script, quiet_ms, deadline_ms = driver.execute_async_script.call_args.args
+        self.assertIn('ResizeObserver', script)
+        self.assertEqual((quiet_ms, deadline_ms), (local.PERCY_RESIZE_QUIET_MS, 500))
+        mock_sleep.assert_not_called()
+
+    @patch('percy.snapshot.sleep')
+    def test_failed_settle_script_sleeps_out_the_remaining_bound(self, mock_sleep):
+        driver = MagicMock()
+        driver.capabilities = {'browserName': 'firefox'}
+        driver.execute_async_script.side_effect = Exception('script timeout')
+        with patch('percy.snapshot.RESIZE_SETTLE_SECONDS', 0.5):
+            local.change_window_dimension_and_wait(driver, 800, 600, 1)
+        self.assertLessEqual(mock_sleep.call_args.args[0], 0.5)
+
+    @patch('percy.snapshot.PERCY_RESIZE_SETTLE', 'fixed')
+    @patch('percy.snapshot.sleep')
+    def test_fixed_settle_skips_the_script(self, mock_sleep):
+        driver = MagicMock()
+        driver.capabilities = {'browserName': 'firefox'}
+        with patch('percy.snapshot.RESIZE_SETTLE_SECONDS', 0.5):
+            local.change_window_dimension_and_wait(driver, 800, 600, 1)
+        driver.execute_async_script.assert_not_called()
+        mock_sleep.assert_called_once_with(0.5)
+
+
+class TestChromiumResponsiveViewport(unittest.TestCase):
+    def _chrome(self):
+        driver = MagicMock()
+        driver.capabilities = {'browserName': 'chrome'}
+        driver.get_window_size.return_value = {'width': 1280, 'height': 800}
+        driver.execute_script.side_effect = lambda *_args: {}
+        return driver
+
+    @patch('percy.snapshot._wait_for_resize_settle', MagicMock())
+    @patch('percy.snapshot._wait_for_ready', MagicMock(return_value=None))
+    def test_override_is_cleared_instead_of_restored(self):
+        driver = self._chrome()
+        with patch('percy.snapshot.get_responsive_widths',
+                   return_value=[{'width': 375}, {'width': 768}]):
+            local.capture_responsive_dom(driver, [], {})
+
+        self.assertEqual([c.args[0] for c in driver.execute_cdp_cmd.call_args_list], [
+            'Emulation.setDeviceMetricsOverride', 'Emulation.setDeviceMetricsOverride',
+            'Emulation.clearDeviceMetricsOverride'])
+        driver.set_window_size.assert_not_called()
+
+    @patch('percy.snapshot._wait_for_resize_settle', MagicMock())
+    @patch('percy.snapshot._wait_for_ready', MagicMock(return_value=None))
+    def test_window_fallback_is_restored_after_clearing(self):
+        driver = self._chrome()
+        driver.execute_cdp_cmd.side_effect = Exception('Emulation domain unavailable')
+        with patch('percy.snapshot.get_responsive_widths', return_value=[{'width': 375}]):
+            local.capture_responsive_dom(driver, [], {})
+
+        self.assertEqual([c.args for c in driver.set_window_size.call_args_list],
+                         [(375, 800), (1280, 800)])
+
+    @patch('percy.snapshot._wait_for_resize_settle', MagicMock())
+    @patch('percy.snapshot._wait_for_ready', MagicMock(return_value=None))
+    def test_override_is_cleared_when_a_width_fails(self):
+        driver = self._chrome()
+        with patch('percy.snapshot.get_responsive_widths',
+                   return_value=[{'width': 375}, {'width': 768}]), \
+                patch('percy.snapshot.get_serialized_dom',
+                      side_effect=[{}, Exception('renderer crashed')]):
+            with self.assertRaises(Exception):
+                local.capture_responsive_dom(driver, [], {})
+
+        self.assertEqual(driver.execute_cdp_cmd.call_args_list[-1].args[0],
+                         'Emulation.clearDeviceMetricsOverride')
+
+    @patch('percy.snapshot._wait_for_ready', MagicMock(return_value=None))
+    @patch('percy.snapshot._responsive_sleep', MagicMock())
+    @patch('percy.snapshot.expose_closed_shadow_roots', MagicMock())
+    def test_helper_sessions_resize_through_a_viewport(self):
+        helper = self._chrome()
+        local.enable_parallel_responsive_capture(lambda: helper, max_sessions=1)
+        self.addCleanup(local.disable_parallel_responsive_capture)
+        with patch('builtins.print') as mock_print:
+            local._capture_width_on_helper(local._responsive_driver_pool, 'http://x/', [], {},
+                                           375, 800, 'PERCY_DOM', {})
+
+        driver_cmds = [c.args for c in helper.execute_cdp_cmd.call_args_list]
+        self.assertEqual(driver_cmds[0], ('Emulation.setDeviceMetricsOverride', {
+            'width': 375, 'height': 800, 'deviceScaleFactor': 1, 'mobile': False}))
+        self.assertFalse(any('Attempting to resize' in str(c.args[0])
+                             for c in mock_print.call_args_list))
+
+    def test_non_chromium_drivers_get_no_viewport(self):
+        driver = MagicMock()
+        driver.capabilities = {'browserName': 'firefox'}
+        self.assertIsNone(local._chromium_viewport(driver))
+        self.assertIsNotNone(local._chromium_viewport(self._chrome()))
+
+
+class TestShareIdenticalSnapshotParts(unittest.TestCase):
+    def test_identical_html_and_resources_are_stored_once(self):
+        font = {'url': 'https://a.example/font.woff', 'content': 'AAAA', 'mimetype': 'font/woff'}
+        snapshots = [
+            {'html': ''.join(['<p>', 'same</p>']), 'resources': [dict(font)], 'width': 375},
+            {'html': ''.join(['<p>', 'same</p>']), 'resources': [dict(font)], 'width': 768},
+            {'html': '<p>wide</p>', 'resources': [], 'width': 1280},
+        ]
+        self.assertIsNot(snapshots[0]['html'], snapshots[1]['html'])
+
+        seen = {}
+        shared = [local._share_identical_snapshot_parts(snapshot, seen) for snapshot in snapshots]
+
+        self.assertEqual(shared, [0, len('<p>same</p>') + len('AAAA'), 0])
+        self.assertIs(snapshots[1]['html'], snapshots[0]['html'])
+        self.assertIs(snapshots[1]['resources'][0], snapshots[0]['resources'][0])
+        self.assertEqual([s['width'] for s in snapshots], [375, 768, 1280])
+        self.assertEqual(json.loads(json.dumps(snapshots))[1]['html'], '<p>same</p>')
+
+    @patch('percy.snapshot._wait_for_ready', MagicMock(return_value=None))
+    @patch('percy.snapshot._responsive_sleep', MagicMock())
+    @patch('percy.snapshot.change_window_dimension_and_wait', MagicMock())
+    def test_widths_are_shared_as_they_are_captured(self):
+        driver = MagicMock()
+        driver.get_window_size.return_value = {'width': 1280, 'height': 800}
+        with patch('percy.snapshot.get_responsive_widths',
+                   return_value=[{'width': 375}, {'width': 768}]), \
+                patch('percy.snapshot.get_serialized_dom',
+                      side_effect=lambda *_a, **_k: {'html': ''.join(['<p>', 'same</p>'])}):
+            result = local.capture_responsive_dom(driver, [], {})
+        self.assertIs(result[1]['html'], result[0]['html'])
+
+    def test_unexpected_shapes_are_left_alone(self):
+        snapshots = [None, {'html': None, 'resources': 'n/a'},
+                     {'resources': [{1, 2}, {'url': 'u', 'widths': [375]}]}]
+        seen = {}
+        for snapshot in snapshots + snapshots:
+            self.assertEqual(local._share_identical_snapshot_parts(snapshot, seen), 0)
+        self.assertEqual(snapshots[2]['resources'], [{1, 2}, {'url': 'u', 'widths': [375]}])
+
 
 class TestResponsiveSleep(unittest.TestCase):
     @patch('percy.snapshot.RESPONSIVE_CAPTURE_SLEEP_TIME', 'not-a-number')
@@ -176,6 +438,70 @@ class TestCaptureResponsiveDomMinHeight(unittest.TestCase):
         self.assertEqual(result, [])
 
 
+class TestResponsiveWidthOrder(unittest.TestCase):
+    @staticmethod
+    def _order(widths, current_width, skip=()):
+        return local._order_responsive_widths([(width, 800) for width in widths],
+                                              (current_width, 800), skip)
+
+    def test_starts_at_current_width_and_ends_next_to_it(self):
+        widths = [1920, 375, 1280, 768, 1024]
+        order = self._order(widths, 1280)
+        self.assertEqual([widths[i] for i in order], [1280, 1920, 375, 768, 1024])
+        self.assertEqual([widths[i] for i in self._order(widths, 1600)],
+                         [1920, 375, 768, 1024, 1280])
+
+    def test_config_order_is_kept_on_request(self):
+        with patch('percy.snapshot.PERCY_RESPONSIVE_WIDTH_ORDER', 'config'):
+            self.assertEqual(self._order([1920, 375, 1280], 1280), [0, 1, 2])
+
+    def test_skipped_indexes_are_left_out(self):
+        self.assertEqual(self._order([375, 768, 1280], 1280, {2}), [0, 1])
+
+    def test_current_width_at_another_height_is_not_a_free_start(self):
+        sizes = [(1280, 1024), (375, 1024), (1280, 700)]
+        self.assertEqual(local._order_responsive_widths(sizes, (1280, 700)), [2, 0, 1])
+
+    @patch('percy.snapshot._wait_for_ready', MagicMock(return_value=None))
+    @patch('percy.snapshot._responsive_sleep', MagicMock())
+    def test_snapshots_keep_config_order_and_window_is_not_restored_when_unchanged(self):
+        driver = MagicMock()
+        driver.get_window_size.return_value = {'width': 1280, 'height': 800}
+        driver.execute_script.side_effect = lambda *_args: {}
+        with patch('percy.snapshot.get_responsive_widths',
+                   return_value=[{'width': 375}, {'width': 1280}]), \
+                patch('percy.snapshot.change_window_dimension_and_wait') as mock_resize:
+            result = local.capture_responsive_dom(driver, [], {}, percy_dom_script=None)
+            self.assertEqual([snap['width'] for snap in result], [375, 1280])
+            self.assertEqual([c.args[1] for c in mock_resize.call_args_list], [375, 1280])
+
+            mock_resize.reset_mock()
+            with patch('percy.snapshot.get_responsive_widths',
+                       return_value=[{'width': 1280}]):
+                local.capture_responsive_dom(driver, [], {}, percy_dom_script=None)
+            mock_resize.assert_not_called()
+
+    @patch('percy.snapshot.PERCY_RESPONSIVE_CAPTURE_MIN_HEIGHT', True)
+    @patch('percy.snapshot._wait_for_ready', MagicMock(return_value=None))
+    @patch('percy.snapshot._responsive_sleep', MagicMock())
+    def test_current_width_is_resized_to_min_height(self):
+        driver = MagicMock(spec=['get_window_size', 'set_window_size', 'execute_script',
+                                 'execute_async_script', 'current_url'])
+        driver.get_window_size.return_value = {'width': 1280, 'height': 700}
+        driver.execute_script.side_effect = lambda *_args: {}
+        for order in ('config', 'nearest'):
+            driver.set_window_size.reset_mock()
+            with patch('percy.snapshot.PERCY_RESPONSIVE_WIDTH_ORDER', order), \
+                    patch('percy.snapshot.get_responsive_widths',
+                          return_value=[{'width': 375}, {'width': 1280}]):
+                result = local.capture_responsive_dom(
+                    driver, [], {}, percy_dom_script=None, minHeight=1024)
+            self.assertEqual([snap['width'] for snap in result], [375, 1280])
+            resizes = [c.args for c in driver.set_window_size.call_args_list]
+            self.assertEqual(sorted(resizes[:-1]), [(375, 1024), (1280, 1024)], order)
+            self.assertEqual(resizes[-1], (1280, 700))
+
+
 class TestResizeSettleSecondsParsing(unittest.TestCase):
     def test_invalid_env_value_falls_back_to_default(self):
         # Module-level parse: an unparseable PERCY_RESIZE_SETTLE_SECONDS must
@@ -243,11 +569,11 @@ class TestProcessFrameTreeGuards(unittest.TestCase):
         self.assertEqual(result, [])
         driver.switch_to.frame.assert_not_called()
 
-    def test_document_url_read_failure_is_treated_as_unsupported(self):
+    def test_in_frame_capture_failure_returns_empty(self):
         driver = MagicMock()
         driver.execute_script.side_effect = [
             Mock(name='iframe_element'),   # querySelector
-            Exception('document.URL blew up'),  # post-switch URL read
+            Exception('document.URL blew up'),  # fused in-frame capture
         ]
         result = local.process_frame_tree(
             driver, self._meta('https://x.example.com/', 'pid-x'), 1, set(),
@@ -259,23 +585,21 @@ class TestProcessFrameTreeGuards(unittest.TestCase):
         driver = MagicMock()
         driver.execute_script.side_effect = [
             Mock(name='iframe_element'),      # querySelector
-            'https://x.example.com/page',     # post-switch document.URL
-            None,                             # inject PercyDOM
-            None,                             # serialize returned nothing
+            {'status': 'inject'},             # in-frame capture: no PercyDOM yet
+            {'status': 'ok', 'snapshot': None},  # serialize returned nothing
         ]
         result = local.process_frame_tree(
             driver, self._meta('https://x.example.com/page', 'pid-x'), 1, set(),
             _tree_ctx())
         self.assertEqual(result, [])
 
-    def test_nested_enumeration_failure_keeps_parent_capture(self):
+    def test_malformed_nested_enumeration_keeps_parent_capture(self):
         driver = MagicMock()
         driver.execute_script.side_effect = [
             Mock(name='iframe_element'),
-            'https://x.example.com/page',
-            None,
-            {'snapshot': {'html': '<x/>'}, 'frameUrl': 'https://x.example.com/page'},
-            Exception('nested enumerate blew up'),
+            {'status': 'inject'},
+            {'status': 'ok', 'snapshot': {'html': '<x/>'},
+             'frameUrl': 'https://x.example.com/page', 'iframes': None},
         ]
         result = local.process_frame_tree(
             driver, self._meta('https://x.example.com/page', 'pid-x'), 1, set(),
@@ -287,11 +611,11 @@ class TestProcessFrameTreeGuards(unittest.TestCase):
         driver = MagicMock()
         driver.execute_script.side_effect = [
             Mock(name='iframe_element'),
-            'https://x.example.com/page',
-            None,
-            {'snapshot': {'html': '<x/>'}, 'frameUrl': 'https://x.example.com/page'},
+            {'status': 'inject'},
             # nested enumeration returns one child carrying data-percy-ignore
-            [self._meta('https://c.example.com/', 'pid-c', ignore=True)],
+            {'status': 'ok', 'snapshot': {'html': '<x/>'},
+             'frameUrl': 'https://x.example.com/page',
+             'iframes': [self._meta('https://c.example.com/', 'pid-c', ignore=True)]},
         ]
         result = local.process_frame_tree(
             driver, self._meta('https://x.example.com/page', 'pid-x'), 1, set(),
@@ -305,16 +629,14 @@ class TestProcessFrameTreeGuards(unittest.TestCase):
         driver.execute_script.side_effect = [
             # depth-1 frame
             Mock(name='iframe_element_x'),
-            'https://x.example.com/page',
-            None,
-            {'snapshot': {'html': '<x/>'}, 'frameUrl': 'https://x.example.com/page'},
-            [self._meta('https://c.example.com/', 'pid-c')],
-            # nested depth-2 frame
+            {'status': 'inject'},
+            {'status': 'ok', 'snapshot': {'html': '<x/>'},
+             'frameUrl': 'https://x.example.com/page',
+             'iframes': [self._meta('https://c.example.com/', 'pid-c')]},
+            # nested depth-2 frame, PercyDOM already present
             Mock(name='iframe_element_c'),
-            'https://c.example.com/',
-            None,
-            {'snapshot': {'html': '<c/>'}, 'frameUrl': 'https://c.example.com/'},
-            [],
+            {'status': 'ok', 'snapshot': {'html': '<c/>'},
+             'frameUrl': 'https://c.example.com/', 'iframes': []},
         ]
         result = local.process_frame_tree(
             driver, self._meta('https://x.example.com/page', 'pid-x'), 1, set(),
@@ -326,7 +648,7 @@ class TestProcessFrameTreeGuards(unittest.TestCase):
         driver = MagicMock()
         driver.execute_script.side_effect = [
             Mock(name='iframe_element'),
-            'https://x.example.com/page',
+            {'status': 'inject'},
             Exception('inject blew up'),
         ]
         driver.switch_to.parent_frame.side_effect = Exception('lost parent')
@@ -341,7 +663,7 @@ class TestProcessFrameTreeGuards(unittest.TestCase):
         driver = MagicMock()
         driver.execute_script.side_effect = [
             Mock(name='iframe_element'),
-            'https://c.example.com/',
+            {'status': 'inject'},
             Exception('inject blew up'),
         ]
         driver.switch_to.parent_frame.side_effect = Exception('lost parent')
@@ -355,6 +677,170 @@ class TestProcessFrameTreeGuards(unittest.TestCase):
         self.assertIsNotNone(cm.exception.__cause__)
 
 
+class TestIframeCaptureCache(unittest.TestCase):
+    SRC = 'https://widget.example.net/embed'
+
+    def setUp(self):
+        self.cache = local.enable_iframe_cache(max_entries=10, max_mb=1)
+        self.addCleanup(local.disable_iframe_cache)
+        self.meta = TestProcessFrameTreeGuards._meta(self.SRC, 'pid-w')
+
+    def capture(self, *results):
+        driver = MagicMock()
+        driver.execute_script.side_effect = [Mock(name='iframe_element'), *results]
+        return driver, local.process_frame_tree(driver, self.meta, 1, set(), _tree_ctx())
+
+    def test_serialized_leaf_frame_is_cached_and_reused(self):
+        _, first = self.capture(
+            {'status': 'ok', 'snapshot': {'html': '<w/>'}, 'frameUrl': self.SRC,
+             'fingerprint': 'fp', 'iframes': []})
+        driver, second = self.capture(
+            {'status': 'cached', 'frameUrl': self.SRC, 'fingerprint': 'fp', 'iframes': []})
+
+        self.assertEqual(second, first)
+        self.assertEqual(driver.execute_script.call_count, 2)
+        capture_args = driver.execute_script.call_args.args[1]
+        self.assertEqual(capture_args['known'], [local.FrameCaptureCache.key(self.SRC, 'fp')])
+        self.assertTrue(capture_args['cache'].startswith(
+            local._tagged_percy_dom('PERCY_DOM')[0]))
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_frames_with_nested_iframes_are_not_cached(self):
+        self.capture(
+            {'status': 'ok', 'snapshot': {'html': '<w/>'}, 'frameUrl': self.SRC,
+             'fingerprint': 'fp',
+             'iframes': [TestProcessFrameTreeGuards._meta('https://c.example.com/', 'pid-c',
+                                                          ignore=True)]})
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_evicted_entry_is_captured_again(self):
+        driver, result = self.capture(
+            {'status': 'cached', 'frameUrl': self.SRC, 'fingerprint': 'gone', 'iframes': []},
+            {'status': 'ok', 'snapshot': {'html': '<fresh/>'}, 'frameUrl': self.SRC,
+             'fingerprint': 'gone', 'iframes': []})
+
+        self.assertEqual(result[0]['iframeSnapshot'], {'html': '<fresh/>'})
+        self.assertEqual(driver.execute_script.call_args.args[1]['known'], [])
+        self.assertEqual(self.cache.get(self.SRC, 'gone'), {'html': '<fresh/>'})
+
+    def test_disabled_cache_sends_no_fingerprint_request(self):
+        local.disable_iframe_cache()
+        driver, _ = self.capture(
+            {'status': 'ok', 'snapshot': {'html': '<w/>'}, 'frameUrl': self.SRC, 'iframes': []})
+        capture_args = driver.execute_script.call_args.args[1]
+        self.assertIsNone(capture_args['cache'])
+        self.assertEqual(capture_args['known'], [])
+
+    def test_cache_key_depends_on_serialize_options_and_frame_size(self):
+        marker = local._tagged_percy_dom('PERCY_DOM')[0]
+        self.assertNotEqual(local._frame_cache_suffix(marker, {'a': 1}),
+                            local._frame_cache_suffix(marker, {'a': 2}))
+        self.assertNotEqual(local._frame_cache_suffix(marker, {'a': 1}, (300, 250)),
+                            local._frame_cache_suffix(marker, {'a': 1}, (728, 90)))
+
+
+class TestResponsiveIframeStrategy(unittest.TestCase):
+    PAGE = 'http://main.example.com/'
+
+    @staticmethod
+    def _meta(src, percy_id, width=300, height=250):
+        return {**TestProcessFrameTreeGuards._meta(src, percy_id),
+                'width': width, 'height': height}
+
+    @staticmethod
+    def _entries(percy_id, html):
+        return [{'iframeData': {'percyElementId': percy_id}, 'iframeSnapshot': {'html': html},
+                 'frameUrl': 'https://ads.example.net/'}]
+
+    def _capture(self, state, frames, captured):
+        driver = MagicMock()
+        driver.execute_script.return_value = frames
+        ctx = {**_tree_ctx(), 'responsive_iframes': state}
+        with patch('percy.snapshot.process_frame_tree', side_effect=captured) as mock_tree:
+            result = local._capture_cors_iframes(driver, self.PAGE, ctx)
+        return result, mock_tree
+
+    def test_resolution_order_and_fallback(self):
+        config = {'snapshot': {'responsiveIframeStrategy': 'adaptive'}}
+        self.assertEqual(local.resolve_responsive_iframe_strategy({}, None), 'per-width')
+        self.assertEqual(local.resolve_responsive_iframe_strategy({}, config), 'adaptive')
+        self.assertEqual(local.resolve_responsive_iframe_strategy(
+            {'responsiveIframeStrategy': 'ONCE'}, config), 'once')
+        self.assertEqual(local.resolve_responsive_iframe_strategy(
+            {'responsive_iframe_strategy': 'once'}, {}), 'once')
+        with patch.dict(os.environ, {'PERCY_RESPONSIVE_IFRAME_STRATEGY': 'adaptive'}):
+            self.assertEqual(local.resolve_responsive_iframe_strategy({}, {}), 'adaptive')
+        self.assertEqual(local.resolve_responsive_iframe_strategy(
+            {'responsiveIframeStrategy': 'sometimes'}, config), 'per-width')
+
+    def test_once_reuses_captures_from_the_first_width(self):
+        state = {'strategy': 'once', 'entries': {}, 'sizes': {}}
+        frames = [self._meta('https://ads.example.net/', 'pid-a')]
+        first, _ = self._capture(state, frames, [self._entries('pid-a', '<w1/>')])
+
+        resized = [self._meta('https://ads.example.net/', 'pid-a', width=100)]
+        second, mock_tree = self._capture(state, resized, [])
+
+        mock_tree.assert_not_called()
+        self.assertEqual(second, first)
+
+    def test_adaptive_recaptures_only_resized_frames(self):
+        state = {'strategy': 'adaptive', 'entries': {}, 'sizes': {}}
+        frames = [self._meta('https://ads.example.net/', 'pid-a'),
+                  self._meta('https://video.example.org/', 'pid-b')]
+        self._capture(state, frames, [self._entries('pid-a', '<a1/>'),
+                                      self._entries('pid-b', '<b1/>')])
+
+        frames[1] = self._meta('https://video.example.org/', 'pid-b', width=120)
+        result, mock_tree = self._capture(state, frames, [self._entries('pid-b', '<b2/>')])
+
+        mock_tree.assert_called_once()
+        self.assertEqual(mock_tree.call_args.args[1]['percyElementId'], 'pid-b')
+        self.assertEqual([e['iframeSnapshot']['html'] for e in result], ['<a1/>', '<b2/>'])
+        self.assertEqual(state['sizes']['pid-b'], (120, 250))
+
+    def test_frames_appearing_later_are_captured(self):
+        state = {'strategy': 'once', 'entries': {}, 'sizes': {}}
+        self._capture(state, [], [])
+        _, mock_tree = self._capture(
+            state, [self._meta('https://ads.example.net/', 'pid-a')], [[]])
+        mock_tree.assert_called_once()
+        self.assertEqual(state['entries'], {'pid-a': []})
+
+    @patch('percy.snapshot.change_window_dimension_and_wait', MagicMock())
+    @patch('percy.snapshot._responsive_sleep', MagicMock())
+    @patch('percy.snapshot._wait_for_ready', MagicMock(return_value=None))
+    @patch('percy.snapshot.get_responsive_widths',
+           MagicMock(return_value=[{'width': 375}, {'width': 1280}]))
+    @patch('percy.snapshot.get_serialized_dom')
+    def test_capture_responsive_dom_shares_state_across_widths(self, mock_dom):
+        mock_dom.side_effect = lambda *a, **kw: {}
+        driver = MagicMock()
+        driver.get_window_size.return_value = {'width': 1000, 'height': 800}
+
+        local.capture_responsive_dom(driver, [], {}, percy_dom_script='PERCY_DOM',
+                                     responsiveIframeStrategy='once')
+
+        states = [c.kwargs['responsive_iframes'] for c in mock_dom.call_args_list]
+        self.assertEqual(states[0]['strategy'], 'once')
+        self.assertIs(states[0], states[1])
+
+        mock_dom.reset_mock()
+        with patch('percy.snapshot.PERCY_RESPONSIVE_CAPTURE_RELOAD_PAGE', True), \
+                patch('percy.snapshot.expose_closed_shadow_roots'), \
+                patch('percy.snapshot._setup_resize_listener'):
+            local.capture_responsive_dom(driver, [], {}, percy_dom_script='PERCY_DOM',
+                                         responsiveIframeStrategy='once')
+        self.assertIsNone(mock_dom.call_args.kwargs['responsive_iframes'])
+
+    def test_strategy_option_is_not_forwarded_to_serialize(self):
+        driver = MagicMock()
+        driver.execute_script.return_value = {'html': '<html/>'}
+        local.get_serialized_dom(driver, [], responsiveIframeStrategy='once',
+                                 responsive_iframe_strategy='once')
+        self.assertNotIn('iframeStrategy', driver.execute_script.call_args_list[0].args[0])
+
+
 class TestCaptureCorsIframesErrorHandling(unittest.TestCase):
     def test_unexpected_error_returns_empty_list(self):
         driver = MagicMock()
@@ -366,6 +852,210 @@ class TestCaptureCorsIframesErrorHandling(unittest.TestCase):
         self.assertEqual(result, [])
 
 
+class TestParallelCorsCapture(unittest.TestCase):
+    PAGE = 'http://main.example.com/'
+
+    @staticmethod
+    def _meta(src, percy_id):
+        return {'src': src, 'srcdoc': None, 'percyElementId': percy_id,
+                'dataPercyIgnore': False, 'matchesIgnoreSelector': False, 'index': 0}
+
+    @staticmethod
+    def _frame_driver(fail_on=None):
+        helper = MagicMock()
+        state = {}
+
+        def get(url):
+            if url == fail_on:
+                raise Exception('navigation timed out')
+            state['url'] = url
+        helper.get.side_effect = get
+
+        def execute_script(script, *_args):
+            if not script.startswith('PERCY_DOM'):
+                return {'status': 'inject'}
+            return {'status': 'ok', 'snapshot': {'html': state['url']},
+                    'frameUrl': state['url'], 'iframes': []}
+        helper.execute_script.side_effect = execute_script
+        return helper
+
+    def setUp(self):
+        self.frames = [self._meta(f'https://ads{i}.example.net/', f'f{i}') for i in range(3)]
+        self.main = MagicMock()
+        self.main.execute_script.return_value = self.frames
+        self.addCleanup(local.disable_parallel_cors_capture)
+
+    @patch('percy.snapshot.process_frame_tree')
+    def test_frames_are_captured_on_helper_sessions_in_page_order(self, mock_tree):
+        factory = MagicMock(side_effect=self._frame_driver)
+        pool = local.enable_parallel_cors_capture(factory, max_sessions=2)
+
+        result = local._capture_cors_iframes(self.main, self.PAGE, _tree_ctx())
+
+        mock_tree.assert_not_called()
+        self.assertEqual(result, [
+            {'iframeData': {'percyElementId': f'f{i}'},
+             'iframeSnapshot': {'html': f'https://ads{i}.example.net/'},
+             'frameUrl': f'https://ads{i}.example.net/'} for i in range(3)])
+        self.assertLessEqual(pool.size(), 2)
+
+    @patch('percy.snapshot.process_frame_tree')
+    def test_failed_helper_capture_falls_back_to_the_main_driver(self, mock_tree):
+        mock_tree.return_value = [{'iframeData': {'percyElementId': 'f1'},
+                                   'iframeSnapshot': {}, 'frameUrl': 'fallback'}]
+        local.enable_parallel_cors_capture(
+            lambda: self._frame_driver(fail_on='https://ads1.example.net/'), max_sessions=1)
+
+        result = local._capture_cors_iframes(self.main, self.PAGE, _tree_ctx())
+
+        self.assertEqual([e['frameUrl'] for e in result], [
+            'https://ads0.example.net/', 'fallback', 'https://ads2.example.net/'])
+        mock_tree.assert_called_once_with(self.main, self.frames[1], 1, {self.PAGE},
+                                          _tree_ctx())
+
+    def test_helper_is_sized_to_the_iframe_box(self):
+        helper = self._frame_driver()
+        helper.capabilities = {'browserName': 'chrome'}
+        local.enable_parallel_cors_capture(lambda: helper, max_sessions=1)
+        meta = {**self.frames[0], 'width': 300, 'height': 250}
+
+        result = local._capture_cors_iframe_on_helper(
+            local._cors_driver_pool, meta, self.PAGE, _tree_ctx())
+
+        self.assertEqual(result[0]['frameUrl'], 'https://ads0.example.net/')
+        self.assertEqual(helper.method_calls[0], call.execute_cdp_cmd(
+            'Emulation.setDeviceMetricsOverride',
+            {'width': 300, 'height': 250, 'deviceScaleFactor': 1, 'mobile': False}))
+
+    @patch('percy.snapshot.process_frame_tree', return_value=[])
+    def test_single_frame_stays_on_the_main_driver(self, mock_tree):
+        factory = MagicMock()
+        local.enable_parallel_cors_capture(factory)
+        self.main.execute_script.return_value = self.frames[:1]
+
+        local._capture_cors_iframes(self.main, self.PAGE, _tree_ctx())
+
+        factory.assert_not_called()
+        mock_tree.assert_called_once()
+
+    def test_reenabling_closes_the_previous_pool(self):
+        first = local.enable_parallel_cors_capture(MagicMock())
+        with patch.object(first, 'close') as mock_close:
+            local.enable_parallel_cors_capture(MagicMock())
+        mock_close.assert_called_once_with()
+
+
+class TestParallelResponsiveCapture(unittest.TestCase):
+    PAGE = 'http://main.example.com/'
+    COOKIES = [{'name': 'session', 'value': 'abc'}]
+
+    @staticmethod
+    def _helper(fail_width=None):
+        helper = MagicMock()
+        state = {}
+
+        def set_window_size(width, _height):
+            state['width'] = width
+        helper.set_window_size.side_effect = set_window_size
+
+        def execute_script(script, *_args):
+            if 'PercyDOM.serialize' in script:
+                if state.get('width') == fail_width:
+                    raise Exception('renderer crashed')
+                return {'html': f"w{state['width']}"}
+            return True
+        helper.execute_script.side_effect = execute_script
+        return helper
+
+    def setUp(self):
+        self.main = MagicMock()
+        self.main.current_url = self.PAGE
+        self.main.get_window_size.return_value = {'width': 1280, 'height': 800}
+        self.addCleanup(local.disable_parallel_responsive_capture)
+        for target in ('percy.snapshot._responsive_sleep', 'percy.snapshot._wait_for_ready',
+                       'percy.snapshot.expose_closed_shadow_roots'):
+            patcher = patch(target, MagicMock(return_value=None))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _widths(self, *widths):
+        return [{'width': width} for width in widths]
+
+    def test_widths_are_captured_on_helper_sessions_in_order(self):
+        helpers = []
+
+        def factory():
+            helpers.append(self._helper())
+            return helpers[-1]
+        pool = local.enable_parallel_responsive_capture(factory, max_sessions=2)
+
+        with patch('percy.snapshot.change_window_dimension_and_wait') as mock_resize:
+            mock_resize.side_effect = lambda d, w, h, *_a, **_k: d.set_window_size(w, h)
+            futures = local._submit_widths_to_helpers(
+                self.main, self.COOKIES, {}, [(375, 800), (768, 800), (1280, 800)],
+                (1280, 800), 'PERCY_DOM', {})
+            result = {index: future.result() for index, future in futures.items()}
+
+        self.assertEqual(result, {i: {'html': f'w{w}', 'cookies': self.COOKIES, 'width': w}
+                                  for i, w in enumerate((375, 768))})
+        self.assertLessEqual(pool.size(), 2)
+        for helper in helpers:
+            helper.add_cookie.assert_called_with(self.COOKIES[0])
+            helper.get.assert_called_with(self.PAGE)
+        self.main.set_window_size.assert_not_called()
+
+    def test_current_width_is_captured_in_the_main_window(self):
+        factory = MagicMock(side_effect=self._helper)
+        local.enable_parallel_responsive_capture(factory, max_sessions=2)
+        self.main.execute_script.return_value = {'html': 'main'}
+
+        with patch('percy.snapshot.change_window_dimension_and_wait') as mock_resize, \
+                patch('percy.snapshot.get_responsive_widths',
+                      return_value=self._widths(375, 1280)):
+            mock_resize.side_effect = lambda d, w, h, *_a, **_k: d.set_window_size(w, h)
+            result = local.capture_responsive_dom(
+                self.main, self.COOKIES, {}, percy_dom_script='PERCY_DOM')
+
+        self.assertEqual([(s['width'], s['html']) for s in result],
+                         [(375, 'w375'), (1280, 'main')])
+        self.assertEqual(factory.call_count, 1)
+        self.main.set_window_size.assert_not_called()
+
+    def test_failed_width_falls_back_to_the_main_window(self):
+        def factory():
+            return self._helper(fail_width=768)
+        local.enable_parallel_responsive_capture(factory, max_sessions=1)
+        self.main.execute_script.return_value = {'html': 'main'}
+
+        with patch('percy.snapshot.change_window_dimension_and_wait') as mock_resize, \
+                patch('percy.snapshot.get_responsive_widths',
+                      return_value=self._widths(375, 768)):
+            mock_resize.side_effect = lambda d, w, h, *_a, **_k: d.set_window_size(w, h)
+            result = local.capture_responsive_dom(
+                self.main, self.COOKIES, {}, percy_dom_script='PERCY_DOM')
+
+        self.assertEqual([(s['width'], s['html']) for s in result],
+                         [(375, 'w375'), (768, 'main')])
+        self.main.set_window_size.assert_any_call(768, 800)
+
+    def test_single_width_or_no_pool_stays_in_the_main_window(self):
+        self.assertEqual(local._submit_widths_to_helpers(
+            self.main, [], {}, [(375, 800), (768, 800)], (1280, 800), 'PERCY_DOM', {}), {})
+        factory = MagicMock()
+        local.enable_parallel_responsive_capture(factory)
+        self.assertEqual(local._submit_widths_to_helpers(
+            self.main, [], {}, [(375, 800)], (1280, 800), 'PERCY_DOM', {}), {})
+        self.assertEqual(local._submit_widths_to_helpers(
+            self.main, [], {}, [(1280, 800), (1280, 800)], (1280, 800), 'PERCY_DOM', {}), {})
+        factory.assert_not_called()
+
+    def test_reenabling_closes_the_previous_pool(self):
+        first = local.enable_parallel_responsive_capture(MagicMock())
+        with patch.object(first, 'close') as mock_close:
+            local.enable_parallel_responsive_capture(MagicMock())
+        mock_close.assert_called_once_with()
+
+
 class TestExposeClosedShadowRootsEdgeCases(unittest.TestCase):
     def test_capabilities_access_failure_is_treated_as_non_chromium(self):
         cdp_calls = []
@@ -432,6 +1122,209 @@ class TestExposeClosedShadowRootsEdgeCases(unittest.TestCase):
         local.expose_closed_shadow_roots(driver)  # must not raise
 
 
+class TestExposeClosedShadowRootsBatching(unittest.TestCase):
+    ROOTS = 5
+
+    def setUp(self):
+        self.stats = patch.dict(local.CLOSED_SHADOW_ROOT_STATS,
+                                {'found': 0, 'exposed': 0, 'cdp_calls': 0, 'seconds': 0.0})
+        self.stats.start()
+        self.driver = MagicMock()
+        self.driver.capabilities = {'browserName': 'chrome'}
+        self.fail_batches = False
+        self.driver.execute_cdp_cmd.side_effect = self.cdp
+
+    def tearDown(self):
+        self.stats.stop()
+
+    def cdp(self, cmd, params):
+        if cmd == 'DOM.getDocument':
+            return {'root': {'backendNodeId': 1, 'children': [
+                {'backendNodeId': 10 + i,
+                 'shadowRoots': [{'backendNodeId': 100 + i, 'shadowRootType': 'closed'}]}
+                for i in range(self.ROOTS)]}}
+        if cmd == 'DOM.resolveNode':
+            return {'object': {'objectId': f"root-{params['backendNodeId']}"}}
+        if cmd == 'Runtime.callFunctionOn' and self.fail_batches and 'arguments' in params:
+            raise Exception('argument list too long')
+        return {}
+
+    def calls(self, cmd):
+        return [c.args[1] for c in self.driver.execute_cdp_cmd.call_args_list
+                if c.args[0] == cmd]
+
+    def test_roots_are_exposed_in_one_call_per_batch(self):
+        with patch.object(local, 'PERCY_SHADOW_ROOT_BATCH_SIZE', 2):
+            local.expose_closed_shadow_roots(self.driver)
+
+        batches = self.calls('Runtime.callFunctionOn')
+        self.assertEqual([len(b['arguments']) for b in batches], [2, 2, 1])
+        self.assertIn('root.host', batches[0]['functionDeclaration'])
+        self.assertEqual(len(self.calls('DOM.resolveNode')), self.ROOTS)
+        self.assertEqual(self.calls('Runtime.releaseObjectGroup'),
+                         [{'objectGroup': 'percy-closed-shadow-roots'}])
+        self.assertEqual(local.CLOSED_SHADOW_ROOT_STATS['found'], self.ROOTS)
+        self.assertEqual(local.CLOSED_SHADOW_ROOT_STATS['exposed'], self.ROOTS)
+        self.assertEqual(local.CLOSED_SHADOW_ROOT_STATS['cdp_calls'], self.ROOTS + 4)
+
+    def test_failed_batch_is_retried_per_root(self):
+        self.fail_batches = True
+        with patch('percy.snapshot.log') as mock_log:
+            local.expose_closed_shadow_roots(self.driver)
+
+        singles = [c for c in self.calls('Runtime.callFunctionOn') if 'arguments' not in c]
+        self.assertEqual([c['objectId'] for c in singles],
+                         [f'root-{100 + i}' for i in range(self.ROOTS - 1, -1, -1)])
+        self.assertEqual(local.CLOSED_SHADOW_ROOT_STATS['exposed'], self.ROOTS)
+        self.assertIn('Exposed %d/%d closed shadow root(s)', mock_log.call_args.args[0])
+
+    def test_batching_can_be_disabled(self):
+        with patch.object(local, 'PERCY_SHADOW_ROOT_BATCH_SIZE', 0):
+            local.expose_closed_shadow_roots(self.driver)
+
+        calls = self.calls('Runtime.callFunctionOn')
+        self.assertEqual(len(calls), self.ROOTS)
+        self.assertTrue(all('this.host' in c['functionDeclaration'] for c in calls))
+
+    def test_single_root_failure_is_counted_but_not_raised(self):
+        def cdp(cmd, params):
+            if cmd == 'Runtime.callFunctionOn':
+                raise Exception('context destroyed')
+            if cmd == 'Runtime.releaseObjectGroup':
+                raise Exception('target closed')
+            return self.cdp(cmd, params)
+        self.driver.execute_cdp_cmd.side_effect = cdp
+
+        local.expose_closed_shadow_roots(self.driver)
+        self.assertEqual(local.CLOSED_SHADOW_ROOT_STATS['found'], self.ROOTS)
+        self.assertEqual(local.CLOSED_SHADOW_ROOT_STATS['exposed'], 0)
+
+
+class TestClosedShadowRootPrescan(unittest.TestCase):
+    HOST = {'backendNodeId': 10, 'localName': 'x-card',
+            'shadowRoots': [{'backendNodeId': 11, 'shadowRootType': 'closed', 'children': [
+                {'backendNodeId': 12, 'localName': 'x-inner',
+                 'shadowRoots': [{'backendNodeId': 13, 'shadowRootType': 'closed'}]}]}]}
+
+    def setUp(self):
+        self.driver = MagicMock()
+        self.driver.capabilities = {'browserName': 'chrome'}
+        self.candidates = ['el-0', 'el-1']
+        self.driver.execute_cdp_cmd.side_effect = self.cdp
+        patcher = patch.multiple(local, PERCY_SHADOW_DISCOVERY='prescan',
+                                 PERCY_SHADOW_DISCOVERY_BUDGET=2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def cdp(self, cmd, params):
+        if cmd == 'Runtime.evaluate':
+            return {'result': {'type': 'object', 'objectId': 'array'}}
+        if cmd == 'Runtime.getProperties':
+            return {'result': [{'name': str(i), 'value': {'objectId': oid}}
+                               for i, oid in enumerate(self.candidates)]
+                    + [{'name': 'length', 'value': {'value': len(self.candidates)}}]}
+        if cmd == 'DOM.describeNode':
+            # both candidates report the same host so dedupe is exercised
+            return {'node': self.HOST}
+        if cmd == 'DOM.getDocument':
+            return {'root': {'backendNodeId': 1, 'children': [self.HOST]}}
+        if cmd == 'DOM.resolveNode':
+            return {'object': {'objectId': f"root-{params['backendNodeId']}"}}
+        return {}
+
+    def cmds(self):
+        return [c.args[0] for c in self.driver.execute_cdp_cmd.call_args_list]
+
+    def exposed_roots(self):
+        return sorted(c.args[1]['backendNodeId'] for c in self.driver.execute_cdp_cmd.call_args_list
+                      if c.args[0] == 'DOM.resolveNode')
+
+    def test_prescan_describes_only_candidates(self):
+        local.expose_closed_shadow_roots(self.driver)
+
+        self.assertNotIn('DOM.getDocument', self.cmds())
+        self.assertEqual(self.cmds().count('DOM.describeNode'), 2)
+        self.assertEqual(self.exposed_roots(), [11, 13])
+        evaluate = self.driver.execute_cdp_cmd.call_args_list[1].args[1]
+        self.assertTrue(evaluate['expression'].endswith('(2)'))
+
+    def test_over_budget_falls_back_to_full_walk(self):
+        self.candidates = ['el-0', 'el-1', 'el-2']
+        with patch('percy.snapshot.log') as mock_log:
+            local.expose_closed_shadow_roots(self.driver)
+
+        self.assertNotIn('DOM.describeNode', self.cmds())
+        self.assertIn('DOM.getDocument', self.cmds())
+        self.assertEqual(self.exposed_roots(), [11, 13])
+        self.assertIn('walking the full document', mock_log.call_args_list[0].args[0])
+
+    def test_scan_failure_falls_back_to_full_walk(self):
+        def cdp(cmd, params):
+            if cmd == 'Runtime.evaluate':
+                raise Exception('execution context destroyed')
+            if cmd == 'Runtime.releaseObjectGroup':
+                raise Exception('target closed')
+            return self.cdp(cmd, params)
+        self.driver.execute_cdp_cmd.side_effect = cdp
+
+        local.expose_closed_shadow_roots(self.driver)
+        self.assertIn('DOM.getDocument', self.cmds())
+
+    def test_missing_result_object_falls_back_to_full_walk(self):
+        def cdp(cmd, params):
+            if cmd == 'Runtime.evaluate':
+                return {'result': {'type': 'undefined'}}
+            return self.cdp(cmd, params)
+        self.driver.execute_cdp_cmd.side_effect = cdp
+
+        local.expose_closed_shadow_roots(self.driver)
+        self.assertIn('DOM.getDocument', self.cmds())
+
+    def test_no_candidates_skips_exposure(self):
+        self.candidates = []
+        local.expose_closed_shadow_roots(self.driver)
+
+        self.assertNotIn('DOM.getDocument', self.cmds())
+        self.assertNotIn('DOM.resolveNode', self.cmds())
+        scripts = [c.args[0] for c in self.driver.execute_script.call_args_list]
+        self.assertFalse(any('__percyClosedShadowRoots' in s for s in scripts))
+
+
+class TestCustomElementProbe(unittest.TestCase):
+    def setUp(self):
+        self.driver = MagicMock()
+        self.driver.capabilities = {'browserName': 'chrome'}
+
+    def test_page_without_custom_elements_skips_cdp(self):
+        self.driver.execute_script.return_value = False
+        local.expose_closed_shadow_roots(self.driver)
+
+        self.driver.execute_cdp_cmd.assert_not_called()
+        self.assertIn("querySelectorAll('*')", self.driver.execute_script.call_args.args[0])
+
+    def test_page_with_custom_elements_runs_cdp(self):
+        self.driver.execute_script.return_value = True
+        self.driver.execute_cdp_cmd.return_value = {}
+        local.expose_closed_shadow_roots(self.driver)
+
+        self.driver.execute_cdp_cmd.assert_any_call('DOM.enable', {})
+
+    def test_probe_failure_runs_cdp(self):
+        self.driver.execute_script.side_effect = Exception('no such window')
+        self.driver.execute_cdp_cmd.return_value = {}
+        local.expose_closed_shadow_roots(self.driver)
+
+        self.driver.execute_cdp_cmd.assert_any_call('DOM.enable', {})
+
+    @patch('percy.snapshot.PERCY_FORCE_CLOSED_SHADOW_CAPTURE', True)
+    def test_force_skips_the_probe(self):
+        self.driver.execute_cdp_cmd.return_value = {}
+        local.expose_closed_shadow_roots(self.driver)
+
+        self.driver.execute_script.assert_not_called()
+        self.driver.execute_cdp_cmd.assert_any_call('DOM.enable', {})
+
+
 class TestGetOriginHelpers(unittest.TestCase):
     def test_get_origin_returns_none_without_scheme_or_netloc(self):
         self.assertIsNone(local.get_origin('not-a-url'))
@@ -470,6 +1363,202 @@ class TestGetSerializedDomPageUrlFailure(unittest.TestCase):
         self.assertEqual(dom['cookies'], [{'name': 'k', 'value': 'v'}])
 
 
+class TestRawDomSnapshot(unittest.TestCase):
+    @patch('percy.snapshot.PERCY_RAW_DOM_SNAPSHOT', True)
+    @patch('percy.snapshot.get_transport')
+    def test_browser_json_reaches_the_post_body_unparsed(self, mock_get_transport):
+        raw_text = '{"html":"<p>hi</p>","warnings":[]}'
+        driver = MagicMock()
+        driver.execute_script.side_effect = lambda script, *_args: (
+            raw_text if 'JSON.stringify(PercyDOM.serialize(' in script else [])
+        mock_get_transport.return_value.post.return_value.json.return_value = {
+            'success': True}
+
+        dom = local.get_serialized_dom(driver, [{'name': 'k'}], percy_dom_script='PERCY_DOM',
+                                       readiness_diagnostics={'passed': True},
+                                       skip_readiness=True)
+        local._post_snapshot('Raw', {'name': 'Raw', 'dom_snapshot': dom})
+
+        self.assertIsInstance(dom, local.RawJSON)
+        self.assertIs(dom.text, raw_text)
+        body = mock_get_transport.return_value.post.call_args.kwargs['data']
+        self.assertIn(raw_text[:-1].encode('utf-8'), body)
+        self.assertEqual(json.loads(body)['dom_snapshot'], {
+            'html': '<p>hi</p>', 'warnings': [], 'readiness_diagnostics': {'passed': True},
+            'cookies': [{'name': 'k'}]})
+
+    @patch('percy.snapshot.PERCY_RAW_DOM_SNAPSHOT', True)
+    def test_missing_snapshot_raises(self):
+        driver = MagicMock()
+        driver.execute_script.return_value = None
+        with self.assertRaises(Exception):
+            local.get_serialized_dom(driver, [], skip_readiness=True)
+
+    def test_identical_raw_widths_share_one_text(self):
+        first, second = local.RawJSON('{"html":"x"}'), local.RawJSON(''.join(['{"html"', ':"x"}']))
+        seen = {}
+        local._share_identical_snapshot_parts(first, seen)
+        local._share_identical_snapshot_parts(second, seen)
+        self.assertIs(second.parts, first.parts)
+
+
+class TestChunkedDomRetrieval(unittest.TestCase):
+    SNAPSHOT = {'html': '<p>' + 'caf\u00e9 \U0001F600 ' * 50 + '</p>', 'resources': []}
+
+    def _driver(self):
+        page = {}
+        driver = MagicMock()
+
+        def execute_script(script, *args):
+            if 'JSON.stringify(PercyDOM.serialize(' in script:
+                page['dom'] = json.dumps(self.SNAPSHOT, ensure_ascii=False)
+                return len(page['dom'])
+            if script == local._DOM_SLICE_JS:
+                start, size = args
+                return [page['dom'][start:start + size], min(start + size, len(page['dom']))]
+            if script.startswith('delete window.__percySerializedDom'):
+                page.pop('dom')
+            return []
+        driver.execute_script.side_effect = execute_script
+        return driver, page
+
+    @patch('percy.snapshot.PERCY_DOM_CHUNK_SIZE', 64)
+    @patch('percy.snapshot.get_transport')
+    def test_dom_is_pulled_in_slices_and_streamed_unjoined(self, mock_get_transport):
+        driver, page = self._driver()
+
+        dom = local.get_serialized_dom(driver, [], skip_readiness=True)
+
+        self.assertIsInstance(dom, local.RawJSON)
+        self.assertGreater(len(dom.parts), 5)
+        self.assertTrue(all(len(part) <= 64 for part in dom.parts))
+        self.assertNotIn('dom', page)
+        self.assertEqual(dom.decode(), {**self.SNAPSHOT, 'cookies': []})
+
+        with patch('percy.snapshot.PERCY_STREAM_SNAPSHOTS', True):
+            local._post_snapshot('Chunked', {'name': 'Chunked', 'dom_snapshot': dom})
+        args = mock_get_transport.return_value.post_json_stream.call_args.args
+        body = b''.join(iter_json_body(args[1], chunk_size=32))
+        self.assertEqual(json.loads(body)['dom_snapshot']['html'], self.SNAPSHOT['html'])
+
+    @patch('percy.snapshot.PERCY_DOM_CHUNK_SIZE', 64)
+    def test_page_buffer_is_released_when_a_slice_fails(self):
+        driver, page = self._driver()
+        original = driver.execute_script.side_effect
+
+        def execute_script(script, *args):
+            if script == local._DOM_SLICE_JS:
+                raise Exception('response too large')
+            return original(script, *args)
+        driver.execute_script.side_effect = execute_script
+
+        with self.assertRaises(Exception):
+            local.get_serialized_dom(driver, [], skip_readiness=True)
+        self.assertNotIn('dom', page)
+
+
+class TestResourceDedupe(unittest.TestCase):
+    @staticmethod
+    def _payload(name):
+        return {'name': name, 'dom_snapshot': {'html': '<p></p>', 'resources': [
+            {'url': 'http://localhost/logo.png', 'content': 'QUJD', 'mimetype': 'image/png'}]}}
+
+    def setUp(self):
+        self.store = local.enable_resource_dedupe()
+        self.addCleanup(local.disable_resource_dedupe)
+        patcher = patch('percy.snapshot.is_percy_enabled',
+                        return_value={'session_type': 'web', 'resource_references': True})
+        self.is_percy_enabled = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch('percy.snapshot.get_transport')
+    def test_second_snapshot_references_the_uploaded_body(self, mock_get_transport):
+        post = mock_get_transport.return_value.post
+        post.return_value.json.return_value = {'success': True}
+
+        local._post_snapshot('One', self._payload('One'))
+        local._post_snapshot('Two', self._payload('Two'))
+
+        bodies = [json.loads(c.kwargs['data']) for c in post.call_args_list]
+        self.assertEqual(bodies[0]['dom_snapshot']['resources'][0]['content'], 'QUJD')
+        self.assertEqual(bodies[1]['dom_snapshot']['resources'][0], {
+            'url': 'http://localhost/logo.png', 'mimetype': 'image/png',
+            'sha': local.ResourceStore.digest('QUJD')})
+
+    @patch('percy.snapshot.get_transport')
+    def test_cli_without_the_capability_gets_full_snapshots(self, mock_get_transport):
+        self.is_percy_enabled.return_value = {'session_type': 'web', 'resource_references': False}
+        post = mock_get_transport.return_value.post
+        post.return_value.json.return_value = {'success': True}
+        self.store.confirm({local.ResourceStore.digest('QUJD')})
+
+        local._post_snapshot('One', self._payload('One'))
+
+        body = json.loads(post.call_args.kwargs['data'])
+        self.assertEqual(body['dom_snapshot']['resources'][0]['content'], 'QUJD')
+
+    @patch('percy.snapshot.PERCY_RESOURCE_DEDUPE_URL', 'http://standin:5339/percy/snapshot')
+    @patch('percy.snapshot.get_transport')
+    def test_stand_in_url_receives_references(self, mock_get_transport):
+        self.is_percy_enabled.return_value = {'session_type': 'web'}
+        post = mock_get_transport.return_value.post
+        post.return_value.json.return_value = {'success': True}
+        self.store.confirm({local.ResourceStore.digest('QUJD')})
+
+        local._post_snapshot('One', self._payload('One'))
+
+        self.assertEqual(post.call_args.args[0], 'http://standin:5339/percy/snapshot')
+        body = json.loads(post.call_args.kwargs['data'])
+        self.assertIn('sha', body['dom_snapshot']['resources'][0])
+
+    @patch('percy.snapshot.get_transport')
+    def test_rejected_references_are_resent_in_full(self, mock_get_transport):
+        post = mock_get_transport.return_value.post
+        sha = local.ResourceStore.digest('QUJD')
+        self.store.confirm({sha})
+        rejected, accepted = MagicMock(), MagicMock()
+        rejected.json.return_value = {'success': False, 'error': 'unknown resource',
+                                      'unknownResources': [sha]}
+        accepted.json.return_value = {'success': True, 'data': {'ok': 1}}
+        post.side_effect = [rejected, accepted]
+
+        self.assertEqual(local._post_snapshot('One', self._payload('One')), {'ok': 1})
+
+        full = json.loads(post.call_args.kwargs['data'])
+        self.assertEqual(full['dom_snapshot']['resources'][0]['content'], 'QUJD')
+        self.assertEqual(self.store.size(), 1)
+
+    @patch('percy.snapshot.get_transport')
+    def test_other_failures_are_not_resent(self, mock_get_transport):
+        post = mock_get_transport.return_value.post
+        self.store.confirm({local.ResourceStore.digest('QUJD')})
+        post.side_effect = Exception('Read timed out')
+
+        self.assertIsNone(local._post_snapshot('One', self._payload('One')))
+
+        post.assert_called_once()
+        self.assertEqual(self.store.size(), 1)
+
+    @patch('percy.snapshot.get_transport')
+    def test_healthcheck_reports_the_capability(self, mock_get_transport):
+        response = mock_get_transport.return_value.get.return_value
+        response.headers = {'x-percy-core-version': '1.30.0'}
+        response.json.return_value = {'success': True, 'type': 'web',
+                                      'capabilities': ['resource-references', 'gzip-requests']}
+        data = local._healthcheck()
+        self.assertTrue(data['resource_references'] and data['gzip_requests'])
+        response.json.return_value = {'success': True, 'type': 'web'}
+        data = local._healthcheck()
+        self.assertFalse(data['resource_references'] or data['gzip_requests'])
+
+    @patch('percy.snapshot._healthcheck', return_value=False)
+    def test_refreshing_the_healthcheck_forgets_uploaded_bodies(self, _health):
+        self.addCleanup(local.is_percy_enabled.cache_clear)
+        self.store.confirm({'abc'})
+        local.refresh_percy_enabled()
+        self.assertEqual(self.store.size(), 0)
+
+
 class TestResponsiveDebugDump(unittest.TestCase):
     def tearDown(self):
         if os.path.exists('output_file.json'):
@@ -502,5 +1591,328 @@ class TestResponsiveDebugDump(unittest.TestCase):
         self.assertEqual(result, [])
 
 
+class TestStreamedSnapshotPost(unittest.TestCase):
+    URL = 'http://localhost:5338/percy/snapshot'
+
+    @patch('percy.snapshot.PERCY_SNAPSHOT_GZIP', True)
+    @patch('percy.snapshot.PERCY_STREAM_SNAPSHOTS', True)
+    @patch('percy.snapshot.is_percy_enabled', MagicMock(return_value={'gzip_requests': True}))
+    @patch('percy.snapshot.get_transport')
+    def test_stream_mode_posts_through_the_streaming_path(self, mock_get_transport):
+        transport = mock_get_transport.return_value
+        transport.post_json_stream.return_value.json.return_value = {
+            'success': True, 'data': {'ok': 1}}
+        payload = {'name': 'Streamed', 'dom_snapshot': {'html': '<p></p>'}}
+
+        self.assertEqual(local._post_snapshot('Streamed', payload), {'ok': 1})
+
+        transport.post.assert_not_called()
+        transport.post_json_stream.assert_called_once_with(
+            self.URL, payload, compress=True, timeout=600)
+
+    @patch('percy.snapshot.PERCY_SNAPSHOT_GZIP', True)
+    @patch('percy.snapshot.PERCY_STREAM_SNAPSHOTS', True)
+    @patch('percy.snapshot.is_percy_enabled', MagicMock(return_value={'gzip_requests': False}))
+    @patch('percy.snapshot.get_transport')
+    def test_gzip_needs_the_cli_capability(self, mock_get_transport):
+        transport = mock_get_transport.return_value
+        transport.post_json_stream.return_value.json.return_value = {'success': True}
+
+        local._post_snapshot('Streamed', {'name': 'Streamed'})
+
+        transport.post_json_stream.assert_called_once_with(
+            self.URL, {'name': 'Streamed'}, compress=False, timeout=600)
+
+    @patch('percy.snapshot.PERCY_SNAPSHOT_GZIP', True)
+    @patch('percy.snapshot.PERCY_STREAM_SNAPSHOTS', True)
+    @patch('percy.snapshot.is_percy_enabled', MagicMock(return_value={'gzip_requests': True}))
+    @patch('percy.snapshot.get_transport')
+    def test_rejected_gzip_body_is_resent_uncompressed(self, mock_get_transport):
+        transport = mock_get_transport.return_value
+        rejected, accepted = MagicMock(status_code=415), MagicMock(status_code=200)
+        accepted.json.return_value = {'success': True, 'data': {'ok': 1}}
+        transport.post_json_stream.side_effect = [rejected, accepted]
+
+        self.assertEqual(local._post_snapshot('Streamed', {'name': 'Streamed'}), {'ok': 1})
+
+        self.assertEqual([c.kwargs['compress'] for c in transport.post_json_stream.call_args_list],
+                         [True, False])
+
+    @patch('percy.snapshot.get_transport')
+    def test_default_mode_posts_json(self, mock_get_transport):
+        transport = mock_get_transport.return_value
+        transport.post.return_value.json.return_value = {'success': True}
+
+        local._post_snapshot('Plain', {'name': 'Plain'})
+
+        transport.post_json_stream.assert_not_called()
+        self.assertEqual(json.loads(transport.post.call_args.kwargs['data']), {'name': 'Plain'})
+
+
+@patch('percy.snapshot.fetch_percy_dom', MagicMock(return_value='PERCY_DOM'))
+@patch('percy.snapshot.is_percy_enabled',
+       MagicMock(return_value={'session_type': 'web', 'config': {}, 'widths': {}}))
+class TestAsyncUploads(unittest.TestCase):
+    @staticmethod
+    def _driver():
+        driver = MagicMock()
+        driver.current_url = 'http://localhost:8000/'
+        driver.get_cookies.return_value = []
+
+        def execute_script(script, *_args):
+            if 'PercyDOM.serialize' in script:
+                return {'html': '<html></html>'}
+            return []
+        driver.execute_script.side_effect = execute_script
+        return driver
+
+    def tearDown(self):
+        local.disable_async_uploads(5)
+
+    @patch('percy.snapshot.get_transport')
+    def test_snapshot_returns_future_inside_async_block(self, mock_get_transport):
+        response = mock_get_transport.return_value.post.return_value
+        response.json.return_value = {'success': True, 'data': {'ok': 1}}
+
+        with local.async_uploads(workers=1) as uploads:
+            future = local.percy_snapshot(self._driver(), 'Async')
+            self.assertIsInstance(future, Future)
+        self.assertEqual(uploads.pending(), 0)
+        self.assertEqual(future.result(timeout=0), {'ok': 1})
+        self.assertIsNone(local._upload_queue)
+
+        payload = json.loads(mock_get_transport.return_value.post.call_args.kwargs['data'])
+        self.assertEqual(payload['name'], 'Async')
+        self.assertEqual(payload['dom_snapshot'], {'html': '<html></html>', 'cookies': []})
+
+    @patch('percy.snapshot.get_transport')
+    def test_failed_async_upload_resolves_to_none_and_logs(self, mock_get_transport):
+        mock_get_transport.return_value.post.side_effect = Exception('cli gone')
+        local.enable_async_uploads(workers=1)
+
+        with patch('percy.snapshot.log') as mock_log:
+            future = local.percy_snapshot(self._driver(), 'Broken')
+            self.assertTrue(local.flush(5))
+        self.assertIsNone(future.result(timeout=0))
+        mock_log.assert_any_call('Could not take DOM snapshot "Broken"')
+
+    def test_serialization_failure_is_not_queued(self):
+        driver = self._driver()
+        driver.execute_script.side_effect = Exception('page crashed')
+        uploads = local.enable_async_uploads()
+
+        with patch('percy.snapshot.log'):
+            self.assertIsNone(local.percy_snapshot(driver, 'Crashed'))
+        self.assertEqual(uploads.pending(), 0)
+
+    def test_enable_replaces_and_disable_drains_queue(self):
+        first = local.enable_async_uploads(workers=1)
+        with patch.object(first, 'flush', wraps=first.flush) as mock_flush:
+            second = local.enable_async_uploads(workers=1, max_queue_size=1)
+        mock_flush.assert_called_once_with()
+        self.assertIs(local._upload_queue, second)
+        self.assertTrue(local.disable_async_uploads(5))
+        self.assertIsNone(local._upload_queue)
+        self.assertTrue(local.disable_async_uploads())
+        self.assertTrue(local.flush(5))
+
+
+class TestInjectPercyDom(unittest.TestCase):
+    def setUp(self):
+        self.stats = patch.dict(local.PERCY_DOM_INJECTION_STATS, {'injected': 0, 'skipped': 0})
+        self.stats.start()
+
+    def tearDown(self):
+        self.stats.stop()
+
+    def test_skips_injection_when_same_version_is_present(self):
+        driver = MagicMock()
+        driver.execute_script.return_value = True
+
+        self.assertFalse(local.inject_percy_dom(driver, 'PERCY_DOM'))
+        probe, marker = driver.execute_script.call_args.args
+        self.assertIn("typeof PercyDOM !== 'undefined'", probe)
+        self.assertEqual(marker, local._tagged_percy_dom('PERCY_DOM')[0])
+        self.assertEqual(local.PERCY_DOM_INJECTION_STATS, {'injected': 0, 'skipped': 1})
+
+    def test_injects_tagged_script_when_missing_or_stale(self):
+        driver = MagicMock()
+        driver.execute_script.side_effect = [False, None]
+
+        self.assertTrue(local.inject_percy_dom(driver, 'PERCY_DOM'))
+        marker, tagged = local._tagged_percy_dom('PERCY_DOM')
+        self.assertEqual(driver.execute_script.call_args.args, (tagged,))
+        self.assertTrue(tagged.startswith('PERCY_DOM\n'))
+        self.assertIn(f'window.__percyDomMarker = "{marker}";', tagged)
+        self.assertEqual(local.PERCY_DOM_INJECTION_STATS, {'injected': 1, 'skipped': 0})
+
+    def test_probe_failure_falls_back_to_injection(self):
+        driver = MagicMock()
+        driver.execute_script.side_effect = [Exception('no context'), None]
+        self.assertTrue(local.inject_percy_dom(driver, 'PERCY_DOM'))
+        self.assertEqual(driver.execute_script.call_count, 2)
+
+    def test_force_skips_the_probe(self):
+        driver = MagicMock()
+        self.assertTrue(local.inject_percy_dom(driver, 'PERCY_DOM', force=True))
+        driver.execute_script.assert_called_once_with(local._tagged_percy_dom('PERCY_DOM')[1])
+
+    def test_marker_changes_with_script_version(self):
+        self.assertNotEqual(local._tagged_percy_dom('v1')[0], local._tagged_percy_dom('v2')[0])
+
+    def test_frame_with_percy_dom_is_not_reinjected(self):
+        driver = MagicMock()
+        driver.execute_script.side_effect = [
+            Mock(name='iframe_element'),
+            # PercyDOM already present: captured in a single round trip
+            {'status': 'ok', 'snapshot': {'html': '<x/>'},
+             'frameUrl': 'https://x.example.com/page', 'iframes': []},
+        ]
+        result = local.process_frame_tree(
+            driver, TestProcessFrameTreeGuards._meta('https://x.example.com/page', 'pid-x'),
+            1, set(), _tree_ctx())
+        self.assertEqual(len(result), 1)
+        self.assertEqual(local.PERCY_DOM_INJECTION_STATS, {'injected': 0, 'skipped': 1})
+        script, capture_args = driver.execute_script.call_args.args
+        self.assertNotIn('PERCY_DOM', script)
+        self.assertEqual(capture_args['marker'], local._tagged_percy_dom('PERCY_DOM')[0])
+
+    def test_frame_without_percy_dom_gets_it_with_the_capture(self):
+        driver = MagicMock()
+        driver.execute_script.side_effect = [
+            Mock(name='iframe_element'),
+            {'status': 'inject', 'frameUrl': 'https://x.example.com/page'},
+            {'status': 'ok', 'snapshot': {'html': '<x/>'},
+             'frameUrl': 'https://x.example.com/page', 'iframes': []},
+        ]
+        result = local.process_frame_tree(
+            driver, TestProcessFrameTreeGuards._meta('https://x.example.com/page', 'pid-x'),
+            1, set(), _tree_ctx())
+        self.assertEqual(len(result), 1)
+        self.assertEqual(local.PERCY_DOM_INJECTION_STATS, {'injected': 1, 'skipped': 0})
+        script = driver.execute_script.call_args.args[0]
+        self.assertTrue(script.startswith(local._tagged_percy_dom('PERCY_DOM')[1]))
+        self.assertTrue(script.endswith(local._CAPTURE_FRAME_SCRIPT))
+
+    def test_frames_not_serialized_are_not_counted_as_skipped(self):
+        for result in ({'status': 'unsupported', 'frameUrl': 'about:blank'},
+                       {'status': 'cycle', 'frameUrl': 'https://x.example.com/page'}):
+            driver = MagicMock()
+            driver.execute_script.side_effect = [Mock(name='iframe_element'), result]
+            local.process_frame_tree(
+                driver, TestProcessFrameTreeGuards._meta('https://x.example.com/page', 'pid-x'),
+                1, set(), _tree_ctx())
+        self.assertEqual(local.PERCY_DOM_INJECTION_STATS, {'injected': 0, 'skipped': 0})
+
+    def test_concurrent_counts_are_not_lost(self):
+        driver = MagicMock()
+        driver.execute_script.return_value = True
+
+        def probe():
+            for _ in range(500):
+                local.inject_percy_dom(driver, 'PERCY_DOM')
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for _ in range(8):
+                executor.submit(probe)
+        self.assertEqual(local.PERCY_DOM_INJECTION_STATS, {'injected': 0, 'skipped': 4000})
+
+
+@patch('percy.snapshot.is_percy_enabled', MagicMock(return_value={'core_version': '1.2.3'}))
+class TestFetchPercyDomDiskCache(unittest.TestCase):
+    def setUp(self):
+        local.fetch_percy_dom.cache_clear()
+        self.directory = tempfile.mkdtemp()
+        self.dom_cache = patch.object(local, '_dom_cache', local.DomScriptCache(self.directory))
+        self.dom_cache.start()
+
+    def tearDown(self):
+        self.dom_cache.stop()
+        local.fetch_percy_dom.cache_clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    @patch('percy.snapshot.get_transport')
+    def test_download_is_stored_and_reused_by_the_next_process(self, mock_get_transport):
+        mock_get_transport.return_value.get.return_value.text = 'window.PercyDOM = {};'
+        self.assertEqual(local.fetch_percy_dom(), 'window.PercyDOM = {};')
+
+        # a fresh process (empty lru_cache) loads from disk without any request
+        local.fetch_percy_dom.cache_clear()
+        mock_get_transport.reset_mock()
+        self.assertEqual(local.fetch_percy_dom(), 'window.PercyDOM = {};')
+        mock_get_transport.return_value.get.assert_not_called()
+
+    @patch('percy.snapshot.get_transport')
+    def test_store_failure_is_logged_not_raised(self, mock_get_transport):
+        mock_get_transport.return_value.get.return_value.text = 'dom'
+        with patch.object(local._dom_cache, 'store', side_effect=OSError('read-only')), \
+                patch('percy.snapshot.log') as mock_log:
+            self.assertEqual(local.fetch_percy_dom(), 'dom')
+        self.assertIn('disk cache', mock_log.call_args.args[0])
+
+    @patch('percy.snapshot.get_transport')
+    def test_unknown_version_bypasses_the_disk_cache(self, mock_get_transport):
+        mock_get_transport.return_value.get.return_value.text = 'dom'
+        with patch('percy.snapshot.is_percy_enabled', return_value=False):
+            self.assertEqual(local.fetch_percy_dom(), 'dom')
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class TestSharedHealthcheck(unittest.TestCase):
+    PAYLOAD = {'session_type': 'web', 'config': {}, 'widths': {}, 'core_version': '1.0.0'}
+
+    def setUp(self):
+        local.is_percy_enabled.cache_clear()
+        self.directory = tempfile.mkdtemp()
+        self.shared = local.SharedHealthcheck('http://cli', 'build-1', directory=self.directory)
+        self.patcher = patch.object(local, '_shared_healthcheck', self.shared)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        local.is_percy_enabled.cache_clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    @patch('percy.snapshot._healthcheck')
+    def test_published_payload_is_reused_without_a_request(self, mock_healthcheck):
+        self.shared.store(self.PAYLOAD)
+        self.assertEqual(local.is_percy_enabled(), self.PAYLOAD)
+        mock_healthcheck.assert_not_called()
+
+    @patch('percy.snapshot._healthcheck')
+    def test_successful_healthcheck_is_published(self, mock_healthcheck):
+        mock_healthcheck.return_value = self.PAYLOAD
+        self.assertEqual(local.is_percy_enabled(), self.PAYLOAD)
+        self.assertEqual(self.shared.load(), self.PAYLOAD)
+
+    @patch('percy.snapshot._healthcheck', return_value=False)
+    def test_failed_healthcheck_is_not_published(self, _mock_healthcheck):
+        self.assertFalse(local.is_percy_enabled())
+        self.assertIsNone(self.shared.load())
+
+    @patch('percy.snapshot._healthcheck')
+    def test_publish_failure_is_logged_not_raised(self, mock_healthcheck):
+        mock_healthcheck.return_value = self.PAYLOAD
+        with patch.object(self.shared, 'store', side_effect=OSError('read-only')), \
+                patch('percy.snapshot.log') as mock_log:
+            self.assertEqual(local.is_percy_enabled(), self.PAYLOAD)
+        self.assertIn('share the healthcheck', mock_log.call_args.args[0])
+
+    @patch('percy.snapshot._healthcheck')
+    def test_refresh_drops_local_and_shared_results(self, mock_healthcheck):
+        self.shared.store(self.PAYLOAD)
+        self.assertEqual(local.is_percy_enabled(), self.PAYLOAD)
+
+        restarted = {**self.PAYLOAD, 'core_version': '1.1.0'}
+        mock_healthcheck.return_value = restarted
+        self.assertEqual(local.refresh_percy_enabled(), restarted)
+        self.assertEqual(self.shared.load(), restarted)
+
+    @patch('percy.snapshot._healthcheck', return_value=False)
+    def test_refresh_without_sharing(self, mock_healthcheck):
+        with patch.object(local, '_shared_healthcheck', None):
+            self.assertFalse(local.refresh_percy_enabled())
+        mock_healthcheck.assert_called_once_with()
+
+
 if __name__ == '__main__':
     unittest.main()
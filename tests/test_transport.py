@@ -0,0 +1,147 @@
+# pylint: disable=protected-access
+import gzip
+import json
+import os
+import importlib
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+from unittest.mock import patch, MagicMock
+
+import httpretty
+
+from percy import transport
+from percy.json_codec import RawJSON
+from percy.transport import Transport, get_transport, iter_json_body, set_transport
+
+
+class TestTransport(unittest.TestCase):
+    def setUp(self):
+        httpretty.enable()
+        httpretty.register_uri(httpretty.GET, 'http://localhost:5338/percy/healthcheck',
+                               body='{"success": true}')
+        httpretty.register_uri(httpretty.POST, 'http://localhost:5338/percy/log',
+                               body='{"success": true}')
+
+    def tearDown(self):
+        httpretty.disable()
+        httpretty.reset()
+
+    def test_get_and_post_go_through_the_pool(self):
+        t = Transport(pool_size=2, retries=0)
+        self.assertEqual(t.get('http://localhost:5338/percy/healthcheck', timeout=1).json(),
+                         {'success': True})
+        t.post('http://localhost:5338/percy/log', json={'message': 'hi'}, timeout=1)
+        self.assertEqual(httpretty.last_request().parsed_body, {'message': 'hi'})
+        t.close()
+
+    def test_sessions_are_per_thread_and_share_one_adapter(self):
+        t = Transport()
+        sessions = []
+        thread = Thread(target=lambda: sessions.append(t.session))
+        thread.start()
+        thread.join()
+
+        self.assertIs(t.session, t.session)
+        self.assertIsNot(sessions[0], t.session)
+        self.assertIs(sessions[0].get_adapter('http://localhost:5338'),
+                      t.session.get_adapter('http://localhost:5338'))
+
+    def test_pool_size_and_retries_are_clamped(self):
+        t = Transport(pool_size=0, retries=-1)
+        self.assertEqual(t.pool_size, 1)
+        self.assertEqual(t.retries, 0)
+        self.assertEqual(t._adapter.max_retries.connect, 0)
+        self.assertEqual(t._adapter.max_retries.read, 0)
+
+    def test_invalid_env_values_fall_back_to_defaults(self):
+        try:
+            with patch.dict(os.environ, {'PERCY_HTTP_POOL_SIZE': 'lots',
+                                         'PERCY_HTTP_RETRIES': '3'}):
+                importlib.reload(transport)
+                self.assertEqual(transport.PERCY_HTTP_POOL_SIZE, 10)
+                self.assertEqual(transport.PERCY_HTTP_RETRIES, 3)
+        finally:
+            importlib.reload(transport)
+
+
+class _ChunkedHandler(BaseHTTPRequestHandler):
+    received = []
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        body = b''
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            if not size:
+                self.rfile.readline()
+                break
+            body += self.rfile.read(size)
+            self.rfile.readline()
+        self.received.append((dict(self.headers), body))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(b'{"success": true}')
+
+    def log_message(self, *_args):  # pylint: disable=arguments-differ
+        pass
+
+
+class TestStreamedJsonBody(unittest.TestCase):
+    PAYLOAD = {'name': 'Home', 'dom_snapshot': [{'html': '<p>caf\u00e9</p>' * 5000}] * 3}
+
+    def test_chunks_decode_to_the_payload(self):
+        chunks = list(iter_json_body(self.PAYLOAD, chunk_size=1024))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(json.loads(b''.join(chunks)), self.PAYLOAD)
+
+    def test_compressed_chunks_form_one_gzip_stream(self):
+        body = b''.join(iter_json_body(self.PAYLOAD, compress=True, chunk_size=1024))
+        self.assertEqual(json.loads(gzip.decompress(body)), self.PAYLOAD)
+        self.assertLess(len(body), len(json.dumps(self.PAYLOAD)))
+
+    def test_raw_json_is_streamed_as_is(self):
+        raw = RawJSON('{"html":"<p>x</p>"}')
+        raw['width'] = 375
+        body = b''.join(iter_json_body({'name': 'Raw', 'dom_snapshot': [raw, raw]},
+                                       chunk_size=8))
+        self.assertEqual(json.loads(body), {'name': 'Raw', 'dom_snapshot': [
+            {'html': '<p>x</p>', 'width': 375}, {'html': '<p>x</p>', 'width': 375}]})
+
+    def test_post_json_stream_sends_a_chunked_body(self):
+        server = HTTPServer(('127.0.0.1', 0), _ChunkedHandler)
+        thread = Thread(target=server.handle_request)
+        thread.start()
+        self.addCleanup(server.server_close)
+        _ChunkedHandler.received = []
+        url = f'http://127.0.0.1:{server.server_port}/percy/snapshot'
+
+        response = Transport().post_json_stream(url, self.PAYLOAD, compress=True, timeout=5)
+        thread.join(5)
+
+        self.assertEqual(response.json(), {'success': True})
+        headers, body = _ChunkedHandler.received[0]
+        self.assertEqual(headers['Transfer-Encoding'], 'chunked')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(gzip.decompress(body)), self.PAYLOAD)
+
+
+class TestGetSetTransport(unittest.TestCase):
+    def tearDown(self):
+        set_transport(None)
+
+    def test_get_transport_is_a_lazy_singleton(self):
+        set_transport(None)
+        self.assertIs(get_transport(), get_transport())
+        self.assertIsInstance(get_transport(), transport.Transport)
+
+    def test_set_transport_swaps_and_returns_previous(self):
+        stub = MagicMock()
+        previous = set_transport(stub)
+        self.assertIs(get_transport(), stub)
+        self.assertIs(set_transport(previous), stub)
+
+
+if __name__ == '__main__':
+    unittest.main()
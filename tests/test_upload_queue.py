@@ -0,0 +1,67 @@
+# pylint: disable=protected-access
+import threading
+import unittest
+from unittest.mock import patch
+
+from percy.upload_queue import UploadQueue
+
+
+class TestUploadQueue(unittest.TestCase):
+    def test_submit_returns_future_with_result(self):
+        uploads = UploadQueue(workers=2)
+        future = uploads.submit(lambda a, b=0: a + b, 1, b=2)
+
+        self.assertEqual(future.result(timeout=5), 3)
+        self.assertTrue(uploads.flush(5))
+        self.assertEqual(uploads.pending(), 0)
+
+    def test_exceptions_are_set_on_the_future(self):
+        def boom():
+            raise ValueError('upload failed')
+
+        future = UploadQueue().submit(boom)
+        with self.assertRaises(ValueError):
+            future.result(timeout=5)
+
+    def test_cancelled_futures_are_skipped(self):
+        release = threading.Event()
+        calls = []
+        uploads = UploadQueue(workers=1)
+        blocker = uploads.submit(release.wait, 5)
+        queued = uploads.submit(calls.append, 'ran')
+
+        self.assertTrue(queued.cancel())
+        release.set()
+        self.assertTrue(uploads.flush(5))
+        self.assertTrue(blocker.result())
+        self.assertEqual(calls, [])
+
+    def test_flush_times_out_while_uploads_are_running(self):
+        release = threading.Event()
+        uploads = UploadQueue(workers=1)
+        uploads.submit(release.wait, 5)
+
+        self.assertFalse(uploads.flush(0.05))
+        release.set()
+        self.assertTrue(uploads.flush(5))
+
+    def test_context_manager_drains_on_exit(self):
+        results = []
+        with UploadQueue(workers=3) as uploads:
+            for i in range(10):
+                uploads.submit(results.append, i)
+        self.assertEqual(sorted(results), list(range(10)))
+
+    @patch('percy.upload_queue.atexit.register')
+    def test_workers_start_once_and_register_exit_drain(self, mock_register):
+        uploads = UploadQueue(workers=2, exit_timeout=30)
+        uploads.submit(lambda: None)
+        uploads.submit(lambda: None)
+
+        self.assertEqual(len(uploads._threads), 2)
+        mock_register.assert_called_once_with(uploads.flush, 30)
+        self.assertTrue(uploads.flush(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
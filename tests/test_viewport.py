@@ -0,0 +1,47 @@
+import unittest
+from unittest.mock import MagicMock
+
+from percy.viewport import ChromiumViewport
+
+
+class TestChromiumViewport(unittest.TestCase):
+    def test_override_is_only_sent_when_the_size_changes(self):
+        driver = MagicMock()
+        viewport = ChromiumViewport(driver)
+
+        self.assertTrue(viewport.resize(375, 800))
+        self.assertFalse(viewport.resize(375, 800))
+        self.assertTrue(viewport.resize(1280, 800))
+
+        self.assertEqual(driver.execute_cdp_cmd.call_count, 2)
+        driver.execute_cdp_cmd.assert_called_with('Emulation.setDeviceMetricsOverride', {
+            'width': 1280, 'height': 800, 'deviceScaleFactor': 1, 'mobile': False})
+        self.assertEqual(viewport.active, (1280, 800))
+
+    def test_clear_removes_the_active_override_once(self):
+        driver = MagicMock()
+        viewport = ChromiumViewport(driver)
+        viewport.clear()
+        driver.execute_cdp_cmd.assert_not_called()
+
+        viewport.resize(375, 800)
+        viewport.clear()
+        viewport.clear()
+
+        driver.execute_cdp_cmd.assert_called_with('Emulation.clearDeviceMetricsOverride', {})
+        self.assertEqual(driver.execute_cdp_cmd.call_count, 2)
+        self.assertIsNone(viewport.active)
+
+    def test_failed_override_keeps_the_previous_state(self):
+        driver = MagicMock()
+        viewport = ChromiumViewport(driver)
+        viewport.resize(375, 800)
+        driver.execute_cdp_cmd.side_effect = Exception('target closed')
+
+        with self.assertRaises(Exception):
+            viewport.resize(1280, 800)
+        self.assertEqual(viewport.active, (375, 800))
+
+
+if __name__ == '__main__':
+    unittest.main()